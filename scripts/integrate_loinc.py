@@ -5,18 +5,36 @@ LOINC 官方資料整合腳本
 """
 
 import argparse
+from contextlib import contextmanager
 from pathlib import Path
 import sqlite3
 import sys
+import time
 
 import pandas as pd
 
+from lab_service import build_loinc_fts
 from utils import log_error
 
 
 class LOINCIntegrator:
     """LOINC 資料整合器"""
 
+    # executemany 每批列數
+    INSERT_CHUNK_SIZE = 20000
+
+    # LOINC CLASS -> 台灣分類
+    CLASS_CATEGORIES = {
+        "CHEM": "生化檢驗",
+        "HEM/BC": "血液常規",
+        "COAG": "凝血功能",
+        "SERO": "血清學",
+        "MICRO": "微生物學",
+        "DRUG/TOX": "藥物/毒物",
+        "H&P.HX.LAB": "病史與理學檢查",
+    }
+    DEFAULT_CATEGORY = "其他檢驗"
+
     def __init__(self, project_root):
         self.project_root = Path(project_root)
         self.data_dir = self.project_root / "data"
@@ -25,6 +43,18 @@ class LOINCIntegrator:
         # 輸出資料庫
         self.output_db = self.data_dir / "lab_tests.db"
 
+        # 各階段耗時（秒）
+        self.timings = {}
+
+    @contextmanager
+    def timed(self, stage):
+        """記錄階段耗時"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] = self.timings.get(stage, 0.0) + time.perf_counter() - started
+
     def check_loinc_file(self):
         """檢查 LOINC 官方檔案是否存在"""
         loinc_file = self.loinc_official_dir / "Loinc.csv"
@@ -130,15 +160,17 @@ class LOINCIntegrator:
             loinc_df["name_zh"] = None
             loinc_df["common_name_zh"] = None
 
-        # 5. 如果對照表沒有，從參考值資料補充
+        # 5. 如果對照表沒有，從參考值資料補充（每個 LOINC 碼取第一個中文名稱，一次 map 完成）
         if not ref_df.empty:
-            for _, row in (
-                ref_df[["loinc_code", "test_name_zh"]].drop_duplicates().iterrows()
-            ):
-                mask = (loinc_df["LOINC_NUM"] == row["loinc_code"]) & (
-                    loinc_df["name_zh"].isna()
-                )
-                loinc_df.loc[mask, "name_zh"] = row["test_name_zh"]
+            ref_names = (
+                ref_df[["loinc_code", "test_name_zh"]]
+                .dropna(subset=["test_name_zh"])
+                .drop_duplicates(subset="loinc_code")
+                .set_index("loinc_code")["test_name_zh"]
+            )
+            loinc_df["name_zh"] = loinc_df["name_zh"].fillna(
+                loinc_df["LOINC_NUM"].map(ref_names)
+            )
 
         print(f"   有中文名稱: {loinc_df['name_zh'].notna().sum()} 項")
 
@@ -156,6 +188,12 @@ class LOINCIntegrator:
         conn = sqlite3.connect(self.output_db)
         cursor = conn.cursor()
 
+        # 全新建立的資料庫失敗時會整個重建，可關閉日誌與同步寫入以加速大量匯入
+        cursor.execute("PRAGMA journal_mode = OFF")
+        cursor.execute("PRAGMA synchronous = OFF")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+        cursor.execute("PRAGMA cache_size = -65536")
+
         try:
             # 1. 建立 LOINC 對照表
             print("   建立 loinc_mapping 表...")
@@ -178,51 +216,21 @@ class LOINCIntegrator:
             """
             )
 
-            # 2. 插入 LOINC 資料
+            # 2. 插入 LOINC 資料（欄位先向量化轉換，再分批 executemany）
             print("   插入 LOINC 資料...")
             insert_count = 0
-
-            for _, row in merged_df.iterrows():
-                # 決定分類
-                category = self._map_class_to_category(row.get("CLASS", ""))
-
-                # 決定檢體類型
-                specimen = row.get("SYSTEM", "")
-
-                # 決定單位
-                unit = row.get("EXAMPLE_UNITS", "")
-
-                # 決定方法
-                method = row.get("METHOD_TYP", "")
-
-                cursor.execute(
+            for chunk in self._chunks(self._loinc_rows(merged_df)):
+                cursor.executemany(
                     """
                     INSERT OR IGNORE INTO loinc_mapping
                     (loinc_code, loinc_name_en, loinc_name_zh, common_name_zh,
                      category, specimen_type, unit, method, is_taiwan_common, common_test_rank)
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
-                    (
-                        row["LOINC_NUM"],
-                        row.get("LONG_COMMON_NAME", ""),
-                        row.get("name_zh"),
-                        row.get("common_name_zh"),
-                        category,
-                        specimen,
-                        unit,
-                        method,
-                        1 if row.get("is_taiwan_common") else 0,
-                        (
-                            int(row["COMMON_TEST_RANK"])
-                            if pd.notna(row.get("COMMON_TEST_RANK"))
-                            else None
-                        ),
-                    ),
+                    chunk,
                 )
-                insert_count += 1
-
-                if insert_count % 10000 == 0:
-                    print(f"   已插入 {insert_count:,} 項...")
+                insert_count += len(chunk)
+                print(f"   已插入 {insert_count:,} 項...")
 
             print(f"✅ 插入完成: {insert_count:,} 項")
 
@@ -249,27 +257,33 @@ class LOINCIntegrator:
             # 4. 插入參考值
             if not ref_df.empty:
                 print(f"   插入參考值: {len(ref_df)} 筆...")
-                for _, row in ref_df.iterrows():
-                    cursor.execute(
-                        """
-                        INSERT INTO reference_ranges
-                        (loinc_code, age_min, age_max, gender, range_low, range_high, unit, interpretation)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                        (
-                            row["loinc_code"],
-                            row["age_min"],
-                            row["age_max"],
-                            row["gender"],
-                            row["range_low"],
-                            row["range_high"],
-                            row["unit"],
-                            row.get("interpretation", ""),
-                        ),
-                    )
+                if "interpretation" not in ref_df.columns:
+                    ref_df = ref_df.assign(interpretation="")
+                ref_rows = self._to_records(
+                    ref_df[
+                        [
+                            "loinc_code",
+                            "age_min",
+                            "age_max",
+                            "gender",
+                            "range_low",
+                            "range_high",
+                            "unit",
+                            "interpretation",
+                        ]
+                    ]
+                )
+                cursor.executemany(
+                    """
+                    INSERT INTO reference_ranges
+                    (loinc_code, age_min, age_max, gender, range_low, range_high, unit, interpretation)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                    ref_rows,
+                )
                 print(f"✅ 參考值插入完成")
 
-            # 5. 建立索引
+            # 5. 建立索引（資料全部寫入後才建立，避免插入時逐列維護索引）
             print("   建立索引...")
             indices = [
                 "CREATE INDEX IF NOT EXISTS idx_loinc_code ON loinc_mapping(loinc_code)",
@@ -285,6 +299,11 @@ class LOINCIntegrator:
 
             conn.commit()
 
+            # 6. 建立全文檢索索引（search_loinc_code 使用）
+            print("   建立全文檢索索引...")
+            if build_loinc_fts(conn):
+                print("✅ 全文檢索索引建立完成")
+
         except Exception as e:
             log_error(f"建立資料庫失敗: {e}")
             conn.rollback()
@@ -292,18 +311,51 @@ class LOINCIntegrator:
         finally:
             conn.close()
 
+    def _loinc_rows(self, merged_df):
+        """將合併後的 DataFrame 一次轉為 loinc_mapping 的插入列"""
+        frame = pd.DataFrame(
+            {
+                "loinc_code": merged_df["LOINC_NUM"],
+                "loinc_name_en": merged_df.get("LONG_COMMON_NAME"),
+                "loinc_name_zh": merged_df.get("name_zh"),
+                "common_name_zh": merged_df.get("common_name_zh"),
+                "category": merged_df.get("CLASS", pd.Series(index=merged_df.index))
+                .map(self.CLASS_CATEGORIES)
+                .fillna(self.DEFAULT_CATEGORY),
+                "specimen_type": merged_df.get("SYSTEM"),
+                "unit": merged_df.get("EXAMPLE_UNITS"),
+                "method": merged_df.get("METHOD_TYP"),
+                "is_taiwan_common": merged_df["is_taiwan_common"].fillna(False).astype(int),
+                "common_test_rank": pd.to_numeric(
+                    merged_df.get("COMMON_TEST_RANK"), errors="coerce"
+                ).astype("Int64"),
+            }
+        )
+        return self._to_records(frame)
+
+    @staticmethod
+    def _to_records(frame):
+        """DataFrame -> tuple 列表（NaN / NA 轉為 None，numpy 數值轉為 Python 型別）"""
+        frame = frame.astype(object).where(frame.notna(), None)
+        return [
+            tuple(v.item() if hasattr(v, "item") else v for v in row)
+            for row in frame.itertuples(index=False, name=None)
+        ]
+
+    def _chunks(self, rows):
+        for start in range(0, len(rows), self.INSERT_CHUNK_SIZE):
+            yield rows[start : start + self.INSERT_CHUNK_SIZE]
+
+    def print_timing_report(self):
+        """印出各階段耗時"""
+        print("\n⏱️  耗時統計:")
+        for stage, seconds in self.timings.items():
+            print(f"   {stage}: {seconds:.2f} 秒")
+        print(f"   總計: {sum(self.timings.values()):.2f} 秒")
+
     def _map_class_to_category(self, loinc_class):
         """將 LOINC CLASS 對應到台灣分類"""
-        mapping = {
-            "CHEM": "生化檢驗",
-            "HEM/BC": "血液常規",
-            "COAG": "凝血功能",
-            "SERO": "血清學",
-            "MICRO": "微生物學",
-            "DRUG/TOX": "藥物/毒物",
-            "H&P.HX.LAB": "病史與理學檢查",
-        }
-        return mapping.get(loinc_class, "其他檢驗")
+        return self.CLASS_CATEGORIES.get(loinc_class, self.DEFAULT_CATEGORY)
 
     def print_summary(self):
         """印出整合摘要"""
@@ -377,21 +429,25 @@ def main():
             return 1
 
     # 2. 載入資料
-    loinc_df = integrator.load_loinc_official()
-    if loinc_df is None:
-        return 1
+    with integrator.timed("載入資料"):
+        loinc_df = integrator.load_loinc_official()
+        if loinc_df is None:
+            return 1
 
-    mapping_df = integrator.load_taiwan_mapping()
-    ref_df = integrator.load_taiwan_reference_ranges()
+        mapping_df = integrator.load_taiwan_mapping()
+        ref_df = integrator.load_taiwan_reference_ranges()
 
     # 3. 合併資料
-    merged_df = integrator.merge_data(loinc_df, mapping_df, ref_df)
+    with integrator.timed("合併資料"):
+        merged_df = integrator.merge_data(loinc_df, mapping_df, ref_df)
 
     # 4. 建立資料庫
-    integrator.create_database(merged_df, ref_df)
+    with integrator.timed("建立資料庫"):
+        integrator.create_database(merged_df, ref_df)
 
     # 5. 印出摘要
     integrator.print_summary()
+    integrator.print_timing_report()
 
     print("✅ 整合完成！")
     print("\n下一步:")
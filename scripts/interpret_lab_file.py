@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+大量檢驗結果檔案判讀腳本
+串流讀取 CSV / NDJSON 檢驗結果並輸出判讀後的 NDJSON（適用於回溯性品質稽核）
+
+輸入欄位: patient_id, age, gender, loinc_code, value, unit
+"""
+
+import argparse
+import json
+from pathlib import Path
+import sys
+
+src_dir = Path(__file__).resolve().parent.parent / "src"
+if str(src_dir) not in sys.path:
+    sys.path.insert(0, str(src_dir))
+
+from lab_pipeline import run_pipeline  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批次判讀檢驗結果檔案（CSV / NDJSON）")
+    parser.add_argument("input", help="輸入檔案（.csv 或 .ndjson）")
+    parser.add_argument("-o", "--output", default="-", help="輸出 NDJSON 檔案（預設為標準輸出）")
+    parser.add_argument(
+        "--data-dir",
+        default=str(Path(__file__).resolve().parent.parent / "data"),
+        help="lab_tests.db 所在目錄",
+    )
+    parser.add_argument("--chunk-size", type=int, default=5000, help="每個區塊的列數")
+    parser.add_argument("--workers", type=int, default=1, help="worker 程序數")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="輸入格式（預設自動判斷）")
+
+    args = parser.parse_args()
+
+    summary = run_pipeline(
+        args.input,
+        args.output,
+        args.data_dir,
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+        file_format=args.format,
+    )
+    sys.stderr.write(json.dumps(summary, ensure_ascii=False) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"""
+Autocomplete Service - 即時輸入建議
+以預先排序的前綴索引（bisect）提供 ICD、LOINC、藥品名稱的逐字建議
+"""
+
+from bisect import bisect_left
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from fuzzy_search import normalize_code, normalize_text
+from utils import log_error, log_info
+
+# Seconds between source database mtime checks (queries arrive on every keystroke)
+MTIME_CHECK_INTERVAL = 5.0
+
+# A name word starts after whitespace or punctuation ('insulin' in 'human insulin',
+# '未伴有併發症' in '第二型糖尿病，未伴有併發症')
+_WORD_RE = re.compile(r"(?<=[^\w])\w+")
+_FIRST_WORD_RE = re.compile(r"\w+")
+
+
+def word_starts(key: str) -> List[tuple]:
+    """
+    正規化名稱中第 2 個以後各詞的 (詞, 在名稱中的起始位置)（整串前綴另外索引）；
+    只存詞本身與位置，不複製每個詞之後的整段後綴
+    """
+    return [(m.group(), m.start()) for m in _WORD_RE.finditer(key)]
+
+
+class AutocompleteService:
+    """
+    自動完成服務
+    - 每個領域（icd / loinc / drug）各有一組排序後的 (key, entry) 陣列，
+      另有名稱中各詞的 (詞, 名稱鍵, 位置, entry) 陣列，整串前綴符合者排在前面
+    - 查詢以 bisect 定位前綴起點後線性取出，完全在記憶體中完成
+    - 來源資料庫檔案更新（mtime 變動）時自動重建該領域索引；mtime 每 MTIME_CHECK_INTERVAL 秒最多檢查一次。
+      索引在鎖外建立後整個替換，建立期間查詢使用舊索引（首次建立時該領域暫無建議）
+    """
+
+    DOMAINS = ("icd", "loinc", "drug")
+
+    def __init__(self, icd_service=None, lab_service=None, drug_service=None):
+        self.icd_service = icd_service
+        self.lab_service = lab_service
+        self.drug_service = drug_service
+
+        # domain -> {"keys", "entries", "word_keys", "word_sources", "word_entries",
+        #            "mtime", "checked_at"}; replaced as a whole, never mutated in place
+        self._indexes: Dict[str, Dict] = {}
+        # Domains whose index is being built; guarded by _lock
+        self._building = set()
+        self._lock = threading.Lock()
+
+        # Build in the background so server startup is not blocked
+        threading.Thread(target=self._warm_up, daemon=True).start()
+
+    def _warm_up(self):
+        for domain in self.DOMAINS:
+            self._get_index(domain)
+
+    # ==========================================
+    # 索引建立
+    # ==========================================
+
+    def _get_source(self, domain: str):
+        return {
+            "icd": self.icd_service,
+            "loinc": self.lab_service,
+            "drug": self.drug_service,
+        }.get(domain)
+
+    def _get_index(self, domain: str) -> Optional[Dict]:
+        """取得（必要時重建）領域索引"""
+        service = self._get_source(domain)
+        if service is None:
+            return None
+        index = self._indexes.get(domain)
+        now = time.monotonic()
+        if index is not None and now - index["checked_at"] < MTIME_CHECK_INTERVAL:
+            return index
+        if not os.path.exists(service.db_path):
+            return None
+
+        mtime = os.path.getmtime(service.db_path)
+        if index is not None and index["mtime"] == mtime:
+            with self._lock:
+                # Skip if a rebuild swapped in a newer index meanwhile
+                if self._indexes.get(domain) is index:
+                    self._indexes[domain] = {**index, "checked_at": now}
+            return index
+
+        # Only one thread builds a domain; others keep using the previous index
+        with self._lock:
+            index = self._indexes.get(domain)
+            if domain in self._building or (index is not None and index["mtime"] == mtime):
+                return index
+            self._building.add(domain)
+
+        try:
+            pairs, word_pairs = self._load_pairs(domain, service)
+            pairs.sort(key=lambda pair: pair[0])
+            word_pairs.sort(key=lambda item: item[0])
+            index = {
+                "keys": [key for key, _ in pairs],
+                "entries": [entry for _, entry in pairs],
+                "word_keys": [word for word, *_ in word_pairs],
+                "word_sources": [(key, offset) for _, key, offset, _ in word_pairs],
+                "word_entries": [entry for *_, entry in word_pairs],
+                "mtime": mtime,
+                "checked_at": time.monotonic(),
+            }
+            self._indexes[domain] = index
+            log_info(
+                f"Built autocomplete index for {domain}: "
+                f"{len(pairs)} keys, {len(word_pairs)} word keys"
+            )
+            return index
+        except Exception as e:
+            log_error(f"Failed to build autocomplete index for {domain}: {e}")
+            return self._indexes.get(domain)
+        finally:
+            with self._lock:
+                self._building.discard(domain)
+
+    def _load_pairs(self, domain: str, service) -> tuple:
+        """
+        讀取來源資料，產生 (正規化前綴鍵, 建議項目) 配對
+
+        Returns:
+            (整串前綴配對 (key, entry), 名稱各詞配對 (詞, 名稱鍵, 詞的起始位置, entry))
+        """
+        pairs, word_pairs = [], []
+
+        def add(key: str, entry: dict):
+            if key:
+                pairs.append((key, entry))
+
+        def add_name(name: str, entry: dict):
+            key = normalize_text(name)
+            add(key, entry)
+            word_pairs.extend((word, key, offset, entry) for word, offset in word_starts(key))
+
+        if domain == "icd":
+            for table, code_type in (("diagnoses", "diagnosis"), ("procedures", "procedure")):
+                rows = service._query_db(f"SELECT code, name_zh, name_en FROM {table}")
+                for row in rows:
+                    entry = {"domain": "icd", "type": code_type, **row}
+                    add(normalize_text(row["code"]), entry)
+                    if "." in str(row["code"]):
+                        add(normalize_code(row["code"]), entry)
+                    add_name(row["name_zh"], entry)
+                    add_name(row["name_en"], entry)
+
+        elif domain == "loinc":
+            rows = service._query_db(
+                "SELECT loinc_code, loinc_name_zh, loinc_name_en, common_name_zh FROM loinc_mapping"
+            )
+            for row in rows:
+                entry = {"domain": "loinc", **row}
+                add(normalize_text(row["loinc_code"]), entry)
+                add_name(row["loinc_name_zh"], entry)
+                add_name(row["loinc_name_en"], entry)
+                # Abbreviations are stored comma-separated, e.g. 'ALT, GPT'
+                for alias in str(row["common_name_zh"] or "").split(","):
+                    add(normalize_text(alias), entry)
+
+        elif domain == "drug":
+            conn = sqlite3.connect(service.db_path)
+            try:
+                rows = conn.execute(
+                    "SELECT DISTINCT license_id, name_zh, name_en FROM licenses"
+                ).fetchall()
+            finally:
+                conn.close()
+            for license_id, name_zh, name_en in rows:
+                entry = {
+                    "domain": "drug",
+                    "license_id": license_id,
+                    "name_zh": name_zh,
+                    "name_en": name_en,
+                }
+                add_name(name_zh, entry)
+                add_name(name_en, entry)
+
+        return pairs, word_pairs
+
+    # ==========================================
+    # 查詢
+    # ==========================================
+
+    def suggest(self, prefix: str, domain: str = "all", limit: int = 10) -> List[Dict]:
+        """
+        回傳符合前綴的建議（list of dict），供程式內部或 HTTP 介面直接使用
+
+        Args:
+            prefix: 使用者已輸入的字串
+            domain: "icd" / "loinc" / "drug" / "all"
+            limit: 每個領域的最大建議數
+        """
+        key = normalize_text(prefix)
+        if not key:
+            return []
+
+        domains = self.DOMAINS if domain == "all" else (domain,)
+        suggestions = []
+        for name in domains:
+            index = self._get_index(name)
+            if index is None:
+                continue
+            seen = set()
+
+            def collect(entry):
+                if id(entry) not in seen:
+                    seen.add(id(entry))
+                    suggestions.append(entry)
+
+            # Whole-name / code prefixes first
+            keys, entries = index["keys"], index["entries"]
+            i = bisect_left(keys, key)
+            while i < len(keys) and keys[i].startswith(key) and len(seen) < limit:
+                collect(entries[i])
+                i += 1
+
+            # Then matches starting at a later word of the name. A multi-word prefix
+            # ('human ins') needs its first word to be a whole name word, checked
+            # against the rest of the name from that word's position.
+            first = _FIRST_WORD_RE.match(key)
+            if first is None:
+                continue
+            word = first.group()
+            words, sources = index["word_keys"], index["word_sources"]
+            entries = index["word_entries"]
+            i = bisect_left(words, word)
+            while i < len(words) and len(seen) < limit:
+                if word == key:
+                    if not words[i].startswith(key):
+                        break
+                    collect(entries[i])
+                else:
+                    if words[i] != word:
+                        break
+                    name, offset = sources[i]
+                    if name.startswith(key, offset):
+                        collect(entries[i])
+                i += 1
+        return suggestions
+
+    def autocomplete(self, prefix: str, domain: str = "all", limit: int = 10) -> str:
+        """自動完成（JSON 格式）"""
+        if domain != "all" and domain not in self.DOMAINS:
+            return json.dumps(
+                {"error": f"Unknown domain '{domain}'", "domains": list(self.DOMAINS)},
+                ensure_ascii=False,
+            )
+        suggestions = self.suggest(prefix, domain, limit)
+        return json.dumps(
+            {"prefix": prefix, "total_found": len(suggestions), "suggestions": suggestions},
+            ensure_ascii=False,
+        )
@@ -2,15 +2,223 @@ from datetime import datetime, timedelta
 import io
 import json
 import os
+import re
 import sqlite3
 import threading
 import zipfile
 
 from apscheduler.schedulers.background import BackgroundScheduler
+import numpy as np
 import requests
 
+from food_resolver import FoodResolver, alias_variants
+from fuzzy_search import NGramIndex
+from meal_optimizer import (
+    STATUS_ITERATION_LIMIT,
+    STATUS_OPTIMAL,
+    STATUS_TIME_LIMIT,
+    evaluate_targets,
+    solve_portions,
+)
+from nutrient_matrix import (
+    FOOD_FIELDS,
+    parse_number,
+    RANK_BASES,
+    SIMILARITY_METRICS,
+    NutrientMatrix,
+)
+from recipe_engine import compute_recipes, parse_quantity, parse_servings, to_grams
 from utils import log_error, log_info
 
+# Numeric columns of the downloaded datasets; every other column is TEXT
+NUMERIC_COLUMNS = {
+    "nutrition": {
+        "waste_rate": "REAL",
+        "content_per_100g": "REAL",
+        "sample_count": "INTEGER",
+        "std_deviation": "REAL",
+        "content_per_unit": "REAL",
+        "unit_weight": "REAL",
+        "unit_weight_content": "REAL",
+    },
+}
+
+# Placeholders the datasets use for "no value"; stored as NULL without counting as failures
+_EMPTY_VALUES = {"", "-", "--", "—", "N/A", "NA"}
+
+# STRICT tables need SQLite 3.37+
+_STRICT = " STRICT" if sqlite3.sqlite_version_info >= (3, 37, 0) else ""
+
+# food_ingredients has no structured restriction column, only the free-text 備註; notes that
+# match neither rule are reported as "unknown" together with the raw text
+_UNRESTRICTED_NOTE_RE = re.compile(r"^(?:無|-|—|/)?$|^(?:無|未|不)(?:使用)?限(?:制)?$")
+_RESTRICTED_NOTE_RE = re.compile(r"限|僅|不得|禁|須|需|應|每日|不超過|以下|孕|嬰")
+
+
+def _restriction_status(note) -> str:
+    """備註的使用限制狀態：approved（無限制）、restricted、unknown（規則無法判斷）"""
+    text = re.sub(r"[\s。.，,；;]", "", str(note or ""))
+    if _UNRESTRICTED_NOTE_RE.match(text):
+        return "approved"
+    if _RESTRICTED_NOTE_RE.search(text):
+        return "restricted"
+    return "unknown"
+
+
+def _coerce_number(raw, sql_type: str):
+    """
+    將資料集的數值字串轉為 REAL / INTEGER
+
+    Returns:
+        (value, failed)：無法直接轉換時以寬鬆解析（取第一個數字）保留數值並標記 failed
+    """
+    if raw is None:
+        return None, False
+    text = str(raw).strip().replace(",", "")
+    if text in _EMPTY_VALUES:
+        return None, False
+    try:
+        value = float(text)
+    except ValueError:
+        value = parse_number(text)
+        value = None if value != value else value  # NaN -> NULL
+        failed = True
+    else:
+        failed = False
+    if value is not None and sql_type == "INTEGER":
+        if value.is_integer():
+            value = int(value)
+        else:
+            value, failed = round(value), True
+    return value, failed
+
+
+# Nutrients reported per serving by analyze_recipes unless others are requested
+RECIPE_SUMMARY_NUTRIENTS = [
+    ("熱量", ["修正熱量", "熱量"]),
+    ("蛋白質", ["粗蛋白"]),
+    ("脂肪", ["粗脂肪"]),
+    ("飽和脂肪", ["飽和脂肪"]),
+    ("碳水化合物", ["總碳水化合物"]),
+    ("糖", ["糖質總量"]),
+    ("膳食纖維", ["膳食纖維"]),
+    ("鈉", ["鈉"]),
+]
+
+# Columns of the food_ingredients FTS5 index with their bm25 weights (names rank above notes)
+INGREDIENT_FTS_COLUMNS = [
+    ("name_zh", 10.0),
+    ("name_en", 5.0),
+    ("scientific_name", 5.0),
+    ("major_category", 2.0),
+    ("sub_category", 2.0),
+    ("note", 1.0),
+    ("regulation_note", 1.0),
+]
+
+# The trigram tokenizer cannot match queries shorter than three characters
+FTS_MIN_QUERY_LENGTH = 3
+
+
+# Macronutrients as (key, candidate nutrient names in the TFDA dataset, kcal per gram)
+MACRONUTRIENTS = [
+    ("energy", ["修正熱量", "熱量"], None),
+    ("protein", ["粗蛋白"], 4),
+    ("fat", ["粗脂肪"], 9),
+    ("carbohydrate", ["總碳水化合物"], 4),
+]
+
+# Taiwan daily reference values (每日參考值) used for %DRI, as (label, candidates, amount, unit)
+DAILY_REFERENCE_VALUES = [
+    ("熱量", ["修正熱量", "熱量"], 2000, "kcal"),
+    ("蛋白質", ["粗蛋白"], 60, "g"),
+    ("脂肪", ["粗脂肪"], 60, "g"),
+    ("飽和脂肪", ["飽和脂肪"], 18, "g"),
+    ("碳水化合物", ["總碳水化合物"], 300, "g"),
+    ("膳食纖維", ["膳食纖維"], 25, "g"),
+    ("鈉", ["鈉"], 2000, "mg"),
+    ("鈣", ["鈣"], 1200, "mg"),
+    ("鐵", ["鐵"], 15, "mg"),
+    ("鎂", ["鎂"], 390, "mg"),
+    ("鋅", ["鋅"], 15, "mg"),
+    ("磷", ["磷"], 1000, "mg"),
+    ("維生素C", ["維生素C"], 100, "mg"),
+    ("維生素B1", ["維生素B1"], 1.2, "mg"),
+    ("維生素B2", ["維生素B2"], 1.3, "mg"),
+    ("維生素B6", ["維生素B6"], 1.6, "mg"),
+    ("維生素B12", ["維生素B12"], 2.4, "ug"),
+    ("菸鹼素", ["菸鹼素"], 16, "mg"),
+    ("葉酸", ["葉酸"], 400, "ug"),
+]
+
+# Structured daily diet targets per ICD-10 category for the meal-plan optimizer,
+# as {code: (name, [(label, candidates, min, max)])}; None means no bound.
+# Quantified from the dietary advice in HealthFoodService._get_dietary_suggestions.
+DIET_TARGETS = {
+    "default": (
+        "一般均衡飲食",
+        [
+            ("熱量", ["修正熱量", "熱量"], 1800, 2200),
+            ("蛋白質", ["粗蛋白"], 60, None),
+            ("脂肪", ["粗脂肪"], None, 65),
+            ("飽和脂肪", ["飽和脂肪"], None, 20),
+            ("膳食纖維", ["膳食纖維"], 25, None),
+            ("鈉", ["鈉"], None, 2400),
+        ],
+    ),
+    "E11": (
+        "第二型糖尿病飲食",
+        [
+            ("熱量", ["修正熱量", "熱量"], 1500, 1800),
+            ("碳水化合物", ["總碳水化合物"], 130, 200),
+            ("糖", ["糖質總量"], None, 25),
+            ("蛋白質", ["粗蛋白"], 60, None),
+            ("飽和脂肪", ["飽和脂肪"], None, 15),
+            ("膳食纖維", ["膳食纖維"], 25, None),
+            ("鈉", ["鈉"], None, 2300),
+        ],
+    ),
+    "I10": (
+        "高血壓得舒飲食（DASH）",
+        [
+            ("熱量", ["修正熱量", "熱量"], 1800, 2200),
+            ("鈉", ["鈉"], None, 1500),
+            ("鉀", ["鉀"], 4700, None),
+            ("鈣", ["鈣"], 1000, None),
+            ("鎂", ["鎂"], 400, None),
+            ("膳食纖維", ["膳食纖維"], 30, None),
+            ("飽和脂肪", ["飽和脂肪"], None, 13),
+        ],
+    ),
+    "E78": (
+        "高血脂飲食",
+        [
+            ("熱量", ["修正熱量", "熱量"], 1800, 2200),
+            ("飽和脂肪", ["飽和脂肪"], None, 13),
+            ("膽固醇", ["膽固醇"], None, 200),
+            ("膳食纖維", ["膳食纖維"], 25, None),
+            ("蛋白質", ["粗蛋白"], 60, None),
+        ],
+    ),
+    "E66": (
+        "體重控制飲食",
+        [
+            ("熱量", ["修正熱量", "熱量"], 1200, 1500),
+            ("蛋白質", ["粗蛋白"], 60, None),
+            ("脂肪", ["粗脂肪"], None, 50),
+            ("膳食纖維", ["膳食纖維"], 25, None),
+            ("糖", ["糖質總量"], None, 25),
+        ],
+    ),
+}
+DIET_TARGETS["E10"] = DIET_TARGETS["E11"]
+
+# Message attached to optimize_meal_plan results that did not reach the optimum
+SOLVER_STATUS_MESSAGES = {
+    STATUS_TIME_LIMIT: "求解時間已達上限，回傳目前最佳的可行份量。",
+    STATUS_ITERATION_LIMIT: "求解迭代次數已達上限，回傳目前最佳的可行份量。",
+}
+
 
 class FoodNutritionService:
     """
@@ -23,6 +231,20 @@ class FoodNutritionService:
         self.db_path = os.path.join(data_dir, "food_nutrition.db")
         self.meta_path = os.path.join(data_dir, "food_nutrition_meta.json")
 
+        # Dense foods x nutrients matrix derived from the nutrition table; the vocab JSON is
+        # written last on each save and names the matrix version to load
+        self.matrix_path = os.path.join(data_dir, "food_nutrition_matrix.npy")
+        self.matrix_vocab_path = os.path.join(data_dir, "food_nutrition_matrix.json")
+        self._matrix = None
+        self._matrix_mtime = None
+        self._matrix_lock = threading.Lock()
+        # Alias dictionary over the matrix foods, rebuilt whenever the matrix reloads
+        self._resolver = None
+        self._fts_checked = False
+        # In-memory ingredient name index for batch compliance checks
+        self._ingredient_index = None
+        self._ingredient_lock = threading.Lock()
+
         # Define API Sources for Food Nutrition Data
         # 20: Food Nutrition Dataset (食品營養成分資料集)
         # 4: Food Ingredients Platform Dataset (食品原料整合查詢平臺資料集)
@@ -80,9 +302,12 @@ class FoodNutritionService:
             t = threading.Thread(target=self._update_all_data)
             t.start()
 
-    def _download_and_insert(self, url, table_name, conn, columns_map):
+    def _download_and_insert(self, url, table_name, conn, columns_map, commit=True):
         """
         Generic helper to download JSON (or ZIP containing JSON) and insert into SQLite.
+        The table is dropped and reloaded inside one transaction; with commit=False it is left
+        open so the caller can rebuild dependent indexes before readers see the new rows.
+        Returns True once the rows are inserted, False (rolled back) otherwise.
         """
         log_info(f"Downloading {table_name} data from {url}...")
         try:
@@ -91,7 +316,7 @@ class FoodNutritionService:
                 log_error(
                     f"Failed to download {table_name}: HTTP {response.status_code}"
                 )
-                return
+                return False
 
             # Check if response is a ZIP file
             content_type = response.headers.get("Content-Type", "")
@@ -101,19 +326,31 @@ class FoodNutritionService:
                 json_files = [f for f in zip_file.namelist() if f.endswith(".json")]
                 if not json_files:
                     log_error(f"No JSON file found in ZIP for {table_name}")
-                    return
+                    return False
                 with zip_file.open(json_files[0]) as json_file:
                     data = json.load(json_file)
             else:
                 data = response.json()
 
-            cursor = conn.cursor()
-
-            # Create Table
             cols = list(columns_map.keys())
-            col_defs = [f"{c} TEXT" for c in cols]
-            cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
-            cursor.execute(f"CREATE TABLE {table_name} ({', '.join(col_defs)})")
+            numeric = NUMERIC_COLUMNS.get(table_name, {})
+
+            # Process Data
+            rows_to_insert = []
+            failures = {}  # (column, raw value) -> occurrences
+            for item in data:
+                row = []
+                for db_col, json_key in columns_map.items():
+                    raw = item.get(json_key)
+                    if db_col in numeric:
+                        value, failed = _coerce_number(raw, numeric[db_col])
+                        if failed:
+                            key = (db_col, str(raw))
+                            failures[key] = failures.get(key, 0) + 1
+                        row.append(value)
+                    else:
+                        row.append(str(raw) if raw is not None else "")
+                rows_to_insert.append(tuple(row))
 
             # Prepare Insert Statement
             placeholders = ", ".join(["?" for _ in cols])
@@ -121,27 +358,49 @@ class FoodNutritionService:
                 f"INSERT INTO {table_name} ({', '.join(cols)}) VALUES ({placeholders})"
             )
 
-            # Process Data
-            rows_to_insert = []
-            for item in data:
-                row = [
-                    (
-                        str(item.get(json_key, ""))
-                        if item.get(json_key) is not None
-                        else ""
-                    )
-                    for db_col, json_key in columns_map.items()
-                ]
-                rows_to_insert.append(tuple(row))
-
-            # Bulk Insert
+            # Recreate Table (typed, STRICT so numeric columns never hold strings) and bulk
+            # insert in one transaction; an explicit BEGIN keeps the DDL out of autocommit
+            cursor = conn.cursor()
+            col_defs = [f"{c} {numeric.get(c, 'TEXT')}" for c in cols]
+            cursor.execute("BEGIN")
+            cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+            cursor.execute(f"CREATE TABLE {table_name} ({', '.join(col_defs)}){_STRICT}")
             cursor.executemany(insert_sql, rows_to_insert)
-            conn.commit()
+            self._record_parse_failures(cursor, table_name, failures)
+            if commit:
+                conn.commit()
 
             log_info(f"Updated {table_name}: {len(rows_to_insert)} rows.")
+            if failures:
+                log_info(
+                    f"{table_name}: {sum(failures.values())} numeric values needed lenient "
+                    f"parsing ({len(failures)} distinct), see parse_failures table"
+                )
+
+            return True
 
         except Exception as e:
             log_error(f"Failed to update {table_name}: {e}")
+            conn.rollback()
+            return False
+
+    def _record_parse_failures(self, cursor, table_name: str, failures: dict):
+        """Replaces the table's rows in parse_failures with this download's failures."""
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS parse_failures (
+                table_name TEXT NOT NULL,
+                column_name TEXT NOT NULL,
+                raw_value TEXT NOT NULL,
+                occurrences INTEGER NOT NULL
+            ){_STRICT}
+            """
+        )
+        cursor.execute("DELETE FROM parse_failures WHERE table_name = ?", (table_name,))
+        cursor.executemany(
+            "INSERT INTO parse_failures VALUES (?, ?, ?, ?)",
+            [(table_name, col, raw, count) for (col, raw), count in failures.items()],
+        )
 
     def _update_all_data(self):
         """Main ETL process to update food nutrition datasets."""
@@ -175,8 +434,9 @@ class FoodNutritionService:
                 },
             )
 
-            # 2. Food Ingredients Platform Dataset (ID 4)
-            self._download_and_insert(
+            # 2. Food Ingredients Platform Dataset (ID 4); the reload, its indexes and the FTS
+            # rebuild commit together so searches never see the table without its index
+            ingredients_loaded = self._download_and_insert(
                 self.API_SOURCES["ingredients"],
                 "food_ingredients",
                 conn,
@@ -190,7 +450,21 @@ class FoodNutritionService:
                     "part": "部位",
                     "note": "備註",
                 },
+                commit=False,
             )
+            if ingredients_loaded:
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_ingredients_name ON food_ingredients(name_zh)"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_ingredients_category "
+                    "ON food_ingredients(major_category)"
+                )
+                # Full-text index over ingredient names and regulatory notes
+                self._build_ingredients_fts(conn)
+                conn.commit()
+                with self._ingredient_lock:
+                    self._ingredient_index = None
 
             # Create useful indexes
             cursor = conn.cursor()
@@ -201,13 +475,18 @@ class FoodNutritionService:
                 "CREATE INDEX IF NOT EXISTS idx_nutrition_category ON nutrition(food_category)"
             )
             cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_ingredients_name ON food_ingredients(name_zh)"
+                "CREATE INDEX IF NOT EXISTS idx_nutrition_food_item "
+                "ON nutrition(integration_number, nutrient_item)"
             )
             cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_ingredients_category ON food_ingredients(major_category)"
+                "CREATE INDEX IF NOT EXISTS idx_nutrition_item_content "
+                "ON nutrition(nutrient_item, content_per_100g)"
             )
             conn.commit()
 
+            # Pivot the long-format nutrition table into the dense matrix
+            self._build_nutrient_matrix(conn)
+
             # Update Metadata
             with open(self.meta_path, "w") as f:
                 json.dump({"last_updated": datetime.now().isoformat()}, f)
@@ -219,155 +498,615 @@ class FoodNutritionService:
         finally:
             conn.close()
 
+    # --- Nutrient Matrix ---
+
+    def _build_nutrient_matrix(self, conn):
+        """Pivots nutrition rows into a foods x nutrients matrix saved next to the DB."""
+        try:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.execute(
+                f"""
+                SELECT {', '.join(FOOD_FIELDS)}, nutrient_category, nutrient_item,
+                       content_unit, content_per_100g
+                FROM nutrition
+                """
+            )
+            matrix = NutrientMatrix.from_rows(dict(row) for row in cursor)
+            matrix.save(self.matrix_path, self.matrix_vocab_path)
+            log_info(
+                f"Built nutrient matrix: {matrix.shape[0]} foods x {matrix.shape[1]} nutrients"
+            )
+        except Exception as e:
+            log_error(f"Failed to build nutrient matrix: {e}")
+        finally:
+            conn.row_factory = None
+
+    def _get_matrix(self):
+        """
+        Returns the memory-mapped nutrient matrix, reloading it after an ETL rebuild.
+        Builds it from an existing database that predates the matrix file.
+        """
+        if not os.path.exists(self.db_path):
+            return None
+
+        with self._matrix_lock:
+            if not os.path.exists(self.matrix_vocab_path):
+                conn = sqlite3.connect(self.db_path)
+                try:
+                    self._build_nutrient_matrix(conn)
+                finally:
+                    conn.close()
+                if not os.path.exists(self.matrix_vocab_path):
+                    return None
+
+            mtime = os.path.getmtime(self.matrix_vocab_path)
+            if self._matrix is None or mtime != self._matrix_mtime:
+                try:
+                    matrix = NutrientMatrix.load(self.matrix_path, self.matrix_vocab_path)
+                    self._resolver = FoodResolver(matrix.foods)
+                    self._matrix = matrix
+                    self._matrix_mtime = mtime
+                except Exception as e:
+                    # A save in progress elsewhere; keep serving the previous version
+                    log_error(f"Failed to load nutrient matrix: {e}")
+            return self._matrix
+
     # --- Query Features for Food Nutrition ---
 
     def search_nutrition(self, food_name: str, nutrient: str = None):
         """
         Search for nutritional information of foods.
         """
-        if not os.path.exists(self.db_path):
+        matrix = self._get_matrix()
+        if matrix is None:
             return "資料庫初始化中，請稍候..."
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        query = f"%{food_name}%"
+        food_idx = [
+            match["index"]
+            for match in self._resolver.search(food_name, limit=5, exhaustive=True)
+        ]
+        if not food_idx:
+            return f"找不到 '{food_name}' 的營養資料。"
 
         if nutrient:
-            nutrient_query = f"%{nutrient}%"
-            sql = """
-                SELECT sample_name, common_name, nutrient_item, content_per_100g, content_unit, food_category
-                FROM nutrition
-                WHERE (sample_name LIKE ? OR common_name LIKE ? OR english_name LIKE ?)
-                AND nutrient_item LIKE ?
-                LIMIT 20
-            """
-            cursor.execute(sql, (query, query, query, nutrient_query))
+            columns = np.array(matrix.match_nutrients(nutrient), dtype=int)
         else:
-            sql = """
-                SELECT sample_name, common_name, nutrient_item, content_per_100g, content_unit, food_category
-                FROM nutrition
-                WHERE sample_name LIKE ? OR common_name LIKE ? OR english_name LIKE ?
-                LIMIT 30
-            """
-            cursor.execute(sql, (query, query, query))
-
-        rows = cursor.fetchall()
-        conn.close()
+            columns = np.arange(matrix.shape[1])
 
-        if not rows:
-            return f"找不到 '{food_name}' 的營養資料。"
-
-        # Group by food name
-        foods_data = {}
-        for r in rows:
-            food_key = f"{r[0]} ({r[1]})" if r[1] else r[0]
-            if food_key not in foods_data:
-                foods_data[food_key] = {"category": r[5], "nutrients": []}
-            foods_data[food_key]["nutrients"].append(f"  {r[2]}: {r[3]} {r[4]}")
+        # One fancy-indexed slice for all matched foods, then drop missing cells
+        block = matrix.values[np.ix_(food_idx, columns)]
 
         results = []
-        for food_name, data in foods_data.items():
-            nutrients_str = "\n".join(data["nutrients"][:10])
+        for row, i in zip(block, food_idx):
+            food = matrix.foods[i]
+            present = columns[~np.isnan(row)][:10]
+            if not len(present):
+                continue
+            nutrients_str = "\n".join(
+                f"  {matrix.nutrients[j]['name']}: "
+                f"{matrix.format_value(matrix.values[i, j])} {matrix.nutrients[j]['unit']}"
+                for j in present
+            )
+            food_key = (
+                f"{food['sample_name']} ({food['common_name']})"
+                if food["common_name"]
+                else food["sample_name"]
+            )
             results.append(
-                f"【{food_name}】\n" f"分類: {data['category']}\n" f"{nutrients_str}"
+                f"【{food_key}】\n" f"分類: {food['food_category']}\n" f"{nutrients_str}"
             )
 
-        return "\n\n".join(results[:5])
+        if not results:
+            return f"找不到 '{food_name}' 的營養資料。"
+
+        return "\n\n".join(results)
 
     def get_detailed_nutrition(self, food_name: str):
         """
         Get comprehensive nutritional breakdown for a specific food.
         """
-        if not os.path.exists(self.db_path):
+        matrix = self._get_matrix()
+        if matrix is None:
             return "資料庫初始化中，請稍候..."
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        match = self._resolver.resolve(food_name)
+        if match is None:
+            return f"找不到 '{food_name}' 的詳細資料。"
 
-        query = f"%{food_name}%"
-        sql = """
-            SELECT DISTINCT sample_name, common_name, english_name, food_category,
-                   content_description, waste_rate, integration_number
-            FROM nutrition
-            WHERE sample_name LIKE ? OR common_name LIKE ?
-            LIMIT 1
+        return self._format_food_detail(matrix, match["index"])
+
+    def analyze_recipes(self, recipes: list, nutrients: list = None):
         """
-        cursor.execute(sql, (query, query))
-        food_info = cursor.fetchone()
+        Compute total and per-serving nutrients for a batch of recipes.
 
-        if not food_info:
-            conn.close()
-            return f"找不到 '{food_name}' 的詳細資料。"
+        Args:
+            recipes: [{"name": str, "servings": number, "ingredients": [
+                        {"food": str, "quantity": "150g" | "2 碗" | "1 個",
+                         "as_purchased": bool}, ...]}, ...]
+                     A quantity may also be given as "amount" + "unit". Count units (個, 片, ...)
+                     use the food's unit weight. As-purchased weights have the waste rate removed;
+                     this is the default for count units, grams are taken as edible weight.
+            nutrients: Optional nutrient names to report (default: energy and key nutrients)
+
+        Returns:
+            JSON with per-recipe totals, per-serving nutrients and unresolved ingredients
+        """
+        matrix = self._get_matrix()
+        if matrix is None:
+            return "資料庫初始化中，請稍候..."
+
+        if nutrients:
+            columns = [(name, matrix.nutrient_index(name)) for name in nutrients]
+            unknown = [name for name, col in columns if col is None]
+            if unknown:
+                return json.dumps(
+                    {"error": f"找不到營養素: {', '.join(unknown)}"}, ensure_ascii=False
+                )
+        else:
+            columns = [
+                (label, matrix.first_nutrient(names))
+                for label, names in RECIPE_SUMMARY_NUTRIENTS
+            ]
+            columns = [(label, col) for label, col in columns if col is not None]
+
+        # Malformed recipes are reported individually instead of failing the batch
+        errors = [None] * len(recipes)
+        servings = np.ones(len(recipes))
+        for r, recipe in enumerate(recipes):
+            if not isinstance(recipe, dict):
+                errors[r] = "食譜格式錯誤，需為含 name、servings、ingredients 的物件"
+                continue
+            parsed = parse_servings(recipe.get("servings"))
+            if parsed is None:
+                errors[r] = f"無法解析份數: {recipe.get('servings')!r}（需為大於 0 的數字）"
+            elif not isinstance(recipe.get("ingredients") or [], list):
+                errors[r] = "ingredients 需為食材物件的陣列"
+            else:
+                servings[r] = parsed
+
+        # Resolve every ingredient name of every recipe in one pass; non-object
+        # ingredients are reported with the recipe's other unresolved items
+        problems = [[] for _ in recipes]
+        flat = []
+        for r, recipe in enumerate(recipes):
+            if errors[r] is not None:
+                continue
+            for ingredient in recipe.get("ingredients") or []:
+                if isinstance(ingredient, dict):
+                    flat.append((r, ingredient))
+                else:
+                    problems[r].append(
+                        {"food": ingredient, "reason": "食材格式錯誤，需為含 food、quantity 的物件"}
+                    )
+        matches = self._resolver.resolve_many([str(ing.get("food", "")) for _, ing in flat])
+
+        recipe_ids, food_idx, edible = [], [], []
+        for (r, ingredient), match in zip(flat, matches):
+            if match is None:
+                problems[r].append({"food": ingredient.get("food"), "reason": "找不到食品"})
+                continue
+            food = matrix.foods[match["index"]]
+            if "quantity" in ingredient:
+                quantity = parse_quantity(ingredient["quantity"])
+            else:
+                quantity = parse_quantity(ingredient.get("amount", 100))
+                if quantity and ingredient.get("unit"):
+                    quantity = (quantity[0], str(ingredient["unit"]).lower())
+            grams = to_grams(*quantity, food["unit_weight"]) if quantity else None
+            if grams is None:
+                problems[r].append(
+                    {"food": ingredient.get("food"), "reason": "無法換算用量（單位不明或缺每單位重）"}
+                )
+                continue
+            weight, is_count = grams
+            if ingredient.get("as_purchased", is_count) and food["waste_rate"]:
+                weight *= 1 - food["waste_rate"] / 100.0
+            recipe_ids.append(r)
+            food_idx.append(match["index"])
+            edible.append(weight)
+
+        edible = np.array(edible, dtype=float)
+        recipe_ids = np.array(recipe_ids, dtype=int)
+        totals, missing = compute_recipes(
+            matrix.values, np.array(food_idx, dtype=int), edible, recipe_ids, len(recipes)
+        )
+        edible_totals = np.bincount(recipe_ids, weights=edible, minlength=len(recipes))
+        per_serving = totals / servings[:, None]
+
+        def report(row, r):
+            return {
+                label: {
+                    "amount": round(float(row[col]), 2),
+                    "unit": matrix.nutrients[col]["unit"],
+                    **({"ingredients_without_data": int(missing[r, col])} if missing[r, col] else {}),
+                }
+                for label, col in columns
+            }
+
+        def name(recipe, r):
+            return (isinstance(recipe, dict) and recipe.get("name")) or f"recipe_{r + 1}"
+
+        results = [
+            {"name": name(recipe, r), "error": errors[r]}
+            if errors[r]
+            else {
+                "name": name(recipe, r),
+                "servings": float(servings[r]),
+                "edible_grams": round(float(edible_totals[r]), 1),
+                "grams_per_serving": round(float(edible_totals[r] / servings[r]), 1),
+                "per_serving": report(per_serving[r], r),
+                "total": report(totals[r], r),
+                "unresolved": problems[r],
+            }
+            for r, recipe in enumerate(recipes)
+        ]
+        return json.dumps({"total_recipes": len(results), "recipes": results}, ensure_ascii=False)
+
+    def rank_foods_by_nutrient(
+        self, nutrient: str, n: int = 20, category: str = None, per: str = "100g"
+    ):
+        """
+        Rank foods by the content of one nutrient using the precomputed sort order.
+
+        Args:
+            nutrient: Nutrient name (exact or unique partial match, e.g. '鈣')
+            n: Number of foods to return
+            category: Optional food category filter (partial match, e.g. '蔬菜')
+            per: '100g' or 'serving' (per unit weight; foods without one are skipped)
+        """
+        if per not in RANK_BASES:
+            return f"不支援的排序基準 '{per}'，可用: {', '.join(RANK_BASES)}"
+
+        matrix = self._get_matrix()
+        if matrix is None:
+            return "資料庫初始化中，請稍候..."
+
+        col = matrix.nutrient_index(nutrient)
+        if col is None:
+            candidates = [matrix.nutrients[j]["name"] for j in matrix.match_nutrients(nutrient)]
+            if candidates:
+                return f"營養素 '{nutrient}' 不明確，請指定: {', '.join(candidates[:20])}"
+            return f"找不到營養素 '{nutrient}'。"
+
+        mask = None
+        if category:
+            mask = np.array(
+                [category in (food["food_category"] or "") for food in matrix.foods]
+            )
+            if not mask.any():
+                return f"找不到食品分類 '{category}'。"
+
+        top = matrix.top_foods(col, max(1, int(n)), per, mask)
+        if not len(top):
+            return f"沒有可排序的 '{matrix.nutrients[col]['name']}' 資料。"
+
+        info = matrix.nutrients[col]
+        basis_label = "每100克" if per == "100g" else "每單位"
+        lines = []
+        for rank, i in enumerate(top, 1):
+            food = matrix.foods[i]
+            value = matrix.values[i, col]
+            serving = ""
+            if per == "serving":
+                value = value * food["unit_weight"] / 100
+                serving = f"（每單位 {matrix.format_value(food['unit_weight'])} 克）"
+            lines.append(
+                f"{rank}. {food['sample_name']} [{food['food_category']}]: "
+                f"{matrix.format_value(round(float(value), 2))} {info['unit']}{serving}"
+            )
+
+        scope = f"（{category}）" if category else ""
+        return f"=== {info['name']}含量排行{scope} - {basis_label} ===\n\n" + "\n".join(lines)
+
+    def find_similar_foods(
+        self,
+        food_name: str,
+        n: int = 10,
+        metric: str = "cosine",
+        category: str = None,
+        weights: dict = None,
+    ):
+        """
+        Find foods with the most similar nutrient profile (food substitution).
 
-        # Get all nutrients for this food
-        sql_nutrients = """
-            SELECT nutrient_category, nutrient_item, content_per_100g, content_unit,
-                   sample_count, std_deviation
-            FROM nutrition
-            WHERE sample_name = ?
-            ORDER BY nutrient_category, nutrient_item
+        Args:
+            food_name: Reference food
+            n: Number of similar foods to return
+            metric: 'cosine' or 'euclidean' over standardized nutrient vectors
+            category: Optional food category filter for candidates (partial match)
+            weights: Optional {nutrient name: weight}; only the listed nutrients are compared
         """
-        cursor.execute(sql_nutrients, (food_info[0],))
-        nutrients = cursor.fetchall()
-        conn.close()
+        if metric not in SIMILARITY_METRICS:
+            return f"不支援的相似度計算方式 '{metric}'，可用: {', '.join(SIMILARITY_METRICS)}"
+
+        matrix = self._get_matrix()
+        if matrix is None:
+            return "資料庫初始化中，請稍候..."
+
+        match = self._resolver.resolve(food_name)
+        if match is None:
+            return f"找不到 '{food_name}' 的營養資料。"
+        food_idx = match["index"]
+        n = max(1, int(n))
+
+        weight_vector = None
+        if weights:
+            weight_vector = np.zeros(matrix.shape[1])
+            unknown = []
+            for name, weight in weights.items():
+                col = matrix.nutrient_index(name)
+                if col is None:
+                    unknown.append(name)
+                else:
+                    weight_vector[col] = max(float(weight), 0.0)
+            if unknown:
+                return f"找不到營養素: {', '.join(unknown)}"
+
+        if metric == "cosine" and not category and weights is None and n <= matrix.knn.shape[1]:
+            # Default query: served straight from the k-NN table built during ETL
+            neighbours = np.asarray(matrix.knn[food_idx][:n])
+            scores = matrix.similarity(food_idx, targets=neighbours)
+        else:
+            candidates = np.arange(matrix.shape[0])
+            if category:
+                candidates = np.array(
+                    [i for i in candidates if category in (matrix.foods[i]["food_category"] or "")],
+                    dtype=int,
+                )
+            candidates = candidates[candidates != food_idx]
+            if not len(candidates):
+                return f"找不到食品分類 '{category}' 中的其他食品。"
+            all_scores = matrix.similarity(food_idx, metric, weight_vector, candidates)
+            top = np.argsort(-all_scores, kind="stable")[:n]
+            neighbours, scores = candidates[top], all_scores[top]
+
+        macro_cols = [
+            (key, matrix.first_nutrient(names)) for key, names, _ in MACRONUTRIENTS
+        ]
+
+        def macro_text(i):
+            parts = []
+            for key, col in macro_cols:
+                if col is not None:
+                    parts.append(
+                        f"{matrix.nutrients[col]['name']} {matrix.format_value(matrix.values[i, col])}"
+                    )
+            return ", ".join(parts)
+
+        reference = matrix.foods[food_idx]
+        lines = [
+            f"{rank}. {matrix.foods[i]['sample_name']} [{matrix.foods[i]['food_category']}] "
+            f"相似度 {score:.3f}\n   {macro_text(i)}"
+            for rank, (i, score) in enumerate(zip(neighbours, scores), 1)
+        ]
+        return (
+            f"=== 與「{reference['sample_name']}」營養組成相近的食品（{metric}）===\n"
+            f"基準: {macro_text(food_idx)}（每100克）\n\n" + "\n".join(lines)
+        )
+
+    def resolve_food_names(self, names: list, limit: int = 3):
+        """
+        Resolve a batch of food names to dataset foods in one pass.
+
+        Args:
+            names: Food names as written by the user (e.g. a whole meal)
+            limit: Number of ranked candidates returned per name
+
+        Returns:
+            JSON with the best match and ranked candidates for every name
+        """
+        matrix = self._get_matrix()
+        if matrix is None:
+            return "資料庫初始化中，請稍候..."
+
+        results = []
+        for name in names:
+            candidates = [
+                {
+                    "sample_name": matrix.foods[c["index"]]["sample_name"],
+                    "integration_number": matrix.foods[c["index"]]["integration_number"],
+                    "food_category": matrix.foods[c["index"]]["food_category"],
+                    "score": c["score"],
+                    "match": c["match"],
+                    "alias": c["alias"],
+                }
+                for c in self._resolver.search(name, limit=max(1, int(limit)))
+            ]
+            results.append(
+                {
+                    "input": name,
+                    "resolved": candidates[0] if candidates else None,
+                    "candidates": candidates,
+                }
+            )
+        return json.dumps(
+            {
+                "total": len(results),
+                "unresolved": [r["input"] for r in results if r["resolved"] is None],
+                "results": results,
+            },
+            ensure_ascii=False,
+        )
+
+    def _format_food_detail(self, matrix, food_idx: int) -> str:
+        """Formats one food's matrix row grouped by nutrient category."""
+        food = matrix.foods[food_idx]
+        row = matrix.row(food_idx)
 
         # Group nutrients by category
         nutrient_groups = {}
-        for n in nutrients:
-            category = n[0]
-            if category not in nutrient_groups:
-                nutrient_groups[category] = []
-            nutrient_groups[category].append(f"  {n[1]}: {n[2]} {n[3]}")
+        for j in np.flatnonzero(~np.isnan(row)):
+            info = matrix.nutrients[j]
+            nutrient_groups.setdefault(info["category"], []).append(
+                f"  {info['name']}: {matrix.format_value(row[j])} {info['unit']}"
+            )
 
         nutrients_output = []
-        for cat, items in nutrient_groups.items():
+        for cat, items in sorted(nutrient_groups.items(), key=lambda g: str(g[0])):
             nutrients_output.append(f"\n【{cat}】")
-            nutrients_output.extend(items)
+            nutrients_output.extend(sorted(items))
 
+        nutrients_text = "\n".join(nutrients_output)
+        waste_rate = (
+            matrix.format_value(food["waste_rate"]) if food["waste_rate"] is not None else "-"
+        )
         output = f"""
 === 食品營養成分詳情 ===
-樣品名稱: {food_info[0]}
-俗名: {food_info[1] if food_info[1] else '無'}
-英文名稱: {food_info[2] if food_info[2] else '無'}
-食品分類: {food_info[3]}
-內容物描述: {food_info[4] if food_info[4] else '無'}
-廢棄率: {food_info[5]}%
+樣品名稱: {food['sample_name']}
+俗名: {food['common_name'] if food['common_name'] else '無'}
+英文名稱: {food['english_name'] if food['english_name'] else '無'}
+食品分類: {food['food_category']}
+內容物描述: {food['content_description'] if food['content_description'] else '無'}
+廢棄率: {waste_rate}%
 
 【營養成分 (每100克)】
-{''.join(nutrients_output)}
+{nutrients_text}
 """
         return output
 
     # --- Query Features for Food Ingredients ---
 
-    def search_food_ingredient(self, keyword: str):
+    def _build_ingredients_fts(self, conn):
         """
-        Search for food ingredients/materials in the regulatory database.
+        (Re)builds the trigram FTS5 index over food_ingredients; returns False if unsupported.
+        Runs in a savepoint: inside an open transaction it commits with the caller's reload,
+        otherwise it commits on its own; a failure only undoes the index.
         """
-        if not os.path.exists(self.db_path):
-            return "資料庫初始化中，請稍候..."
+        columns = ", ".join(name for name, _ in INGREDIENT_FTS_COLUMNS)
+        try:
+            conn.execute("SAVEPOINT ingredients_fts")
+            conn.execute("DROP TABLE IF EXISTS food_ingredients_fts")
+            conn.execute(
+                f"""
+                CREATE VIRTUAL TABLE food_ingredients_fts USING fts5(
+                    {columns},
+                    content='food_ingredients', content_rowid='rowid', tokenize='trigram'
+                )
+                """
+            )
+            conn.execute("INSERT INTO food_ingredients_fts(food_ingredients_fts) VALUES('rebuild')")
+            conn.execute("RELEASE ingredients_fts")
+            log_info("Built food_ingredients FTS index.")
+            return True
+        except sqlite3.Error as e:
+            log_error(f"FTS5 trigram index unavailable, using LIKE search: {e}")
+            conn.execute("ROLLBACK TO ingredients_fts")
+            conn.execute("RELEASE ingredients_fts")
+            return False
+
+    def _has_ingredients_fts(self, conn) -> bool:
+        """Checks for the FTS index, building it once for databases created before it existed."""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'food_ingredients_fts'"
+        ).fetchone()
+        if exists:
+            return True
+        if self._fts_checked:
+            return False
+        self._fts_checked = True
+        has_table = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'food_ingredients'"
+        ).fetchone()
+        return bool(has_table) and self._build_ingredients_fts(conn)
+
+    def _query_ingredients(
+        self, keyword: str, columns: list, select: str, limit: int, excerpt: bool = True
+    ) -> list:
+        """
+        Ranked ingredient search over the given columns.
+        Uses FTS5 (bm25 + snippet) for queries of 3+ characters, LIKE otherwise.
 
+        Returns:
+            [(*selected columns, excerpt), ...]; without the excerpt when excerpt=False
+        """
         conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        try:
+            keyword = keyword.strip()
+            if len(keyword) >= FTS_MIN_QUERY_LENGTH and self._has_ingredients_fts(conn):
+                weights = ", ".join(str(weight) for _, weight in INGREDIENT_FTS_COLUMNS)
+                phrase = '"' + keyword.replace('"', '""') + '"'
+                match = f"{{{' '.join(columns)}}} : {phrase}"
+                snippet = (
+                    ", snippet(food_ingredients_fts, -1, '【', '】', '…', 24)" if excerpt else ""
+                )
+                sql = f"""
+                    SELECT {select}{snippet}
+                    FROM food_ingredients_fts
+                    JOIN food_ingredients fi ON fi.rowid = food_ingredients_fts.rowid
+                    WHERE food_ingredients_fts MATCH ?
+                    ORDER BY bm25(food_ingredients_fts, {weights})
+                    LIMIT ?
+                """
+                return conn.execute(sql, (match, limit)).fetchall()
+
+            # Short queries: LIKE, ranked exact name > name prefix > name > other columns
+            pattern = f"%{keyword}%"
+            where = " OR ".join(f"fi.{c} LIKE ?" for c in columns)
+            notes = ", fi.note, fi.regulation_note" if excerpt else ""
+            sql = f"""
+                SELECT {select}{notes}
+                FROM food_ingredients fi
+                WHERE {where}
+                ORDER BY CASE
+                    WHEN fi.name_zh = ? OR fi.name_en = ? THEN 0
+                    WHEN fi.name_zh LIKE ? THEN 1
+                    WHEN fi.name_zh LIKE ? OR fi.name_en LIKE ? THEN 2
+                    ELSE 3
+                END, fi.rowid
+                LIMIT ?
+            """
+            params = [pattern] * len(columns) + [
+                keyword, keyword, f"{keyword}%", pattern, pattern, limit
+            ]
+            rows = conn.execute(sql, params).fetchall()
+            if not excerpt:
+                return rows
+            return [
+                (*row[:-2], self._excerpt(row[-2], keyword) or self._excerpt(row[-1], keyword))
+                for row in rows
+            ]
+        finally:
+            conn.close()
 
-        query = f"%{keyword}%"
-        sql = """
-            SELECT name_zh, name_en, scientific_name, major_category, sub_category, part, note
-            FROM food_ingredients
-            WHERE name_zh LIKE ? OR name_en LIKE ? OR scientific_name LIKE ?
-            LIMIT 15
+    @staticmethod
+    def _excerpt(text: str, keyword: str, width: int = 24) -> str:
+        """Snippet-like excerpt around the first keyword occurrence ('' when absent)."""
+        if not text or not keyword:
+            return ""
+        pos = text.lower().find(keyword.lower())
+        if pos < 0:
+            return ""
+        start, end = max(0, pos - width // 2), pos + len(keyword) + width // 2
+        return (
+            ("…" if start > 0 else "")
+            + text[start:pos]
+            + f"【{text[pos:pos + len(keyword)]}】"
+            + text[pos + len(keyword):end]
+            + ("…" if end < len(text) else "")
+        )
+
+    def search_food_ingredient(self, keyword: str):
+        """
+        Search for food ingredients/materials in the regulatory database,
+        including names, categories and regulatory notes.
         """
-        cursor.execute(sql, (query, query, query))
-        rows = cursor.fetchall()
-        conn.close()
+        if not os.path.exists(self.db_path):
+            return "資料庫初始化中，請稍候..."
+
+        rows = self._query_ingredients(
+            keyword,
+            [name for name, _ in INGREDIENT_FTS_COLUMNS],
+            "fi.name_zh, fi.name_en, fi.scientific_name, fi.major_category, "
+            "fi.sub_category, fi.part, fi.note",
+            15,
+        )
 
         if not rows:
             return f"找不到 '{keyword}' 相關的食品原料資料。"
 
         results = []
         for r in rows:
-            results.append(
+            result = (
                 f"【{r[0]}】\n"
                 f"   英文名稱: {r[1] if r[1] else '無'}\n"
                 f"   學名: {r[2] if r[2] else '無'}\n"
@@ -375,6 +1114,11 @@ class FoodNutritionService:
                 f"   使用部位: {r[5] if r[5] else '無'}\n"
                 f"   備註: {r[6][:100] if r[6] else '無'}"
             )
+            # Only show excerpts that add something beyond the name fields above
+            plain = r[7].replace("【", "").replace("】", "") if r[7] else ""
+            if plain and plain not in (r[0], r[1], r[2]):
+                result += f"\n   相關內容: {r[7]}"
+            results.append(result)
 
         return "\n\n".join(results)
 
@@ -385,19 +1129,13 @@ class FoodNutritionService:
         if not os.path.exists(self.db_path):
             return "資料庫初始化中，請稍候..."
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        query = f"%{category}%"
-        sql = """
-            SELECT name_zh, name_en, sub_category, part, regulation_note
-            FROM food_ingredients
-            WHERE major_category LIKE ? OR sub_category LIKE ?
-            LIMIT 20
-        """
-        cursor.execute(sql, (query, query))
-        rows = cursor.fetchall()
-        conn.close()
+        rows = self._query_ingredients(
+            category,
+            ["major_category", "sub_category"],
+            "fi.name_zh, fi.name_en, fi.sub_category, fi.part",
+            20,
+            excerpt=False,
+        )
 
         if not rows:
             return f"找不到 '{category}' 分類的食品原料。"
@@ -411,16 +1149,343 @@ class FoodNutritionService:
 
         return f"=== {category} 分類食品原料 ===\n\n" + "\n".join(results)
 
-    def analyze_diet_plan(self, foods: list):
+    def _get_ingredient_index(self):
         """
-        Analyze nutritional composition of a meal/diet plan.
+        Returns {"rows", "names", "fuzzy"} built from food_ingredients, rebuilt when the DB changes.
+        names maps every normalized Chinese/English/scientific name variant to row positions.
+        The check and the build both run under the lock; the ETL drops the index after a reload.
+        """
+        with self._ingredient_lock:
+            stat = os.stat(self.db_path)
+            version = (stat.st_mtime_ns, stat.st_size)
+            index = self._ingredient_index
+            if index is not None and index["version"] == version:
+                return index
+
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            try:
+                rows = [
+                    dict(row)
+                    for row in conn.execute(
+                        """
+                        SELECT name_zh, name_en, scientific_name, major_category,
+                               sub_category, part, note, regulation_note
+                        FROM food_ingredients
+                        """
+                    )
+                ]
+            finally:
+                conn.close()
+
+            names, fuzzy = {}, NGramIndex()
+            for pos, row in enumerate(rows):
+                row["restriction_status"] = _restriction_status(row["note"])
+                for field in ("name_zh", "name_en", "scientific_name"):
+                    for variant in alias_variants(row[field]):
+                        positions = names.setdefault(variant, [])
+                        if pos not in positions:
+                            positions.append(pos)
+                    fuzzy.add(row[field], pos)
+
+            index = {"rows": rows, "names": names, "fuzzy": fuzzy, "version": version}
+            self._ingredient_index = index
+            log_info(f"Built ingredient name index: {len(rows)} ingredients, {len(names)} names")
+            return index
+
+    def check_ingredients_batch(self, names: list):
+        """
+        Check a whole formulation's ingredient list against the regulatory ingredient table.
+
+        Each name is looked up in an in-memory normalized-name map; names without an exact
+        match fall back to fuzzy matching and are flagged for review.
+
+        Returns:
+            JSON with per-item status (approved / restricted / unknown / needs_review / not_found),
+            matched entries with category, part, the raw restriction note and its status, and a
+            status summary. unknown means the note matched no restriction rule.
         """
         if not os.path.exists(self.db_path):
             return "資料庫初始化中，請稍候..."
 
-        results = []
-        for food in foods:
-            nutrition_data = self.get_detailed_nutrition(food)
-            results.append(nutrition_data)
+        try:
+            index = self._get_ingredient_index()
+        except sqlite3.Error as e:
+            log_error(f"Failed to load food ingredients: {e}")
+            return json.dumps({"error": "食品原料資料尚未就緒"}, ensure_ascii=False)
+
+        def entry(pos, similarity=None):
+            row = index["rows"][pos]
+            result = {
+                "name_zh": row["name_zh"],
+                "name_en": row["name_en"],
+                "scientific_name": row["scientific_name"],
+                "category": f"{row['major_category']} > {row['sub_category']}",
+                "part": row["part"] or "全部",
+                "restriction": row["note"] or None,
+                "restriction_status": row["restriction_status"],
+                "regulation": row["regulation_note"],
+            }
+            if similarity is not None:
+                result["similarity"] = similarity
+            return result
+
+        items, summary = [], {}
+        for name in names:
+            positions = []
+            for variant in alias_variants(name):
+                positions.extend(p for p in index["names"].get(variant, []) if p not in positions)
+
+            if positions:
+                matches = [entry(p) for p in positions]
+                statuses = {m["restriction_status"] for m in matches}
+                status = next(
+                    level for level in ("restricted", "unknown", "approved") if level in statuses
+                )
+            else:
+                hits = index["fuzzy"].search(name, limit=3, min_similarity=0.75)
+                matches = [entry(p, similarity) for p, similarity, _ in hits]
+                status = "needs_review" if matches else "not_found"
+
+            summary[status] = summary.get(status, 0) + 1
+            items.append({"input": name, "status": status, "matches": matches})
+
+        return json.dumps(
+            {
+                "total": len(items),
+                "summary": summary,
+                "items": items,
+                "note": "approved/restricted/unknown 表示名稱完全相符於食品原料資料；restricted 須遵守備註中的使用限制；"
+                "unknown 為備註無法自動判讀，請閱讀 restriction 原文；needs_review 為近似名稱比對結果，請人工確認。",
+            },
+            ensure_ascii=False,
+        )
+
+    def analyze_diet_plan(self, foods: list, grams: list = None, meals: list = None):
+        """
+        Analyze nutritional composition of a meal/diet plan.
+
+        Args:
+            foods: Food names, resolved together against the nutrient matrix
+            grams: Optional edible portion in grams per food (default 100 g each)
+            meals: Optional meal label per food (e.g. '早餐', '午餐'); default '餐點'
+
+        Returns:
+            JSON with resolved items, summed nutrient totals, per-meal macros and %DRI
+        """
+        matrix = self._get_matrix()
+        if matrix is None:
+            return "資料庫初始化中，請稍候..."
+
+        grams = list(grams or [])
+        meals = list(meals or [])
+        items, unresolved = [], []
+        matches = self._resolver.resolve_many(foods)
+        for pos, (name, match) in enumerate(zip(foods, matches)):
+            amount = float(grams[pos]) if pos < len(grams) and grams[pos] is not None else 100.0
+            meal = meals[pos] if pos < len(meals) and meals[pos] else "餐點"
+            if match is None:
+                unresolved.append(name)
+                continue
+            items.append((name, match["index"], amount, meal, match["match"]))
+
+        if not items:
+            return json.dumps(
+                {"error": "找不到任何可分析的食品", "unresolved": unresolved},
+                ensure_ascii=False,
+            )
+
+        food_idx = np.array([item[1] for item in items])
+        weights = np.array([item[2] for item in items]) / 100.0
+        block = np.asarray(matrix.values[food_idx])
+        missing = np.isnan(block)
 
-        return "\n\n" + "=" * 50 + "\n\n".join(results)
+        # Nutrient amount contributed by each item: (items x nutrients)
+        contrib = np.where(missing, 0.0, block) * weights[:, None]
+        totals = contrib.sum(axis=0)
+        has_data = ~missing.all(axis=0)
+        missing_counts = missing.sum(axis=0)
+
+        # Per-meal sums via a one-hot (meals x items) matrix product
+        meal_names = list(dict.fromkeys(item[3] for item in items))
+        one_hot = np.zeros((len(meal_names), len(items)))
+        one_hot[[meal_names.index(item[3]) for item in items], np.arange(len(items))] = 1
+        meal_totals = one_hot @ contrib
+
+        macro_cols = {key: matrix.first_nutrient(names) for key, names, _ in MACRONUTRIENTS}
+
+        def macros(row):
+            summary = {
+                key: round(float(row[col]), 1) if col is not None else None
+                for key, col in macro_cols.items()
+            }
+            macro_kcal = {
+                key: summary[key] * kcal
+                for key, _, kcal in MACRONUTRIENTS
+                if kcal and summary[key] is not None
+            }
+            energy_from_macros = sum(macro_kcal.values())
+            summary["energy_ratio_percent"] = {
+                key: round(value / energy_from_macros * 100, 1) if energy_from_macros else None
+                for key, value in macro_kcal.items()
+            }
+            return summary
+
+        dri = {}
+        for label, names, reference, unit in DAILY_REFERENCE_VALUES:
+            col = matrix.first_nutrient(names)
+            if col is None or not has_data[col]:
+                continue
+            dri[label] = {
+                "amount": round(float(totals[col]), 2),
+                "reference": reference,
+                "unit": unit,
+                "percent": round(float(totals[col]) / reference * 100, 1),
+            }
+
+        result = {
+            "items": [
+                {
+                    "input": name,
+                    "matched": matrix.foods[idx]["sample_name"],
+                    "integration_number": matrix.foods[idx]["integration_number"],
+                    "match": match,
+                    "grams": amount,
+                    "meal": meal,
+                }
+                for name, idx, amount, meal, match in items
+            ],
+            "unresolved": unresolved,
+            "totals": {
+                matrix.nutrients[j]["name"]: {
+                    "amount": round(float(totals[j]), 2),
+                    "unit": matrix.nutrients[j]["unit"],
+                    **({"foods_without_data": int(missing_counts[j])} if missing_counts[j] else {}),
+                }
+                for j in np.flatnonzero(has_data)
+            },
+            "meals": {meal: macros(meal_totals[m]) for m, meal in enumerate(meal_names)},
+            "daily_total_macros": macros(totals),
+            "dri_percent": dri,
+            "note": "%DRI 以台灣每日參考值（2000 大卡）計算，僅供參考，個人需求請諮詢營養師。",
+        }
+        return json.dumps(result, ensure_ascii=False)
+
+    def optimize_meal_plan(
+        self,
+        foods: list,
+        diet: str = None,
+        targets: dict = None,
+        max_grams: float = 300,
+        time_budget_ms: int = 2000,
+    ):
+        """
+        Solve gram amounts of candidate foods that meet daily nutrient targets.
+
+        Args:
+            foods: Candidate food names
+            diet: ICD-10 category with predefined targets (e.g. 'E11', 'I10');
+                  None or 'default' uses the general diet
+            targets: Optional {nutrient: {"min": x, "max": y}} overriding/adding to the diet targets
+            max_grams: Upper bound per food in grams
+            time_budget_ms: Solver time budget; the best plan so far is returned when exceeded
+
+        Returns:
+            JSON with the plan (grams per food), achieved totals vs targets and solver status
+        """
+        code = (diet or "default").strip()
+        code = "default" if code.lower() == "default" else code.upper()[:3]
+        if code not in DIET_TARGETS:
+            return json.dumps(
+                {
+                    "error": f"沒有 '{diet}' 的預設營養目標",
+                    "available_diets": sorted(DIET_TARGETS),
+                },
+                ensure_ascii=False,
+            )
+
+        matrix = self._get_matrix()
+        if matrix is None:
+            return "資料庫初始化中，請稍候..."
+
+        diet_name, diet_rows = DIET_TARGETS[code]
+        goals = {}
+        for label, candidates, low, high in diet_rows:
+            col = matrix.first_nutrient(candidates)
+            if col is not None:
+                goals[col] = (label, low, high)
+
+        unknown = []
+        for name, bounds in (targets or {}).items():
+            col = matrix.nutrient_index(name)
+            if col is None or not isinstance(bounds, dict):
+                unknown.append(name)
+                continue
+            goals[col] = (matrix.nutrients[col]["name"], bounds.get("min"), bounds.get("max"))
+        if unknown:
+            return json.dumps(
+                {"error": f"無法解析的營養目標: {', '.join(unknown)}"}, ensure_ascii=False
+            )
+
+        food_idx, unresolved = [], []
+        for name, match in zip(foods, self._resolver.resolve_many(foods)):
+            if match is None:
+                unresolved.append(name)
+            elif match["index"] not in food_idx:
+                food_idx.append(match["index"])
+        if not food_idx or not goals:
+            return json.dumps(
+                {"error": "沒有可用的候選食品或營養目標", "unresolved": unresolved},
+                ensure_ascii=False,
+            )
+
+        cols = list(goals)
+        lower = np.array([np.nan if goals[c][1] is None else goals[c][1] for c in cols], float)
+        upper = np.array([np.nan if goals[c][2] is None else goals[c][2] for c in cols], float)
+        # (targets x foods) content per 100 g; missing values count as zero
+        content = np.nan_to_num(np.asarray(matrix.values)[np.ix_(food_idx, cols)].T)
+
+        solution = solve_portions(
+            content,
+            lower,
+            upper,
+            np.full(len(food_idx), max(float(max_grams), 0.0) / 100.0),
+            time_budget=max(int(time_budget_ms), 1) / 1000.0,
+        )
+        units = np.round(solution["units"] * 100, 1) / 100
+        totals = content @ units
+        met = evaluate_targets(totals, lower, upper)
+
+        result = {
+            "diet": diet_name,
+            "status": solution["status"],
+            "solve_time_ms": solution["solve_time_ms"],
+            "plan": [
+                {
+                    "food": matrix.foods[i]["sample_name"],
+                    "integration_number": matrix.foods[i]["integration_number"],
+                    "grams": round(float(u * 100), 1),
+                }
+                for i, u in zip(food_idx, units)
+                if u * 100 >= 1
+            ],
+            "unresolved": unresolved,
+            "targets": [
+                {
+                    "nutrient": goals[c][0],
+                    "amount": round(float(total), 1),
+                    "unit": matrix.nutrients[c]["unit"],
+                    "min": goals[c][1],
+                    "max": goals[c][2],
+                    "met": ok,
+                }
+                for c, total, ok in zip(cols, totals, met)
+            ],
+            "all_targets_met": all(met),
+            "note": "份量為線性規劃的建議值，僅供參考，實際飲食計畫請諮詢營養師。",
+        }
+        if solution["status"] != STATUS_OPTIMAL:
+            result["message"] = SOLVER_STATUS_MESSAGES.get(
+                solution["status"], f"求解未達最佳解（{solution['status']}），回傳目前的可行份量。"
+            )
+        return json.dumps(result, ensure_ascii=False)
@@ -0,0 +1,127 @@
+"""
+Food Resolver - 食品名稱解析
+預先建立「別名 -> 食品」字典（樣品名稱、俗名、英文名稱及其正規化變體），
+以固定的評分規則挑選最佳食品，取代 LIKE 查詢後任意取第一筆的做法
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+from fuzzy_search import normalize_text
+
+# Base score per name field; exact matches on the official sample name win
+FIELD_SCORES = {"sample_name": 100, "common_name": 90, "english_name": 85}
+
+# Match kinds and the score they keep from the field score
+MATCH_WEIGHTS = {"exact": 1.0, "prefix": 0.7, "substring": 0.5}
+
+# Common names are stored as lists such as '在來米,白飯' or '蛋、雞卵'
+_ALIAS_SEPARATORS = re.compile(r"[,，、;；/]")
+_PUNCTUATION = re.compile(r"[\s\-_'’.·()（）]")
+
+
+def alias_variants(text: str) -> List[str]:
+    """名稱的正規化變體：NFKC 小寫，以及去除空白與標點的版本"""
+    base = normalize_text(text)
+    if not base:
+        return []
+    compact = _PUNCTUATION.sub("", base)
+    return [base] if compact in ("", base) else [base, compact]
+
+
+class FoodResolver:
+    """
+    食品名稱解析器
+    - aliases: 正規化別名 -> [(欄位分數, 食品索引)]，依分數與資料順序排序
+    - resolve(): 單一名稱的最佳食品；resolve_many(): 一次解析整份菜單
+    評分：完全相符 > 前綴 > 包含，同分時以名稱長度較接近者、再以資料順序決定
+    """
+
+    def __init__(self, foods: List[Dict]):
+        self.foods = foods
+        self.aliases: Dict[str, List[Tuple[int, int]]] = {}
+        for idx, food in enumerate(foods):
+            for field, field_score in FIELD_SCORES.items():
+                for name in _ALIAS_SEPARATORS.split(food.get(field) or ""):
+                    for alias in alias_variants(name):
+                        self.aliases.setdefault(alias, []).append((field_score, idx))
+
+        for entries in self.aliases.values():
+            # Keep one entry per food, best field first
+            best = {}
+            for field_score, idx in entries:
+                best[idx] = max(best.get(idx, 0), field_score)
+            entries[:] = sorted(((s, i) for i, s in best.items()), key=lambda e: (-e[0], e[1]))
+
+        # Sorted once so substring scans return matches in a stable order
+        self._alias_keys = sorted(self.aliases)
+
+    def __len__(self) -> int:
+        return len(self.aliases)
+
+    def search(self, name: str, limit: int = 5, exhaustive: bool = False) -> List[Dict]:
+        """
+        依分數排序的候選食品
+
+        Args:
+            name: 使用者輸入的名稱
+            limit: 最多回傳筆數
+            exhaustive: 有完全相符時仍列出前綴 / 包含的候選（供搜尋清單使用）
+
+        Returns:
+            [{"index", "score", "match", "alias"}, ...]
+        """
+        variants = alias_variants(name)
+        if not variants:
+            return []
+
+        scored: Dict[int, Tuple[float, int, str, str]] = {}
+
+        def consider(idx: int, score: float, length_gap: int, kind: str, alias: str):
+            key = (-score, length_gap, idx)
+            current = scored.get(idx)
+            if current is None or key < (-current[0], current[1], idx):
+                scored[idx] = (score, length_gap, kind, alias)
+
+        for query in variants:
+            entries = self.aliases.get(query)
+            if entries:
+                for field_score, idx in entries:
+                    consider(idx, field_score * MATCH_WEIGHTS["exact"], 0, "exact", query)
+
+        if exhaustive or not scored:
+            for query in variants:
+                for alias in self._alias_keys:
+                    if query not in alias:
+                        continue
+                    kind = "prefix" if alias.startswith(query) else "substring"
+                    for field_score, idx in self.aliases[alias]:
+                        consider(
+                            idx,
+                            field_score * MATCH_WEIGHTS[kind],
+                            len(alias) - len(query),
+                            kind,
+                            alias,
+                        )
+
+        ranked = sorted(scored.items(), key=lambda item: (-item[1][0], item[1][1], item[0]))
+        return [
+            {"index": idx, "score": round(score, 1), "match": kind, "alias": alias}
+            for idx, (score, _, kind, alias) in ranked[:limit]
+        ]
+
+    def resolve(self, name: str) -> Optional[Dict]:
+        """單一名稱的最佳食品（找不到時回傳 None）"""
+        matches = self.search(name, limit=1)
+        return matches[0] if matches else None
+
+    def resolve_many(self, names: List[str]) -> List[Optional[Dict]]:
+        """一次解析多個名稱，重複的名稱只計算一次"""
+        cache: Dict[str, Optional[Dict]] = {}
+        results = []
+        for name in names:
+            key = normalize_text(name)
+            if key not in cache:
+                cache[key] = self.resolve(name)
+            results.append(cache[key])
+        return results
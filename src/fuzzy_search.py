@@ -0,0 +1,136 @@
+"""
+Fuzzy Search - 容錯字串比對工具
+以字元 n-gram 倒排索引挑選候選，再以 Levenshtein 距離重新排序
+"""
+
+from collections import Counter
+import re
+import unicodedata
+from typing import Dict, List, Tuple
+
+
+def normalize_text(text: str) -> str:
+    """全形轉半形（NFKC）、轉小寫並壓縮空白"""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def normalize_code(code: str) -> str:
+    """正規化醫療代碼：全形轉半形並去除小數點與空白（'Ｅ11.9' -> 'e119'）"""
+    return re.sub(r"[\s.]", "", normalize_text(code))
+
+
+def char_ngrams(text: str, n: int = 2) -> set:
+    """取得字元 n-gram 集合（字串短於 n 時回傳整個字串）"""
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i : i + n] for i in range(len(text) - n + 1)}
+
+
+def levenshtein(a: str, b: str) -> int:
+    """標準 Levenshtein 編輯距離"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            )
+        previous = current
+    return previous[-1]
+
+
+def partial_levenshtein(query: str, text: str) -> int:
+    """
+    查詢字串與目標字串「任一子字串」的最小編輯距離
+    （適用於短查詢比對長名稱，例如 'apendicitis' 對 'Acute appendicitis'）
+    """
+    if not query:
+        return 0
+    if not text:
+        return len(query)
+    # Row over text positions; a free start at any position makes the match local
+    previous = [0] * (len(text) + 1)
+    for i, cq in enumerate(query, 1):
+        current = [i]
+        for j, ct in enumerate(text, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (cq != ct))
+            )
+        previous = current
+    return min(previous)
+
+
+class NGramIndex:
+    """
+    字元 n-gram 倒排索引
+    - add(): 加入 (文字, 文件編號)
+    - search(): 依共同 n-gram 數挑選候選，再以 partial Levenshtein 計算相似度排序
+    """
+
+    def __init__(self, n: int = 2, max_posting_ratio: float = 0.2, normalizer=None):
+        self.n = n
+        self.normalizer = normalizer or normalize_text
+        self.max_posting_ratio = max_posting_ratio
+        self.entries: List[Tuple[str, int]] = []
+        self.postings: Dict[str, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, text: str, doc_id: int):
+        text = self.normalizer(text)
+        if not text:
+            return
+        entry_id = len(self.entries)
+        self.entries.append((text, doc_id))
+        for gram in char_ngrams(text, self.n):
+            self.postings.setdefault(gram, []).append(entry_id)
+
+    def search(
+        self,
+        query: str,
+        limit: int = 10,
+        min_similarity: float = 0.6,
+        max_candidates: int = 300,
+    ) -> List[Tuple[int, float, str]]:
+        """
+        Returns:
+            [(doc_id, similarity, matched_text), ...]，依相似度遞減，每個文件只保留最佳比對
+        """
+        query = self.normalizer(query)
+        grams = char_ngrams(query, self.n)
+        if not grams or not self.entries:
+            return []
+
+        # Very common n-grams carry little signal and dominate counting time
+        cap = max(1, int(len(self.entries) * self.max_posting_ratio))
+        postings = [self.postings[g] for g in grams if g in self.postings]
+        selective = [p for p in postings if len(p) <= cap] or postings
+
+        overlap = Counter()
+        for posting in selective:
+            overlap.update(posting)
+
+        best: Dict[int, Tuple[float, str]] = {}
+        for entry_id, _ in overlap.most_common(max_candidates):
+            text, doc_id = self.entries[entry_id]
+            distance = partial_levenshtein(query, text)
+            similarity = 1 - distance / max(len(query), 1)
+            if similarity < min_similarity:
+                continue
+            similarity = round(similarity, 4)
+            if doc_id not in best or similarity > best[doc_id][0]:
+                best[doc_id] = (similarity, text)
+
+        # Ties go to the closest whole string (e.g. 'e119' over 'e1190' for 'e119x')
+        ranked = sorted(
+            best.items(),
+            key=lambda item: (-item[1][0], levenshtein(query, item[1][1])),
+        )
+        return [(doc_id, sim, text) for doc_id, (sim, text) in ranked[:limit]]
+
@@ -38,7 +38,7 @@ except ImportError:
 
 # Import MCP server
 try:
-    from server import mcp
+    from server import autocomplete_service, mcp
     logger.info("✅ MCP server imported successfully")
 except ImportError as e:
     logger.error(f"❌ Failed to import MCP server: {e}")
@@ -62,6 +62,7 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "health": "/health",
+            "autocomplete": "/autocomplete",
             "mcp": "/mcp"
         }
     }
@@ -124,6 +125,16 @@ async def mcp_message(request: Request):
             status_code=500
         )
 
+@app.get("/autocomplete")
+async def autocomplete(prefix: str, domain: str = "all", limit: int = 10):
+    """Per-keystroke prefix suggestions for ICD, LOINC and drug names"""
+    if autocomplete_service is None:
+        return JSONResponse({"error": "Autocomplete service unavailable"}, status_code=503)
+    if domain != "all" and domain not in autocomplete_service.DOMAINS:
+        return JSONResponse({"error": f"Unknown domain '{domain}'"}, status_code=400)
+    suggestions = autocomplete_service.suggest(prefix, domain, limit)
+    return {"prefix": prefix, "total_found": len(suggestions), "suggestions": suggestions}
+
 @app.get("/mcp/tools")
 async def list_tools():
     """List all available MCP tools"""
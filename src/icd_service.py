@@ -1,17 +1,168 @@
+import base64
 import json
 import os
 import sqlite3
+import threading
 
 import pandas as pd
 
+from fuzzy_search import NGramIndex, normalize_code
 from utils import log_error, log_info
 
+# ICD-10-CM chapters as (first_code, last_code, key, name_zh), compared on the first 3 chars
+ICD_CHAPTERS = [
+    ("A00", "B99", "infectious", "感染症及寄生蟲病"),
+    ("C00", "D49", "neoplasm", "腫瘤"),
+    ("D50", "D89", "blood", "血液及造血器官疾病"),
+    ("E00", "E89", "endocrine", "內分泌、營養及新陳代謝疾病"),
+    ("F01", "F99", "mental", "精神、行為及神經發展疾患"),
+    ("G00", "G99", "nervous", "神經系統疾病"),
+    ("H00", "H59", "eye", "眼及附屬器官疾病"),
+    ("H60", "H95", "ear", "耳及乳突疾病"),
+    ("I00", "I99", "circulatory", "循環系統疾病"),
+    ("J00", "J99", "respiratory", "呼吸系統疾病"),
+    ("K00", "K95", "digestive", "消化系統疾病"),
+    ("L00", "L99", "skin", "皮膚及皮下組織疾病"),
+    ("M00", "M99", "musculoskeletal", "肌肉骨骼系統及結締組織疾病"),
+    ("N00", "N99", "genitourinary", "泌尿生殖系統疾病"),
+    ("O00", "O9A", "pregnancy", "妊娠、生產及產褥期"),
+    ("P00", "P96", "perinatal", "源於周產期的病況"),
+    ("Q00", "Q99", "congenital", "先天性畸形、變形及染色體異常"),
+    ("R00", "R99", "symptom", "症狀、徵候及臨床與實驗室異常發現"),
+    ("S00", "T88", "injury", "傷害、中毒及其他外因造成的特定影響"),
+    ("V00", "Y99", "external", "外因"),
+    ("Z00", "Z99", "factor", "影響健康狀態及醫療服務的因素"),
+]
+
+# Chapters that can plausibly justify a procedure on any body system
+UNIVERSAL_CHAPTERS = {"neoplasm", "congenital", "symptom", "injury", "factor"}
+
+# ICD-10-PCS Medical and Surgical (section '0') body systems -> (name, typical ICD chapters)
+PCS_BODY_SYSTEMS = {
+    "0": ("Central Nervous System and Cranial Nerves", {"nervous", "mental"}),
+    "1": ("Peripheral Nervous System", {"nervous", "musculoskeletal"}),
+    "2": ("Heart and Great Vessels", {"circulatory"}),
+    "3": ("Upper Arteries", {"circulatory"}),
+    "4": ("Lower Arteries", {"circulatory", "endocrine"}),
+    "5": ("Upper Veins", {"circulatory", "genitourinary"}),
+    "6": ("Lower Veins", {"circulatory"}),
+    "7": ("Lymphatic and Hemic Systems", {"blood", "infectious"}),
+    "8": ("Eye", {"eye", "endocrine"}),
+    "9": ("Ear, Nose, Sinus", {"ear", "respiratory"}),
+    "B": ("Respiratory System", {"respiratory", "infectious"}),
+    "C": ("Mouth and Throat", {"digestive", "respiratory"}),
+    "D": ("Gastrointestinal System", {"digestive", "infectious"}),
+    "F": ("Hepatobiliary System and Pancreas", {"digestive", "endocrine"}),
+    "G": ("Endocrine System", {"endocrine"}),
+    "H": ("Skin and Breast", {"skin", "genitourinary", "infectious"}),
+    "J": ("Subcutaneous Tissue and Fascia", {"skin", "musculoskeletal", "endocrine"}),
+    "K": ("Muscles", {"musculoskeletal", "nervous"}),
+    "L": ("Tendons", {"musculoskeletal"}),
+    "M": ("Bursae and Ligaments", {"musculoskeletal"}),
+    "N": ("Head and Facial Bones", {"musculoskeletal", "digestive"}),
+    "P": ("Upper Bones", {"musculoskeletal"}),
+    "Q": ("Lower Bones", {"musculoskeletal"}),
+    "R": ("Upper Joints", {"musculoskeletal"}),
+    "S": ("Lower Joints", {"musculoskeletal"}),
+    "T": ("Urinary System", {"genitourinary", "pregnancy"}),
+    "U": ("Female Reproductive System", {"genitourinary", "pregnancy"}),
+    "V": ("Male Reproductive System", {"genitourinary"}),
+    "W": ("Anatomical Regions, General", None),
+    "X": ("Anatomical Regions, Upper Extremities", None),
+    "Y": ("Anatomical Regions, Lower Extremities", None),
+}
+
+# Relevance tiers returned by search_codes, best first
+SEARCH_MATCH_TYPES = ["exact_code", "code_prefix", "exact_name", "name_prefix_or_word", "substring"]
+
+# ICD-10-PCS axis columns, one per character of the 7-character code
+PCS_AXES = [
+    "section",
+    "body_system",
+    "operation",
+    "body_part",
+    "approach",
+    "device",
+    "qualifier",
+]
+
+PCS_SECTIONS = {
+    "0": "Medical and Surgical",
+    "1": "Obstetrics",
+    "2": "Placement",
+    "3": "Administration",
+    "4": "Measurement and Monitoring",
+    "5": "Extracorporeal or Systemic Assistance and Performance",
+    "6": "Extracorporeal or Systemic Therapies",
+    "7": "Osteopathic",
+    "8": "Other Procedures",
+    "9": "Chiropractic",
+    "B": "Imaging",
+    "C": "Nuclear Medicine",
+    "D": "Radiation Therapy",
+    "F": "Physical Rehabilitation and Diagnostic Audiology",
+    "G": "Mental Health",
+    "H": "Substance Abuse Treatment",
+    "X": "New Technology",
+}
+
+# Root operations and approaches of the Medical and Surgical section
+PCS_OPERATIONS = {
+    "0": "Alteration",
+    "1": "Bypass",
+    "2": "Change",
+    "3": "Control",
+    "4": "Creation",
+    "5": "Destruction",
+    "6": "Detachment",
+    "7": "Dilation",
+    "8": "Division",
+    "9": "Drainage",
+    "B": "Excision",
+    "C": "Extirpation",
+    "D": "Extraction",
+    "F": "Fragmentation",
+    "G": "Fusion",
+    "H": "Insertion",
+    "J": "Inspection",
+    "K": "Map",
+    "L": "Occlusion",
+    "M": "Reattachment",
+    "N": "Release",
+    "P": "Removal",
+    "Q": "Repair",
+    "R": "Replacement",
+    "S": "Reposition",
+    "T": "Resection",
+    "U": "Supplement",
+    "V": "Restriction",
+    "W": "Revision",
+    "X": "Transfer",
+    "Y": "Transplantation",
+}
+
+PCS_APPROACHES = {
+    "0": "Open",
+    "3": "Percutaneous",
+    "4": "Percutaneous Endoscopic",
+    "7": "Via Natural or Artificial Opening",
+    "8": "Via Natural or Artificial Opening Endoscopic",
+    "F": "Via Natural or Artificial Opening With Percutaneous Endoscopic Assistance",
+    "X": "External",
+}
+
+PCS_APPROACH_ALIASES = {"laparoscopic": "4", "endoscopic": "8", "percutaneous": "3"}
+
 
 class ICDService:
     def __init__(self, excel_path: str, data_dir: str):
         self.excel_path = excel_path
         self.db_path = os.path.join(data_dir, "icd10_smart.db")
 
+        # Fuzzy index over codes and names, built lazily on first use
+        self._fuzzy_index = None
+        self._fuzzy_lock = threading.Lock()
+
         # Initialize the database immediately upon class instantiation
         self._initialize_database()
 
@@ -22,6 +173,7 @@ class ICDService:
         """
         if os.path.exists(self.db_path):
             log_info(f"ICD Database found at: {self.db_path}")
+            self._ensure_pcs_axes()
             return
 
         log_info(f"Initializing database from Excel: {self.excel_path}")
@@ -65,6 +217,7 @@ class ICDService:
                 df.columns = ["code", "name_en", "name_zh"]
                 df = df.dropna(subset=["code"])
                 df.to_sql("procedures", conn, index=False, if_exists="replace")
+                self._build_pcs_axes(conn)
 
             # Create indices for performance
             indices = [
@@ -84,6 +237,57 @@ class ICDService:
         finally:
             conn.close()
 
+    def _ensure_pcs_axes(self):
+        """Adds the PCS axis columns to databases built before they existed."""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            columns = {
+                row[1] for row in conn.execute("PRAGMA table_info(procedures)")
+            }
+            if columns and (
+                not set(PCS_AXES) <= columns
+                # Earlier builds sliced untrimmed codes, shifting every axis
+                or conn.execute(
+                    "SELECT 1 FROM procedures WHERE length(trim(code)) = 7 "
+                    "AND section IS NOT substr(upper(trim(code)), 1, 1) LIMIT 1"
+                ).fetchone()
+            ):
+                log_info("Decomposing ICD-10-PCS codes into axis columns...")
+                self._build_pcs_axes(conn)
+        except Exception as e:
+            log_error(f"PCS axis migration failed: {e}")
+        finally:
+            conn.close()
+
+    def _build_pcs_axes(self, conn):
+        """
+        Splits each 7-character PCS code into one indexed column per axis
+        (section, body system, operation, body part, approach, device, qualifier).
+        """
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(procedures)")}
+        for axis in PCS_AXES:
+            if axis not in columns:
+                conn.execute(f"ALTER TABLE procedures ADD COLUMN {axis} TEXT")
+
+        assignments = ", ".join(
+            f"{axis} = substr(upper(trim(code)), {i + 1}, 1)" for i, axis in enumerate(PCS_AXES)
+        )
+        conn.execute(
+            f"UPDATE procedures SET {assignments} WHERE length(trim(code)) = 7"
+        )
+
+        # Leading columns follow the PCS hierarchy; the second index serves
+        # operation/approach filters that do not pin a body system.
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_proc_axes ON procedures"
+            "(section, body_system, operation, body_part, approach)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_proc_op_approach ON procedures"
+            "(section, operation, approach, body_part)"
+        )
+        conn.commit()
+
     def _query_db(self, sql: str, params: tuple = ()) -> list:
         """Helper function to execute SQL queries and return results as a list of dicts."""
         if not os.path.exists(self.db_path):
@@ -106,26 +310,160 @@ class ICDService:
 
     # --- Core Functionalities (Ported from your original code) ---
 
-    def search_codes(self, keyword: str, type: str = "all") -> str:
+    def search_codes(
+        self, keyword: str, type: str = "all", limit: int = 10, cursor: str = None
+    ) -> str:
         """
-        Search for ICD-10 diagnosis or procedure codes.
+        Search for ICD-10 diagnosis or procedure codes, ranked by relevance:
+        exact code > code prefix > exact name > name prefix / whole word > substring.
+        Pass the returned `next_cursor` back as `cursor` to fetch the next page.
         """
-        term = f"%{keyword}%"
+        keyword = keyword.strip()
+        limit = max(1, limit)
+        positions = self._decode_cursor(cursor)
+        if not positions:
+            cursor = None
         results = {}
+        next_positions = {}
 
-        if type in ["diagnosis", "all"]:
-            sql = "SELECT code, name_zh, name_en FROM diagnoses WHERE code LIKE ? OR name_zh LIKE ? OR name_en LIKE ? LIMIT 10"
-            results["diagnoses"] = self._query_db(sql, (term, term, term))
+        for table, table_type in (("diagnoses", "diagnosis"), ("procedures", "procedure")):
+            if type not in [table_type, "all"]:
+                continue
+            if cursor and table not in positions:
+                # This table was exhausted on an earlier page
+                results[table] = []
+                continue
+            rows = self._ranked_search(table, keyword, limit + 1, positions.get(table))
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_positions[table] = [rows[-1]["rank"], rows[-1]["code"]]
+            for row in rows:
+                row["match"] = SEARCH_MATCH_TYPES[row.pop("rank")]
+            results[table] = rows
 
-        if type in ["procedure", "all"]:
-            sql = "SELECT code, name_zh, name_en FROM procedures WHERE code LIKE ? OR name_zh LIKE ? OR name_en LIKE ? LIMIT 10"
-            results["procedures"] = self._query_db(sql, (term, term, term))
+        if cursor:
+            results["next_cursor"] = self._encode_cursor(next_positions)
+            return json.dumps(results, ensure_ascii=False)
+        if next_positions:
+            results["next_cursor"] = self._encode_cursor(next_positions)
 
         if not results.get("diagnoses") and not results.get("procedures"):
-            return f"No results found for '{keyword}'."
+            # Typo or width mismatch: answer with ranked fuzzy suggestions instead of nothing
+            suggestions = self.fuzzy_search_codes(keyword, type)
+            if not suggestions:
+                return f"No results found for '{keyword}'."
+            results["suggestions"] = suggestions
+            results["message"] = (
+                f"No exact matches for '{keyword}'. Showing closest codes by fuzzy matching."
+            )
 
         return json.dumps(results, ensure_ascii=False)
 
+    def _ranked_search(self, table: str, keyword: str, limit: int, after=None) -> list:
+        """
+        Runs one relevance-ranked LIKE search. Ranks are computed in SQL and rows are
+        ordered by (rank, code), which keeps each 3-character category grouped within
+        a tier; `after` is the (rank, code) keyset of the last row of the previous page.
+        """
+        term = f"%{keyword}%"
+        sql = """
+            SELECT code, name_zh, name_en, category, rank FROM (
+                SELECT code, name_zh, name_en, substr(code, 1, 3) AS category,
+                    CASE
+                        WHEN code = :kw COLLATE NOCASE
+                          OR replace(code, '.', '') = replace(:kw, '.', '') COLLATE NOCASE THEN 0
+                        WHEN code LIKE :kw || '%' THEN 1
+                        WHEN name_zh = :kw OR name_en = :kw COLLATE NOCASE THEN 2
+                        WHEN name_zh LIKE :kw || '%' OR name_en LIKE :kw || '%'
+                          OR ' ' || name_en || ' ' LIKE '% ' || :kw || ' %' THEN 3
+                        ELSE 4
+                    END AS rank
+                FROM {table}
+                WHERE code LIKE :term OR name_zh LIKE :term OR name_en LIKE :term
+                   OR replace(code, '.', '') = replace(:kw, '.', '') COLLATE NOCASE
+            )
+        """.format(table=table)
+        params = {"kw": keyword, "term": term, "limit": limit}
+        if after:
+            sql += " WHERE rank > :after_rank OR (rank = :after_rank AND code > :after_code)"
+            params.update({"after_rank": after[0], "after_code": after[1]})
+        sql += " ORDER BY rank, code LIMIT :limit"
+        return self._query_db(sql, params)
+
+    def _encode_cursor(self, positions: dict) -> str:
+        """Encodes per-table keyset positions into an opaque cursor string."""
+        if not positions:
+            return None
+        raw = json.dumps(positions, ensure_ascii=False).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+
+    def _decode_cursor(self, cursor: str) -> dict:
+        """Decodes a cursor from _encode_cursor; invalid cursors restart from page one."""
+        if not cursor:
+            return {}
+        try:
+            return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        except Exception as e:
+            log_error(f"Invalid search cursor '{cursor}': {e}")
+            return {}
+
+    def fuzzy_search_codes(self, keyword: str, type: str = "all", limit: int = 10) -> list:
+        """
+        Typo-tolerant search over ICD codes and names (e.g. 'E11.9x', 'apendicitis', 'Ｅ１１').
+        Returns ranked suggestions as a list of dicts with a 0-1 similarity score.
+        """
+        index = self._get_fuzzy_index()
+        if index is None:
+            return []
+        docs, code_index, name_index = index
+
+        # Code-like queries match against codes; everything also matches names
+        scored = {}
+        for doc_id, score, _ in code_index.search(keyword, limit=limit * 3):
+            scored[doc_id] = (score, "code")
+        for doc_id, score, _ in name_index.search(keyword, limit=limit * 3):
+            if doc_id not in scored or score > scored[doc_id][0]:
+                scored[doc_id] = (score, "name")
+
+        suggestions = []
+        for doc_id, (score, field) in sorted(
+            scored.items(), key=lambda item: (-item[1][0], docs[item[0]]["code"])
+        ):
+            doc = docs[doc_id]
+            if type != "all" and doc["type"] != type:
+                continue
+            suggestions.append({**doc, "score": score, "matched_on": field})
+            if len(suggestions) >= limit:
+                break
+        return suggestions
+
+    def _get_fuzzy_index(self):
+        """Builds the in-memory n-gram indexes over both tables once, thread-safely."""
+        if self._fuzzy_index is not None:
+            return self._fuzzy_index
+
+        with self._fuzzy_lock:
+            if self._fuzzy_index is not None:
+                return self._fuzzy_index
+
+            docs = []
+            code_index = NGramIndex(n=2, normalizer=normalize_code)
+            name_index = NGramIndex(n=2)
+            for table, doc_type in (("diagnoses", "diagnosis"), ("procedures", "procedure")):
+                rows = self._query_db(f"SELECT code, name_zh, name_en FROM {table}")
+                for row in rows:
+                    doc_id = len(docs)
+                    docs.append({**row, "type": doc_type})
+                    code_index.add(row["code"], doc_id)
+                    name_index.add(row["name_zh"], doc_id)
+                    name_index.add(row["name_en"], doc_id)
+
+            if not docs:
+                return None
+            log_info(f"Built ICD fuzzy index over {len(docs)} codes")
+            self._fuzzy_index = (docs, code_index, name_index)
+            return self._fuzzy_index
+
     def infer_complications(self, code: str) -> str:
         """
         Infers potential complications by finding child codes.
@@ -198,3 +536,192 @@ class ICDService:
                 },
                 ensure_ascii=False,
             )
+
+    def get_conflict_matrix(
+        self, diagnosis_codes: list, procedure_codes: list
+    ) -> str:
+        """
+        Retrieves definitions for every diagnosis/procedure pair in two set queries,
+        with a precomputed ICD chapter / PCS body-system compatibility hint per pair.
+        """
+        # Preserve caller order while dropping duplicates
+        diagnosis_codes = list(dict.fromkeys(c.strip() for c in diagnosis_codes if c))
+        procedure_codes = list(dict.fromkeys(c.strip() for c in procedure_codes if c))
+
+        try:
+            diags = self._query_in("diagnoses", diagnosis_codes)
+            procs = self._query_in("procedures", procedure_codes)
+
+            diag_chapters = {c: self._get_icd_chapter(c) for c in diags}
+            proc_systems = {c: self._get_pcs_body_system(c) for c in procs}
+
+            pairs = []
+            for d_code in diagnosis_codes:
+                chapter = diag_chapters.get(d_code)
+                for p_code in procedure_codes:
+                    system = proc_systems.get(p_code)
+                    pairs.append(
+                        {
+                            "diagnosis_code": d_code,
+                            "procedure_code": p_code,
+                            "diagnosis_chapter": chapter["name_zh"] if chapter else None,
+                            "procedure_body_system": system["name"] if system else None,
+                            "compatibility_hint": self._get_compatibility_hint(
+                                chapter, system
+                            ),
+                        }
+                    )
+
+            result = {
+                "diagnoses": diags,
+                "procedures": procs,
+                "not_found": {
+                    "diagnoses": [c for c in diagnosis_codes if c not in diags],
+                    "procedures": [c for c in procedure_codes if c not in procs],
+                },
+                "pairs": pairs,
+                "instruction": (
+                    "Analyze each pair for potential contraindications or medical conflicts. "
+                    "'review' hints mark pairs whose diagnosis chapter is atypical for the "
+                    "procedure's body system; they are not conclusive."
+                ),
+            }
+            return json.dumps(result, ensure_ascii=False)
+        except Exception as e:
+            log_error(f"Error in get_conflict_matrix: {e}")
+            return json.dumps(
+                {
+                    "error": f"Failed to retrieve conflict matrix: {str(e)}",
+                    "diagnosis_codes": diagnosis_codes,
+                    "procedure_codes": procedure_codes,
+                },
+                ensure_ascii=False,
+            )
+
+    # --- Conflict Matrix Helpers ---
+
+    def _query_in(self, table: str, codes: list) -> dict:
+        """Fetches all rows whose code is in `codes` with a single query, keyed by code."""
+        if not codes:
+            return {}
+        placeholders = ", ".join("?" for _ in codes)
+        rows = self._query_db(
+            f"SELECT * FROM {table} WHERE code IN ({placeholders})", tuple(codes)
+        )
+        return {row["code"]: row for row in rows}
+
+    def _get_icd_chapter(self, code: str) -> dict:
+        """Maps an ICD-10-CM code to its chapter using the 3-character category."""
+        category = code.replace(".", "").upper()[:3]
+        for first, last, key, name_zh in ICD_CHAPTERS:
+            if first <= category <= last:
+                return {"key": key, "name_zh": name_zh}
+        return None
+
+    def _get_pcs_body_system(self, code: str) -> dict:
+        """Decodes the body-system axis of a Medical and Surgical ICD-10-PCS code."""
+        code = code.upper()
+        if len(code) < 2 or code[0] != "0" or code[1] not in PCS_BODY_SYSTEMS:
+            return None
+        name, chapters = PCS_BODY_SYSTEMS[code[1]]
+        return {"name": name, "chapters": chapters}
+
+    def _get_compatibility_hint(self, chapter: dict, system: dict) -> str:
+        """Returns 'compatible', 'review' or 'unknown' for a chapter/body-system pair."""
+        if not chapter or not system:
+            return "unknown"
+        if system["chapters"] is None or chapter["key"] in UNIVERSAL_CHAPTERS:
+            return "compatible"
+        return "compatible" if chapter["key"] in system["chapters"] else "review"
+
+    def search_procedures_by_axes(
+        self,
+        section: str = None,
+        body_system: str = None,
+        operation: str = None,
+        body_part: str = None,
+        approach: str = None,
+        device: str = None,
+        qualifier: str = None,
+        limit: int = 50,
+    ) -> str:
+        """
+        Filters ICD-10-PCS codes by any combination of axis values.
+        Each axis accepts its code character (e.g. 'T'); section, body system, operation
+        and approach also accept Medical and Surgical names (e.g. 'Resection').
+        A name that does not resolve returns an error listing the valid values.
+        """
+        requested = {
+            "section": (section, PCS_SECTIONS),
+            "body_system": (body_system, {k: v[0] for k, v in PCS_BODY_SYSTEMS.items()}),
+            "operation": (operation, PCS_OPERATIONS),
+            "body_part": (body_part, {}),
+            "approach": (PCS_APPROACH_ALIASES.get(str(approach).lower(), approach), PCS_APPROACHES),
+            "device": (device, {}),
+            "qualifier": (qualifier, {}),
+        }
+        filters = {}
+        for axis, (value, labels) in requested.items():
+            try:
+                filters[axis] = self._resolve_pcs_value(value, labels)
+            except ValueError as e:
+                error = {"error": f"Invalid {axis} '{str(value).strip()}': {e.args[0]}"}
+                if labels:
+                    error["valid_values"] = e.args[1] if len(e.args) > 1 else labels
+                return json.dumps(error, ensure_ascii=False)
+        filters = {axis: value for axis, value in filters.items() if value}
+
+        if not filters:
+            return json.dumps(
+                {"error": "At least one PCS axis filter is required."},
+                ensure_ascii=False,
+            )
+
+        # Operation/approach/body system names are only defined for section 0
+        if "section" not in filters and any(
+            axis in filters for axis in ("body_system", "operation", "approach")
+        ):
+            filters["section"] = "0"
+
+        where = " AND ".join(f"{axis} = ?" for axis in filters)
+        sql = (
+            f"SELECT code, name_zh, name_en, {', '.join(PCS_AXES)} FROM procedures "
+            f"WHERE {where} ORDER BY code LIMIT ?"
+        )
+        rows = self._query_db(sql, tuple(filters.values()) + (int(limit),))
+
+        for row in rows:
+            if row["section"] == "0":
+                row["axis_labels"] = {
+                    "body_system": PCS_BODY_SYSTEMS.get(row["body_system"], (None,))[0],
+                    "operation": PCS_OPERATIONS.get(row["operation"]),
+                    "approach": PCS_APPROACHES.get(row["approach"]),
+                }
+
+        return json.dumps(
+            {"filters": filters, "total_found": len(rows), "results": rows},
+            ensure_ascii=False,
+        )
+
+    def _resolve_pcs_value(self, value: str, labels: dict) -> str:
+        """
+        Normalizes an axis filter to its code character, accepting label names.
+        Raises ValueError (message, candidate labels) when a name does not resolve.
+        """
+        if value is None or not str(value).strip():
+            return None
+        value = str(value).strip()
+        if len(value) == 1:
+            return value.upper()
+        if not labels:
+            raise ValueError("this axis only accepts a single code character")
+        for char, label in labels.items():
+            if label.lower() == value.lower():
+                return char
+        # Fall back to a partial name match when it is unambiguous
+        matches = {c: label for c, label in labels.items() if value.lower() in label.lower()}
+        if len(matches) == 1:
+            return next(iter(matches))
+        if matches:
+            raise ValueError("ambiguous name", matches)
+        raise ValueError("unknown name", labels)
@@ -0,0 +1,147 @@
+"""
+Lab Calculators - 衍生檢驗計算
+由已測得的檢驗值（以 LOINC 碼為鍵）推算 eGFR（CKD-EPI 2021）、計算型 LDL（Friedewald）、
+陰離子間隙、白蛋白校正鈣與 HOMA-IR；所有公式以陣列運算，可一次計算多位病人
+"""
+
+from typing import Dict
+
+import numpy as np
+
+# Measured inputs and the unit each formula expects them in
+INPUT_UNITS = {
+    "2160-0": "mg/dL",  # Creatinine
+    "2093-3": "mg/dL",  # Total cholesterol
+    "2085-9": "mg/dL",  # HDL cholesterol
+    "2571-8": "mg/dL",  # Triglyceride
+    "2951-2": "mmol/L",  # Sodium
+    "2075-0": "mmol/L",  # Chloride
+    "1963-8": "mmol/L",  # Bicarbonate
+    "2028-9": "mmol/L",  # Carbon dioxide, total
+    "17861-6": "mg/dL",  # Calcium
+    "2000-8": "mg/dL",  # Calcium (serum/plasma)
+    "1751-7": "g/dL",  # Albumin
+    "1558-6": "mg/dL",  # Fasting glucose
+    "20448-7": "uIU/mL",  # Insulin
+}
+
+# Derived results with their own reference ranges (None = no limit on that side).
+# Keys are derived codes; "loinc" is the LOINC code reported for the result, or None
+# for indices without one (HOMA-IR), which must not be presented as a LOINC code.
+DERIVED_TESTS = {
+    "98979-8": {
+        "loinc": "98979-8",
+        "name_zh": "腎絲球過濾率（CKD-EPI 2021 推算）",
+        "name_en": "eGFR (CKD-EPI 2021)",
+        "unit": "mL/min/1.73m2",
+        "low": 90.0,
+        "high": None,
+        "formula": "142 × min(Scr/κ,1)^α × max(Scr/κ,1)^-1.200 × 0.9938^年齡 × 1.012（女性）",
+        "inputs": ["2160-0"],
+    },
+    "13457-7": {
+        "loinc": "13457-7",
+        "name_zh": "低密度脂蛋白膽固醇（Friedewald 計算）",
+        "name_en": "LDL cholesterol (calculated)",
+        "unit": "mg/dL",
+        "low": None,
+        "high": 130.0,
+        "formula": "總膽固醇 - HDL - 三酸甘油酯/5（三酸甘油酯 < 400 mg/dL）",
+        "inputs": ["2093-3", "2085-9", "2571-8"],
+    },
+    "33037-3": {
+        "loinc": "33037-3",
+        "name_zh": "陰離子間隙",
+        "name_en": "Anion gap",
+        "unit": "mmol/L",
+        "low": 8.0,
+        "high": 16.0,
+        "formula": "Na - (Cl + HCO3)",
+        "inputs": ["2951-2", "2075-0", "1963-8|2028-9"],
+    },
+    "29265-6": {
+        "loinc": "29265-6",
+        "name_zh": "白蛋白校正鈣",
+        "name_en": "Calcium corrected for albumin",
+        "unit": "mg/dL",
+        "low": 8.5,
+        "high": 10.5,
+        "formula": "Ca + 0.8 × (4.0 - 白蛋白)",
+        "inputs": ["17861-6|2000-8", "1751-7"],
+    },
+    "HOMA-IR": {
+        "loinc": None,
+        "name_zh": "胰島素阻抗指數",
+        "name_en": "HOMA-IR",
+        "unit": "ratio",
+        "low": None,
+        "high": 2.5,
+        "formula": "空腹血糖 (mg/dL) × 空腹胰島素 (uIU/mL) / 405",
+        "inputs": ["1558-6", "20448-7"],
+    },
+}
+
+FRIEDEWALD_MAX_TG = 400.0
+EGFR_MIN_AGE = 18
+
+
+def _column(values: Dict[str, np.ndarray], key: str, n: int) -> np.ndarray:
+    """取出輸入欄位；'a|b' 表示優先取 a，缺值時改用 b（都沒有時為 NaN）"""
+    column = np.full(n, np.nan)
+    for code in key.split("|"):
+        if code in values:
+            column = np.where(np.isnan(column), np.asarray(values[code], dtype=float), column)
+    return column
+
+
+def egfr_ckd_epi(creatinine: np.ndarray, age: np.ndarray, gender: np.ndarray) -> np.ndarray:
+    """CKD-EPI 2021（不含種族係數）；未滿 18 歲或性別不明時為 NaN"""
+    female = gender == "F"
+    kappa = np.where(female, 0.7, 0.9)
+    alpha = np.where(female, -0.241, -0.302)
+    ratio = creatinine / kappa
+    egfr = (
+        142.0
+        * np.minimum(ratio, 1.0) ** alpha
+        * np.maximum(ratio, 1.0) ** -1.200
+        * 0.9938**age
+        * np.where(female, 1.012, 1.0)
+    )
+    valid = np.isin(gender, ("M", "F")) & (age >= EGFR_MIN_AGE) & (creatinine > 0)
+    return np.where(valid, egfr, np.nan)
+
+
+def derive(
+    values: Dict[str, np.ndarray], age: np.ndarray, gender: np.ndarray
+) -> Dict[str, np.ndarray]:
+    """
+    計算所有衍生檢驗
+
+    Args:
+        values: LOINC 碼 -> (n,) 檢驗值（單位依 INPUT_UNITS；缺值為 NaN）
+        age: (n,) 年齡
+        gender: (n,) 性別（M / F / all）
+
+    Returns:
+        衍生代碼（DERIVED_TESTS 的鍵）-> (n,) 計算結果（輸入不足或不適用時為 NaN）
+    """
+    age = np.asarray(age, dtype=float)
+    gender = np.asarray(gender)
+    n = len(age)
+    col = {
+        key: _column(values, key, n)
+        for test in DERIVED_TESTS.values()
+        for key in test["inputs"]
+    }
+
+    tg = col["2571-8"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return {
+            "98979-8": egfr_ckd_epi(col["2160-0"], age, gender),
+            "13457-7": np.where(
+                tg < FRIEDEWALD_MAX_TG, col["2093-3"] - col["2085-9"] - tg / 5.0, np.nan
+            ),
+            "33037-3": col["2951-2"] - (col["2075-0"] + col["1963-8|2028-9"]),
+            "29265-6": col["17861-6|2000-8"] + 0.8 * (4.0 - col["1751-7"]),
+            "HOMA-IR": col["1558-6"] * col["20448-7"] / 405.0,
+        }
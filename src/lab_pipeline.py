@@ -0,0 +1,384 @@
+"""
+Lab Pipeline - 大量檢驗結果檔案判讀
+串流讀取 CSV / NDJSON（patient_id, age, gender, loinc_code, value, unit, 選填 date），
+分塊交給 worker pool 判讀並依原順序輸出 NDJSON，記憶體用量與檔案大小無關；
+同一病人同一採檢日的檢驗值另外推算衍生檢驗（eGFR、計算型 LDL 等）。
+輸入需依病人分組（同一病人的列相鄰），區塊只在病人交界處切開，
+衍生結果因此與 chunk_size、workers 無關
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from lab_calculators import DERIVED_TESTS, INPUT_UNITS, derive
+from lab_service import CRITICAL_FLAGS, FLAG_DETAILS, LabService
+from lab_trends import format_day, parse_timestamp
+from unit_conversion import compile_conversion, convert_values, normalize_unit
+from utils import log_info
+
+_GENDER_ALIASES = {
+    "m": "M",
+    "male": "M",
+    "男": "M",
+    "f": "F",
+    "female": "F",
+    "女": "F",
+}
+
+# Set in each worker process by _init_worker
+_worker_service: Optional[LabService] = None
+
+
+def normalize_gender(value) -> str:
+    """性別正規化為 M / F / all"""
+    return _GENDER_ALIASES.get(str(value or "").strip().lower(), "all")
+
+
+def detect_format(path: str) -> str:
+    """依副檔名（或第一個非空白字元）判斷檔案格式：csv 或 ndjson"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        return "csv"
+    if ext in (".ndjson", ".jsonl", ".json"):
+        return "ndjson"
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for line in f:
+            if line.strip():
+                return "ndjson" if line.lstrip().startswith("{") else "csv"
+    return "csv"
+
+
+def iter_records(path: str, file_format: Optional[str] = None) -> Iterator[Dict]:
+    """逐列讀取輸入檔（不一次載入整個檔案）；無法解析的 NDJSON 列以 _error 標記"""
+    file_format = file_format or detect_format(path)
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if file_format == "csv":
+            for row in csv.DictReader(f):
+                yield row
+            return
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield {"_error": f"line {line_no}: invalid JSON ({e.msg})"}
+
+
+def iter_chunks(records: Iterator[Dict], chunk_size: int) -> Iterator[List[Dict]]:
+    """
+    將輸入列分成約 chunk_size 列的區塊，只在 patient_id 改變處切開，
+    讓同一病人的所有列落在同一區塊（單一病人列數超過 chunk_size 時區塊會變大）
+    """
+    chunk: List[Dict] = []
+    for row in records:
+        if len(chunk) >= chunk_size:
+            patient_id = row.get("patient_id")
+            if patient_id in (None, "") or patient_id != chunk[-1].get("patient_id"):
+                yield chunk
+                chunk = []
+        chunk.append(row)
+    if chunk:
+        yield chunk
+
+
+def collection_day(value) -> Optional[str]:
+    """採檢日（YYYY-MM-DD）；無法解析的日期保留原字串，未提供時為 None"""
+    if value in (None, ""):
+        return None
+    day = parse_timestamp(value)
+    return format_day(day) if day is not None else str(value).strip()
+
+
+def interpret_chunk(service: LabService, rows: List[Dict]) -> List[Dict]:
+    """
+    判讀一個區塊的檢驗結果
+
+    參考值以 (LOINC 碼, 年齡, 性別) 在區塊內快取；單位與參考值不同的數值先換算，
+    換算與 L/N/H 旗標皆以陣列一次計算。區塊結尾附上各病人、各採檢日的衍生檢驗
+    （derived: true）；區塊須包含病人的所有列（見 iter_chunks）
+    """
+    index = service._get_reference_index()
+    cache: Dict[tuple, Optional[Dict]] = {}
+    outputs: List[Dict] = []
+    visits: Dict[tuple, Dict] = {}  # (patient_id, date) -> age, gender, calculator inputs
+    pending = []  # (output position, value, low, high, crit low, crit high, (scale, offset) or None)
+
+    for row in rows:
+        record = {
+            "patient_id": row.get("patient_id"),
+            "loinc_code": row.get("loinc_code"),
+            "value": row.get("value"),
+            "unit": row.get("unit") or None,
+        }
+        outputs.append(record)
+        if "_error" in row:
+            record["error"] = row["_error"]
+            continue
+
+        code = str(row.get("loinc_code") or "").strip()
+        try:
+            value = float(row.get("value"))
+            age = float(row.get("age"))
+        except (TypeError, ValueError):
+            record["error"] = "value 或 age 不是數值"
+            continue
+        record["value"] = value
+        gender = normalize_gender(row.get("gender"))
+
+        # 衍生計算的輸入（含不在參考值表中的項目，如 HCO3、胰島素），只在同一次採檢內組合
+        patient_id = row.get("patient_id")
+        if code in INPUT_UNITS and patient_id not in (None, ""):
+            to_input = (1.0, 0.0)
+            if record["unit"]:
+                to_input = compile_conversion(code, record["unit"], INPUT_UNITS[code])
+            if to_input is not None:
+                visit = visits.setdefault(
+                    (patient_id, collection_day(row.get("date"))),
+                    {"age": age, "gender": gender, "values": {}, "conflicts": set()},
+                )
+                converted = value * to_input[0] + to_input[1]
+                previous = visit["values"].setdefault(code, converted)
+                if not np.isclose(previous, converted):
+                    # Same test twice in one visit with different results: do not guess
+                    visit["conflicts"].add(code)
+
+        key = (code, age, gender)
+        if key not in cache:
+            ref = index.lookup(code, age, gender)
+            critical = None
+            if ref is not None:
+                critical = LabService._critical_limits(index, code, age, gender, ref["unit"])
+            cache[key] = (ref, critical)
+        ref, critical = cache[key]
+        test = index.get_test(code)
+        if test is None:
+            record["error"] = f"找不到 LOINC 碼: {code}"
+            continue
+        if ref is None:
+            record["error"] = f"找不到適用於年齡 {row.get('age')} 歲、性別 {gender} 的參考值"
+            continue
+
+        record.update(
+            {
+                "test_name_zh": test["loinc_name_zh"],
+                "reference_low": ref["range_low"],
+                "reference_high": ref["range_high"],
+                "reference_unit": ref["unit"],
+            }
+        )
+        conversion = None
+        unit = record["unit"]
+        if unit and ref["unit"] and normalize_unit(unit) != normalize_unit(ref["unit"]):
+            conversion = compile_conversion(code, unit, ref["unit"])
+            if conversion is None:
+                record["error"] = f"無法將單位 {unit} 換算為參考值單位 {ref['unit']}"
+                continue
+        critical = critical or {}
+        pending.append(
+            (
+                len(outputs) - 1,
+                value,
+                ref["range_low"],
+                ref["range_high"],
+                critical.get("low"),
+                critical.get("high"),
+                conversion,
+            )
+        )
+
+    if pending:
+        values = np.array([p[1] for p in pending])
+        needs_conversion = np.array([p[6] is not None for p in pending])
+        if needs_conversion.any():
+            scales = np.array([p[6][0] if p[6] else 1.0 for p in pending])
+            offsets = np.array([p[6][1] if p[6] else 0.0 for p in pending])
+            values = np.where(
+                needs_conversion, np.round(convert_values(values, scales, offsets), 4), values
+            )
+        flags = LabService._flag_values(
+            values,
+            np.array([p[2] for p in pending], dtype=float),
+            np.array([p[3] for p in pending], dtype=float),
+            np.array([p[4] for p in pending], dtype=float),
+            np.array([p[5] for p in pending], dtype=float),
+        )
+        for (pos, original, *_, conversion), value, flag in zip(pending, values, flags):
+            flag = str(flag)
+            record = outputs[pos]
+            if conversion is not None:
+                record["original_value"] = original
+                record["original_unit"] = record["unit"]
+                record["value"] = float(value)
+                record["unit"] = record["reference_unit"]
+            record["flag"] = flag
+            record["status"] = FLAG_DETAILS[flag][0]
+    outputs.extend(derived_records(visits))
+    return outputs
+
+
+def derived_records(visits: Dict[tuple, Dict]) -> List[Dict]:
+    """
+    計算多次採檢的衍生檢驗，公式與旗標皆對所有採檢以陣列一次計算
+
+    Args:
+        visits: (patient_id, date) -> {"age", "gender", "values": LOINC 碼 -> 公式單位的數值,
+                "conflicts": 同次採檢數值不一致、不納入計算的 LOINC 碼（可省略）}
+
+    Returns:
+        衍生檢驗輸出列（依採檢出現順序、項目排序；輸入不足的項目略過）
+    """
+    if not visits:
+        return []
+    keys = list(visits)
+    inputs: Dict[str, np.ndarray] = {}
+    for pos, key in enumerate(keys):
+        conflicts = visits[key].get("conflicts", ())
+        for code, value in visits[key]["values"].items():
+            if code not in conflicts:
+                inputs.setdefault(code, np.full(len(keys), np.nan))[pos] = value
+    derived = derive(
+        inputs,
+        np.array([visits[k]["age"] for k in keys], dtype=float),
+        np.array([visits[k]["gender"] for k in keys]),
+    )
+
+    records = []
+    for order, (code, values) in enumerate(derived.items()):
+        test = DERIVED_TESTS[code]
+        present = np.flatnonzero(~np.isnan(values))
+        if not len(present):
+            continue
+        flags = LabService._flag_values(
+            values[present],
+            np.array(test["low"], dtype=float),
+            np.array(test["high"], dtype=float),
+        )
+        for pos, value, flag in zip(present, values[present], flags):
+            flag = str(flag)
+            records.append(
+                (
+                    pos,
+                    order,
+                    {
+                        "patient_id": keys[pos][0],
+                        "date": keys[pos][1],
+                        "derived_code": code,
+                        "loinc_code": test["loinc"],
+                        "value": round(float(value), 2),
+                        "unit": test["unit"],
+                        "derived": True,
+                        "test_name_zh": test["name_zh"],
+                        "reference_low": test["low"],
+                        "reference_high": test["high"],
+                        "reference_unit": test["unit"],
+                        "flag": flag,
+                        "status": FLAG_DETAILS[flag][0],
+                    },
+                )
+            )
+    records.sort(key=lambda item: item[:2])
+    return [record for *_, record in records]
+
+
+def _init_worker(data_dir: str):
+    global _worker_service
+    _worker_service = LabService(data_dir)
+
+
+def _interpret_chunk_worker(rows: List[Dict]) -> tuple:
+    """Worker 端判讀並序列化，只把 NDJSON 文字與計數傳回主程序"""
+    outputs = interpret_chunk(_worker_service, rows)
+    return _serialize(outputs)
+
+
+def _serialize(outputs: List[Dict]) -> tuple:
+    measured = [o for o in outputs if not o.get("derived")]
+    abnormal = sum(1 for o in measured if o.get("flag", "N") != "N")
+    critical = sum(1 for o in measured if o.get("flag") in CRITICAL_FLAGS)
+    errors = sum(1 for o in measured if "error" in o)
+    text = "".join(json.dumps(o, ensure_ascii=False) + "\n" for o in outputs)
+    return text, len(measured), abnormal, critical, errors, len(outputs) - len(measured)
+
+
+def run_pipeline(
+    input_path: str,
+    output_path: str,
+    data_dir: str,
+    chunk_size: int = 5000,
+    workers: int = 1,
+    file_format: Optional[str] = None,
+    lab_service: Optional[LabService] = None,
+) -> Dict:
+    """
+    串流判讀整個檔案並寫出 NDJSON
+
+    Args:
+        input_path: CSV 或 NDJSON 檔案
+        output_path: 輸出 NDJSON 路徑（'-' 表示標準輸出）
+        data_dir: lab_tests.db 所在目錄（worker 各自載入參考值索引）
+        chunk_size: 每個區塊的列數（只在病人交界處切開，輸入需依病人分組）
+        workers: worker 程序數；1 表示在目前程序內處理。worker 以 spawn 啟動（不 fork
+                 可能已有背景執行緒的目前程序），__main__ 模組須以 if __name__ 保護
+        file_format: 'csv' / 'ndjson'，預設自動判斷
+        lab_service: workers=1 時可重用的 LabService
+
+    Returns:
+        處理摘要（列數、異常數、危急值數、錯誤數、衍生檢驗數、耗時）
+    """
+    started = time.perf_counter()
+    records = iter_records(input_path, file_format)
+    chunks = iter_chunks(records, max(1, int(chunk_size)))
+    summary = {"rows": 0, "abnormal": 0, "critical": 0, "errors": 0, "derived": 0}
+
+    out = sys.stdout if output_path == "-" else open(output_path, "w", encoding="utf-8")
+    try:
+
+        def write(result):
+            text, rows, abnormal, critical, errors, derived = result
+            out.write(text)
+            summary["rows"] += rows
+            summary["abnormal"] += abnormal
+            summary["critical"] += critical
+            summary["errors"] += errors
+            summary["derived"] += derived
+
+        if workers <= 1:
+            service = lab_service or LabService(data_dir)
+            for chunk in chunks:
+                write(_serialize(interpret_chunk(service, chunk)))
+        else:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(data_dir,),
+            ) as pool:
+                # Bounded in-flight window keeps memory constant and output in input order
+                in_flight = deque()
+                for chunk in chunks:
+                    in_flight.append(pool.submit(_interpret_chunk_worker, chunk))
+                    if len(in_flight) >= workers * 2:
+                        write(in_flight.popleft().result())
+                while in_flight:
+                    write(in_flight.popleft().result())
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    summary["elapsed_seconds"] = round(time.perf_counter() - started, 2)
+    summary["rows_per_second"] = (
+        round(summary["rows"] / summary["elapsed_seconds"]) if summary["elapsed_seconds"] else None
+    )
+    summary["output"] = output_path
+    log_info(f"Lab file interpreted: {summary}")
+    return summary
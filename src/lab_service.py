@@ -3,13 +3,116 @@ Laboratory Service - LOINC 碼對照與檢驗參考值查詢
 整合台灣常用檢驗項目、LOINC 標準碼、參考值範圍
 """
 
+import csv
 import json
 import os
 import sqlite3
-from typing import Dict, List, Literal, Optional
+import threading
+from typing import Dict, List, Literal, Optional, Union
 
+import numpy as np
+
+from lab_calculators import DERIVED_TESTS, INPUT_UNITS, derive
+from lab_trends import (
+    DAYS_PER_YEAR,
+    DEFAULT_DELTA_PERCENT,
+    DELTA_THRESHOLDS,
+    analyze_series,
+    delta_checks,
+    format_day,
+    parse_timestamp,
+    percent_change,
+    round_or_none,
+    trend_direction,
+)
+from reference_index import ReferenceRangeIndex
+from unit_conversion import compile_conversion, convert_values, normalize_unit
 from utils import log_error, log_info
 
+# Bundled data directory (used when data_dir lacks the CSV files)
+BUNDLED_DATA_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"
+)
+COMMON_TESTS_FILE = "lab_tests.csv"
+DEFAULT_REFERENCE_FILE = "lab_reference_ranges.csv"
+REFERENCE_SOURCES_DIR = "reference_ranges"
+
+# Columns of the loinc_mapping FTS5 index with their bm25 weights (names rank above the code)
+LOINC_FTS_COLUMNS = [
+    ("loinc_code", 2.0),
+    ("loinc_name_en", 5.0),
+    ("loinc_name_zh", 10.0),
+    ("common_name_zh", 10.0),
+]
+
+# The trigram tokenizer cannot match queries shorter than three characters
+FTS_MIN_QUERY_LENGTH = 3
+
+# Relevance multipliers applied to bm25 so frequently ordered tests rank first:
+# Taiwan common tests, and LOINC COMMON_TEST_RANK (1 = most common, 0 = unranked)
+TAIWAN_COMMON_BOOST = 2.0
+COMMON_RANK_BOOST = 1.0
+COMMON_RANK_SCALE = 100.0
+
+
+# Triggers keeping the external-content FTS index in step with loinc_mapping writes
+LOINC_FTS_TRIGGERS = ("loinc_mapping_fts_ai", "loinc_mapping_fts_ad", "loinc_mapping_fts_au")
+
+
+def create_loinc_fts_triggers(conn: sqlite3.Connection):
+    """Creates the AFTER INSERT/DELETE/UPDATE triggers that sync loinc_mapping_fts."""
+    columns = ", ".join(name for name, _ in LOINC_FTS_COLUMNS)
+    new_values = ", ".join(f"new.{name}" for name, _ in LOINC_FTS_COLUMNS)
+    old_values = ", ".join(f"old.{name}" for name, _ in LOINC_FTS_COLUMNS)
+    insert = f"INSERT INTO loinc_mapping_fts(rowid, {columns}) VALUES (new.id, {new_values});"
+    delete = (
+        f"INSERT INTO loinc_mapping_fts(loinc_mapping_fts, rowid, {columns}) "
+        f"VALUES ('delete', old.id, {old_values});"
+    )
+    ai, ad, au = LOINC_FTS_TRIGGERS
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS {ai} AFTER INSERT ON loinc_mapping BEGIN {insert} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS {ad} AFTER DELETE ON loinc_mapping BEGIN {delete} END")
+    conn.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {au} AFTER UPDATE ON loinc_mapping BEGIN {delete} {insert} END"
+    )
+
+
+def build_loinc_fts(conn: sqlite3.Connection) -> bool:
+    """(Re)builds the trigram FTS5 index over loinc_mapping; returns False if unsupported."""
+    columns = ", ".join(name for name, _ in LOINC_FTS_COLUMNS)
+    try:
+        for trigger in LOINC_FTS_TRIGGERS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        conn.execute("DROP TABLE IF EXISTS loinc_mapping_fts")
+        conn.execute(
+            f"""
+            CREATE VIRTUAL TABLE loinc_mapping_fts USING fts5(
+                {columns},
+                content='loinc_mapping', content_rowid='id', tokenize='trigram'
+            )
+            """
+        )
+        conn.execute("INSERT INTO loinc_mapping_fts(loinc_mapping_fts) VALUES('rebuild')")
+        create_loinc_fts_triggers(conn)
+        conn.commit()
+        log_info("Built loinc_mapping FTS index.")
+        return True
+    except sqlite3.Error as e:
+        log_error(f"FTS5 trigram index unavailable, using LIKE search: {e}")
+        conn.rollback()
+        return False
+
+
+# Result flag -> (status, clinical significance)
+FLAG_DETAILS = {
+    "L": ("偏低 (Low)", "低於正常參考值，建議進一步評估"),
+    "H": ("偏高 (High)", "高於正常參考值，建議進一步評估"),
+    "N": ("正常 (Normal)", "數值在正常範圍內"),
+    "LL": ("危急偏低 (Critical Low)", "低於危急值，需立即通知醫師處理"),
+    "HH": ("危急偏高 (Critical High)", "高於危急值，需立即通知醫師處理"),
+}
+CRITICAL_FLAGS = ("LL", "HH")
+
 
 class LabService:
     """
@@ -29,7 +132,17 @@ class LabService:
         """
         self.data_dir = data_dir
         self.db_path = os.path.join(data_dir, "lab_tests.db")
+
+        # In-memory LOINC / reference range index, rebuilt when lab_tests.db changes
+        self._reference_index = None
+        self._reference_mtime = None
+        self._reference_lock = threading.Lock()
+        self._fts_checked = False
+
         self._initialize_database()
+        self._sync_reference_ranges()
+        self._ensure_critical_ranges()
+        self._get_reference_index()
         log_info("Lab Service initialized")
 
     def _initialize_database(self):
@@ -74,14 +187,17 @@ class LabService:
                     range_high REAL,
                     unit TEXT,
                     interpretation TEXT,
+                    source TEXT,
+                    version TEXT,
+                    is_default INTEGER DEFAULT 1,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (loinc_code) REFERENCES loinc_mapping(loinc_code)
                 )
             """
             )
 
-            # 3. 插入台灣常用檢驗項目資料
-            self._populate_taiwan_common_tests(cursor)
+            # 3. 插入台灣常用檢驗項目資料（參考值由 _sync_reference_ranges 自 CSV 載入）
+            self._load_common_tests(cursor)
 
             # 4. 建立索引
             cursor.execute(
@@ -98,6 +214,7 @@ class LabService:
             )
 
             conn.commit()
+            build_loinc_fts(conn)
             log_info("Lab database initialized successfully")
 
         except Exception as e:
@@ -106,683 +223,277 @@ class LabService:
         finally:
             conn.close()
 
-    def _populate_taiwan_common_tests(self, cursor):
-        """填充台灣常用檢驗項目（基於真實醫院檢驗科資料）"""
+    def _data_file(self, name: str) -> str:
+        """資料檔路徑：優先使用 data_dir，找不到時使用專案內附的 data 目錄"""
+        path = os.path.join(self.data_dir, name)
+        if os.path.exists(path):
+            return path
+        return os.path.join(BUNDLED_DATA_DIR, name)
 
-        # 台灣常用檢驗項目與 LOINC 對照表
-        common_tests = [
-            # === 血液常規 (CBC) ===
-            {
-                "loinc_code": "6690-2",
-                "loinc_name_en": "Leukocytes [#/volume] in Blood by Automated count",
-                "loinc_name_zh": "白血球計數",
-                "common_name_zh": "WBC",
-                "category": "血液常規",
-                "specimen_type": "全血",
-                "unit": "10^3/uL",
-                "method": "自動血球計數儀",
-            },
-            {
-                "loinc_code": "789-8",
-                "loinc_name_en": "Erythrocytes [#/volume] in Blood by Automated count",
-                "loinc_name_zh": "紅血球計數",
-                "common_name_zh": "RBC",
-                "category": "血液常規",
-                "specimen_type": "全血",
-                "unit": "10^6/uL",
-                "method": "自動血球計數儀",
-            },
-            {
-                "loinc_code": "718-7",
-                "loinc_name_en": "Hemoglobin [Mass/volume] in Blood",
-                "loinc_name_zh": "血紅素",
-                "common_name_zh": "Hb",
-                "category": "血液常規",
-                "specimen_type": "全血",
-                "unit": "g/dL",
-                "method": "自動血球計數儀",
-            },
-            {
-                "loinc_code": "4544-3",
-                "loinc_name_en": "Hematocrit [Volume Fraction] of Blood by Automated count",
-                "loinc_name_zh": "血球容積比",
-                "common_name_zh": "Hct",
-                "category": "血液常規",
-                "specimen_type": "全血",
-                "unit": "%",
-                "method": "自動血球計數儀",
-            },
-            {
-                "loinc_code": "777-3",
-                "loinc_name_en": "Platelets [#/volume] in Blood by Automated count",
-                "loinc_name_zh": "血小板計數",
-                "common_name_zh": "PLT",
-                "category": "血液常規",
-                "specimen_type": "全血",
-                "unit": "10^3/uL",
-                "method": "自動血球計數儀",
-            },
-            # === 生化檢驗 - 血糖相關 ===
-            {
-                "loinc_code": "1558-6",
-                "loinc_name_en": "Fasting glucose [Mass/volume] in Serum or Plasma",
-                "loinc_name_zh": "空腹血糖",
-                "common_name_zh": "AC Sugar, FBS",
-                "category": "生化檢驗-血糖",
-                "specimen_type": "血清/血漿",
-                "unit": "mg/dL",
-                "method": "酵素法",
-            },
-            {
-                "loinc_code": "2345-7",
-                "loinc_name_en": "Glucose [Mass/volume] in Serum or Plasma",
-                "loinc_name_zh": "血糖",
-                "common_name_zh": "Glucose",
-                "category": "生化檢驗-血糖",
-                "specimen_type": "血清/血漿",
-                "unit": "mg/dL",
-                "method": "酵素法",
-            },
-            {
-                "loinc_code": "4548-4",
-                "loinc_name_en": "Hemoglobin A1c/Hemoglobin.total in Blood",
-                "loinc_name_zh": "糖化血色素",
-                "common_name_zh": "HbA1c",
-                "category": "生化檢驗-血糖",
-                "specimen_type": "全血",
-                "unit": "%",
-                "method": "HPLC",
-            },
-            # === 生化檢驗 - 血脂肪 ===
-            {
-                "loinc_code": "2093-3",
-                "loinc_name_en": "Cholesterol [Mass/volume] in Serum or Plasma",
-                "loinc_name_zh": "總膽固醇",
-                "common_name_zh": "T-Chol",
-                "category": "生化檢驗-血脂",
-                "specimen_type": "血清/血漿",
-                "unit": "mg/dL",
-                "method": "酵素法",
-            },
-            {
-                "loinc_code": "2571-8",
-                "loinc_name_en": "Triglyceride [Mass/volume] in Serum or Plasma",
-                "loinc_name_zh": "三酸甘油酯",
-                "common_name_zh": "TG",
-                "category": "生化檢驗-血脂",
-                "specimen_type": "血清/血漿",
-                "unit": "mg/dL",
-                "method": "酵素法",
-            },
-            {
-                "loinc_code": "2085-9",
-                "loinc_name_en": "Cholesterol in HDL [Mass/volume] in Serum or Plasma",
-                "loinc_name_zh": "高密度脂蛋白膽固醇",
-                "common_name_zh": "HDL-C",
-                "category": "生化檢驗-血脂",
-                "specimen_type": "血清/血漿",
-                "unit": "mg/dL",
-                "method": "直接法",
-            },
-            {
-                "loinc_code": "2089-1",
-                "loinc_name_en": "Cholesterol in LDL [Mass/volume] in Serum or Plasma",
-                "loinc_name_zh": "低密度脂蛋白膽固醇",
-                "common_name_zh": "LDL-C",
-                "category": "生化檢驗-血脂",
-                "specimen_type": "血清/血漿",
-                "unit": "mg/dL",
-                "method": "計算法/直接法",
-            },
-            # === 生化檢驗 - 肝功能 ===
-            {
-                "loinc_code": "1742-6",
-                "loinc_name_en": "Alanine aminotransferase [Enzymatic activity/volume] in Serum or Plasma",
-                "loinc_name_zh": "丙胺酸轉胺酶",
-                "common_name_zh": "ALT, GPT",
-                "category": "生化檢驗-肝功能",
-                "specimen_type": "血清/血漿",
-                "unit": "U/L",
-                "method": "酵素法",
-            },
-            {
-                "loinc_code": "1920-8",
-                "loinc_name_en": "Aspartate aminotransferase [Enzymatic activity/volume] in Serum or Plasma",
-                "loinc_name_zh": "天門冬胺酸轉胺酶",
-                "common_name_zh": "AST, GOT",
-                "category": "生化檢驗-肝功能",
-                "specimen_type": "血清/血漿",
-                "unit": "U/L",
-                "method": "酵素法",
-            },
-            {
-                "loinc_code": "1975-2",
-                "loinc_name_en": "Bilirubin.total [Mass/volume] in Serum or Plasma",
-                "loinc_name_zh": "總膽紅素",
-                "common_name_zh": "T-Bil",
-                "category": "生化檢驗-肝功能",
-                "specimen_type": "血清/血漿",
-                "unit": "mg/dL",
-                "method": "化學法",
-            },
-            # === 生化檢驗 - 腎功能 ===
-            {
-                "loinc_code": "2160-0",
-                "loinc_name_en": "Creatinine [Mass/volume] in Serum or Plasma",
-                "loinc_name_zh": "肌酸酐",
-                "common_name_zh": "Cr",
-                "category": "生化檢驗-腎功能",
-                "specimen_type": "血清/血漿",
-                "unit": "mg/dL",
-                "method": "Jaffe法/酵素法",
-            },
-            {
-                "loinc_code": "3094-0",
-                "loinc_name_en": "Urea nitrogen [Mass/volume] in Serum or Plasma",
-                "loinc_name_zh": "尿素氮",
-                "common_name_zh": "BUN",
-                "category": "生化檢驗-腎功能",
-                "specimen_type": "血清/血漿",
-                "unit": "mg/dL",
-                "method": "酵素法",
-            },
-            {
-                "loinc_code": "33914-3",
-                "loinc_name_en": "Glomerular filtration rate/1.73 sq M.predicted [Volume Rate/Area] in Serum or Plasma by Creatinine-based formula (CKD-EPI)",
-                "loinc_name_zh": "腎絲球過濾率",
-                "common_name_zh": "eGFR",
-                "category": "生化檢驗-腎功能",
-                "specimen_type": "血清/血漿",
-                "unit": "mL/min/1.73m2",
-                "method": "CKD-EPI 公式計算",
-            },
-            # === 生化檢驗 - 電解質 ===
-            {
-                "loinc_code": "2951-2",
-                "loinc_name_en": "Sodium [Moles/volume] in Serum or Plasma",
-                "loinc_name_zh": "鈉離子",
-                "common_name_zh": "Na",
-                "category": "生化檢驗-電解質",
-                "specimen_type": "血清/血漿",
-                "unit": "mmol/L",
-                "method": "離子選擇電極法",
-            },
-            {
-                "loinc_code": "2823-3",
-                "loinc_name_en": "Potassium [Moles/volume] in Serum or Plasma",
-                "loinc_name_zh": "鉀離子",
-                "common_name_zh": "K",
-                "category": "生化檢驗-電解質",
-                "specimen_type": "血清/血漿",
-                "unit": "mmol/L",
-                "method": "離子選擇電極法",
-            },
-            {
-                "loinc_code": "2075-0",
-                "loinc_name_en": "Chloride [Moles/volume] in Serum or Plasma",
-                "loinc_name_zh": "氯離子",
-                "common_name_zh": "Cl",
-                "category": "生化檢驗-電解質",
-                "specimen_type": "血清/血漿",
-                "unit": "mmol/L",
-                "method": "離子選擇電極法",
-            },
-            # === 甲狀腺功能 ===
-            {
-                "loinc_code": "3016-3",
-                "loinc_name_en": "Thyrotropin [Units/volume] in Serum or Plasma",
-                "loinc_name_zh": "促甲狀腺激素",
-                "common_name_zh": "TSH",
-                "category": "內分泌-甲狀腺",
-                "specimen_type": "血清/血漿",
-                "unit": "uIU/mL",
-                "method": "化學冷光免疫分析",
-            },
-            {
-                "loinc_code": "3053-6",
-                "loinc_name_en": "Thyroxine (T4) free [Mass/volume] in Serum or Plasma",
-                "loinc_name_zh": "游離甲狀腺素",
-                "common_name_zh": "Free T4",
-                "category": "內分泌-甲狀腺",
-                "specimen_type": "血清/血漿",
-                "unit": "ng/dL",
-                "method": "化學冷光免疫分析",
-            },
-            # === 凝血功能 ===
-            {
-                "loinc_code": "5902-2",
-                "loinc_name_en": "Prothrombin time (PT)",
-                "loinc_name_zh": "凝血酶原時間",
-                "common_name_zh": "PT",
-                "category": "凝血功能",
-                "specimen_type": "檸檬酸鈉血漿",
-                "unit": "sec",
-                "method": "凝固法",
-            },
-            {
-                "loinc_code": "6301-6",
-                "loinc_name_en": "INR in Platelet poor plasma by Coagulation assay",
-                "loinc_name_zh": "國際標準化比值",
-                "common_name_zh": "INR",
-                "category": "凝血功能",
-                "specimen_type": "檸檬酸鈉血漿",
-                "unit": "ratio",
-                "method": "凝固法計算",
-            },
-            {
-                "loinc_code": "3173-2",
-                "loinc_name_en": "Activated partial thromboplastin time (aPTT)",
-                "loinc_name_zh": "活化部分凝血活酶時間",
-                "common_name_zh": "aPTT",
-                "category": "凝血功能",
-                "specimen_type": "檸檬酸鈉血漿",
-                "unit": "sec",
-                "method": "凝固法",
-            },
-            # === 發炎指標 ===
-            {
-                "loinc_code": "1988-5",
-                "loinc_name_en": "C reactive protein [Mass/volume] in Serum or Plasma",
-                "loinc_name_zh": "C反應蛋白",
-                "common_name_zh": "CRP",
-                "category": "發炎指標",
-                "specimen_type": "血清/血漿",
-                "unit": "mg/dL",
-                "method": "免疫比濁法",
-            },
-        ]
+    def _load_common_tests(self, cursor):
+        """由 lab_tests.csv 載入台灣常用檢驗項目與 LOINC 對照（基於真實醫院檢驗科資料）"""
+        path = self._data_file(COMMON_TESTS_FILE)
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            common_tests = list(csv.DictReader(f))
 
-        # 插入檢驗項目
-        for test in common_tests:
-            cursor.execute(
-                """
-                INSERT OR IGNORE INTO loinc_mapping
-                (loinc_code, loinc_name_en, loinc_name_zh, common_name_zh, category, specimen_type, unit, method)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """,
+        cursor.executemany(
+            """
+            INSERT OR IGNORE INTO loinc_mapping
+            (loinc_code, loinc_name_en, loinc_name_zh, common_name_zh, category, specimen_type, unit, method)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            [
                 (
                     test["loinc_code"],
                     test["loinc_name_en"],
                     test["loinc_name_zh"],
-                    test["common_name_zh"],
-                    test["category"],
-                    test["specimen_type"],
-                    test["unit"],
-                    test["method"],
-                ),
+                    test["common_name_zh"] or None,
+                    test["category"] or None,
+                    test["specimen_type"] or None,
+                    test["unit"] or None,
+                    test["method"] or None,
+                )
+                for test in common_tests
+            ],
+        )
+        log_info(f"Populated {len(common_tests)} Taiwan common lab tests")
+
+    def _reference_files(self) -> List[Dict]:
+        """
+        參考值來源檔案
+        - lab_reference_ranges.csv：預設參考值（每列的 source 欄為出處）
+        - reference_ranges/<來源>/<版本>.csv：各醫院 / 學會的參考值，每個來源只載入最新版本
+        """
+        files = []
+        default_path = self._data_file(DEFAULT_REFERENCE_FILE)
+        if os.path.exists(default_path):
+            files.append({"path": default_path, "source": None, "version": None, "is_default": 1})
+
+        sources_dir = self._data_file(REFERENCE_SOURCES_DIR)
+        if os.path.isdir(sources_dir):
+            for source in sorted(os.listdir(sources_dir)):
+                source_dir = os.path.join(sources_dir, source)
+                if not os.path.isdir(source_dir):
+                    continue
+                versions = sorted(name for name in os.listdir(source_dir) if name.endswith(".csv"))
+                if versions:
+                    files.append(
+                        {
+                            "path": os.path.join(source_dir, versions[-1]),
+                            "source": source,
+                            "version": os.path.splitext(versions[-1])[0],
+                            "is_default": 0,
+                        }
+                    )
+        return files
+
+    @staticmethod
+    def _read_reference_file(file: Dict) -> List[tuple]:
+        """讀取一個參考值 CSV 為 reference_ranges 插入列"""
+
+        def number(value, cast=float):
+            value = (value or "").strip()
+            return cast(float(value)) if value else None
+
+        rows = []
+        with open(file["path"], "r", encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                rows.append(
+                    (
+                        row["loinc_code"].strip(),
+                        number(row.get("age_min"), int),
+                        number(row.get("age_max"), int),
+                        (row.get("gender") or "all").strip(),
+                        number(row.get("range_low")),
+                        number(row.get("range_high")),
+                        row.get("unit") or None,
+                        row.get("interpretation") or "",
+                        # Directory-based sources are selected by their directory name
+                        file["source"] or row.get("source") or None,
+                        file["version"] or row.get("version") or None,
+                        file["is_default"],
+                    )
+                )
+        return rows
+
+    def _sync_reference_ranges(self):
+        """
+        參考值 CSV 變動（新增檔案、新版本、修改時間改變）時重新載入 reference_ranges，
+        並記錄各檔案的來源與版本（reference_range_files）；lab_tests.csv 新增的檢驗項目
+        每次都補進 loinc_mapping。有寫入時同步更新 LOINC 全文索引並清除記憶體內的參考值索引
+        """
+        files = self._reference_files()
+        if not files:
+            log_error("No reference range CSV files found; keeping existing reference_ranges")
+            return
+        for file in files:
+            file["mtime"] = os.path.getmtime(file["path"])
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.cursor()
+            columns = {row[1] for row in cursor.execute("PRAGMA table_info(reference_ranges)")}
+            for column, ddl in (
+                ("source", "TEXT"),
+                ("version", "TEXT"),
+                ("is_default", "INTEGER DEFAULT 1"),
+            ):
+                if column not in columns:
+                    cursor.execute(f"ALTER TABLE reference_ranges ADD COLUMN {column} {ddl}")
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS reference_range_files (
+                    path TEXT PRIMARY KEY,
+                    source TEXT,
+                    version TEXT,
+                    mtime REAL,
+                    row_count INTEGER,
+                    loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """
             )
+            # Ranges may reference tests added to lab_tests.csv after the database was built
+            changes = conn.total_changes
+            self._load_common_tests(cursor)
+            if conn.total_changes != changes:
+                self._refresh_loinc_fts(conn)
 
-        # 插入參考值範圍
-        reference_ranges = [
-            # 白血球 (成人)
-            {
-                "loinc_code": "6690-2",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 4.0,
-                "range_high": 10.0,
-                "unit": "10^3/uL",
-                "interpretation": "成人參考值",
-            },
-            # 紅血球
-            {
-                "loinc_code": "789-8",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "M",
-                "range_low": 4.5,
-                "range_high": 5.9,
-                "unit": "10^6/uL",
-                "interpretation": "成人男性",
-            },
-            {
-                "loinc_code": "789-8",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "F",
-                "range_low": 4.0,
-                "range_high": 5.2,
-                "unit": "10^6/uL",
-                "interpretation": "成人女性",
-            },
-            # 血紅素
-            {
-                "loinc_code": "718-7",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "M",
-                "range_low": 13.5,
-                "range_high": 17.5,
-                "unit": "g/dL",
-                "interpretation": "成人男性",
-            },
-            {
-                "loinc_code": "718-7",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "F",
-                "range_low": 12.0,
-                "range_high": 16.0,
-                "unit": "g/dL",
-                "interpretation": "成人女性",
-            },
-            # 血球容積比
-            {
-                "loinc_code": "4544-3",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "M",
-                "range_low": 39,
-                "range_high": 52,
-                "unit": "%",
-                "interpretation": "成人男性",
-            },
-            {
-                "loinc_code": "4544-3",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "F",
-                "range_low": 36,
-                "range_high": 46,
-                "unit": "%",
-                "interpretation": "成人女性",
-            },
-            # 血小板
-            {
-                "loinc_code": "777-3",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 150,
-                "range_high": 400,
-                "unit": "10^3/uL",
-                "interpretation": "成人參考值",
-            },
-            # 空腹血糖
-            {
-                "loinc_code": "1558-6",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 70,
-                "range_high": 100,
-                "unit": "mg/dL",
-                "interpretation": "正常範圍",
-            },
-            # 糖化血色素
-            {
-                "loinc_code": "4548-4",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 4.0,
-                "range_high": 5.6,
-                "unit": "%",
-                "interpretation": "正常範圍",
-            },
-            # 總膽固醇
-            {
-                "loinc_code": "2093-3",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 0,
-                "range_high": 200,
-                "unit": "mg/dL",
-                "interpretation": "理想值",
-            },
-            # 三酸甘油酯
-            {
-                "loinc_code": "2571-8",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 0,
-                "range_high": 150,
-                "unit": "mg/dL",
-                "interpretation": "正常值",
-            },
-            # HDL
-            {
-                "loinc_code": "2085-9",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "M",
-                "range_low": 40,
-                "range_high": 999,
-                "unit": "mg/dL",
-                "interpretation": "成人男性（越高越好）",
-            },
-            {
-                "loinc_code": "2085-9",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "F",
-                "range_low": 50,
-                "range_high": 999,
-                "unit": "mg/dL",
-                "interpretation": "成人女性（越高越好）",
-            },
-            # LDL
-            {
-                "loinc_code": "2089-1",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 0,
-                "range_high": 130,
-                "unit": "mg/dL",
-                "interpretation": "理想值",
-            },
-            # ALT (GPT)
-            {
-                "loinc_code": "1742-6",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "M",
-                "range_low": 0,
-                "range_high": 40,
-                "unit": "U/L",
-                "interpretation": "成人男性",
-            },
-            {
-                "loinc_code": "1742-6",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "F",
-                "range_low": 0,
-                "range_high": 35,
-                "unit": "U/L",
-                "interpretation": "成人女性",
-            },
-            # AST (GOT)
-            {
-                "loinc_code": "1920-8",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 0,
-                "range_high": 40,
-                "unit": "U/L",
-                "interpretation": "成人參考值",
-            },
-            # 總膽紅素
-            {
-                "loinc_code": "1975-2",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 0.2,
-                "range_high": 1.2,
-                "unit": "mg/dL",
-                "interpretation": "成人參考值",
-            },
-            # 肌酸酐
-            {
-                "loinc_code": "2160-0",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "M",
-                "range_low": 0.7,
-                "range_high": 1.3,
-                "unit": "mg/dL",
-                "interpretation": "成人男性",
-            },
-            {
-                "loinc_code": "2160-0",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "F",
-                "range_low": 0.6,
-                "range_high": 1.1,
-                "unit": "mg/dL",
-                "interpretation": "成人女性",
-            },
-            # BUN
-            {
-                "loinc_code": "3094-0",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 7,
-                "range_high": 20,
-                "unit": "mg/dL",
-                "interpretation": "成人參考值",
-            },
-            # eGFR
-            {
-                "loinc_code": "33914-3",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 90,
-                "range_high": 999,
-                "unit": "mL/min/1.73m2",
-                "interpretation": "正常腎功能",
-            },
-            # 鈉
-            {
-                "loinc_code": "2951-2",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 136,
-                "range_high": 145,
-                "unit": "mmol/L",
-                "interpretation": "成人參考值",
-            },
-            # 鉀
-            {
-                "loinc_code": "2823-3",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 3.5,
-                "range_high": 5.1,
-                "unit": "mmol/L",
-                "interpretation": "成人參考值",
-            },
-            # 氯
-            {
-                "loinc_code": "2075-0",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 98,
-                "range_high": 107,
-                "unit": "mmol/L",
-                "interpretation": "成人參考值",
-            },
-            # TSH
-            {
-                "loinc_code": "3016-3",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 0.27,
-                "range_high": 4.2,
-                "unit": "uIU/mL",
-                "interpretation": "成人參考值",
-            },
-            # Free T4
-            {
-                "loinc_code": "3053-6",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 0.93,
-                "range_high": 1.7,
-                "unit": "ng/dL",
-                "interpretation": "成人參考值",
-            },
-            # PT
-            {
-                "loinc_code": "5902-2",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 9.5,
-                "range_high": 12.5,
-                "unit": "sec",
-                "interpretation": "成人參考值",
-            },
-            # INR
-            {
-                "loinc_code": "6301-6",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 0.8,
-                "range_high": 1.2,
-                "unit": "ratio",
-                "interpretation": "未服用抗凝血劑",
-            },
-            # aPTT
-            {
-                "loinc_code": "3173-2",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 25,
-                "range_high": 35,
-                "unit": "sec",
-                "interpretation": "成人參考值",
-            },
-            # CRP
-            {
-                "loinc_code": "1988-5",
-                "age_min": 18,
-                "age_max": 120,
-                "gender": "all",
-                "range_low": 0,
-                "range_high": 0.5,
-                "unit": "mg/dL",
-                "interpretation": "正常值",
-            },
-        ]
+            loaded = {
+                (path, mtime)
+                for path, mtime in cursor.execute("SELECT path, mtime FROM reference_range_files")
+            }
+            if loaded == {(file["path"], file["mtime"]) for file in files}:
+                if conn.total_changes != changes:
+                    conn.commit()
+                    self._invalidate_reference_index()
+                return
 
-        for ref in reference_ranges:
+            cursor.execute("DELETE FROM reference_ranges")
+            cursor.execute("DELETE FROM reference_range_files")
+            total = 0
+            for file in files:
+                rows = self._read_reference_file(file)
+                cursor.executemany(
+                    """
+                    INSERT INTO reference_ranges
+                    (loinc_code, age_min, age_max, gender, range_low, range_high, unit,
+                     interpretation, source, version, is_default)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                    rows,
+                )
+                cursor.execute(
+                    """
+                    INSERT INTO reference_range_files (path, source, version, mtime, row_count)
+                    VALUES (?, ?, ?, ?, ?)
+                """,
+                    (file["path"], file["source"], file["version"], file["mtime"], len(rows)),
+                )
+                total += len(rows)
             cursor.execute(
                 """
-                INSERT INTO reference_ranges
-                (loinc_code, age_min, age_max, gender, range_low, range_high, unit, interpretation)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-                (
-                    ref["loinc_code"],
-                    ref["age_min"],
-                    ref["age_max"],
-                    ref["gender"],
-                    ref["range_low"],
-                    ref["range_high"],
-                    ref["unit"],
-                    ref["interpretation"],
-                ),
+                CREATE INDEX IF NOT EXISTS idx_ref_source
+                ON reference_ranges(loinc_code, source, gender, age_min)
+            """
             )
+            conn.commit()
+            self._invalidate_reference_index()
+            log_info(f"Loaded {total} reference ranges from {len(files)} CSV files")
+        except Exception as e:
+            log_error(f"Failed to load reference range CSV files: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
 
-        log_info(f"Populated {len(common_tests)} Taiwan common lab tests")
-        log_info(f"Populated {len(reference_ranges)} reference ranges")
+    @staticmethod
+    def _refresh_loinc_fts(conn):
+        """
+        新增的 loinc_mapping 列寫入 FTS 索引：有觸發程序時已自動同步，
+        舊資料庫（索引沒有觸發程序）在同一交易內重建索引並補上觸發程序
+        """
+        names = {
+            row[0]
+            for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE name LIKE 'loinc_mapping_fts%'"
+            )
+        }
+        if "loinc_mapping_fts" not in names or set(LOINC_FTS_TRIGGERS) <= names:
+            return
+        conn.execute("INSERT INTO loinc_mapping_fts(loinc_mapping_fts) VALUES('rebuild')")
+        create_loinc_fts_triggers(conn)
+        log_info("Rebuilt loinc_mapping FTS index after syncing lab tests.")
+
+    def _invalidate_reference_index(self):
+        """清除記憶體內的參考值索引，下次查詢時重新載入"""
+        with self._reference_lock:
+            self._reference_index = None
+            self._reference_mtime = None
+
+    def _ensure_critical_ranges(self):
+        """建立危急值表（含整合 LOINC 後的資料庫等舊資料庫），首次建立時填入預設危急值"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'critical_ranges'"
+            ).fetchone()
+            if exists:
+                return
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                CREATE TABLE critical_ranges (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    loinc_code TEXT NOT NULL,
+                    age_min INTEGER,
+                    age_max INTEGER,
+                    gender TEXT,
+                    critical_low REAL,
+                    critical_high REAL,
+                    unit TEXT,
+                    note TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (loinc_code) REFERENCES loinc_mapping(loinc_code)
+                )
+            """
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_critical_loinc ON critical_ranges(loinc_code)"
+            )
+            self._populate_critical_ranges(cursor)
+            conn.commit()
+        except Exception as e:
+            log_error(f"Failed to create critical_ranges table: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+
+    def _populate_critical_ranges(self, cursor):
+        """填入常用檢驗項目的危急值（未設定的一側為 NULL）"""
+        critical_ranges = [
+            # (loinc_code, age_min, age_max, gender, critical_low, critical_high, unit, note)
+            ("6690-2", 0, 120, "all", 2.0, 30.0, "10^3/uL", "白血球危急值"),
+            ("718-7", 0, 120, "all", 7.0, 20.0, "g/dL", "血紅素危急值"),
+            ("4544-3", 0, 120, "all", 20.0, 60.0, "%", "血球容積比危急值"),
+            ("777-3", 0, 120, "all", 20.0, 1000.0, "10^3/uL", "血小板危急值"),
+            ("1558-6", 0, 120, "all", 40.0, 500.0, "mg/dL", "血糖危急值"),
+            ("2345-7", 0, 120, "all", 40.0, 500.0, "mg/dL", "血糖危急值"),
+            ("2951-2", 0, 120, "all", 120.0, 160.0, "mmol/L", "鈉離子危急值"),
+            ("2823-3", 0, 120, "all", 2.8, 6.2, "mmol/L", "鉀離子危急值"),
+            ("2075-0", 0, 120, "all", 80.0, 120.0, "mmol/L", "氯離子危急值"),
+            ("2160-0", 18, 120, "all", None, 5.0, "mg/dL", "成人肌酸酐危急值"),
+            ("1975-2", 0, 1, "all", None, 15.0, "mg/dL", "新生兒總膽紅素危急值"),
+            ("6301-6", 0, 120, "all", None, 5.0, "ratio", "INR 危急值"),
+            ("3173-2", 0, 120, "all", None, 100.0, "sec", "aPTT 危急值"),
+        ]
+        cursor.executemany(
+            """
+            INSERT INTO critical_ranges
+            (loinc_code, age_min, age_max, gender, critical_low, critical_high, unit, note)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            critical_ranges,
+        )
+        log_info(f"Populated {len(critical_ranges)} critical ranges")
 
     def _query_db(self, sql: str, params: tuple = ()) -> list:
         """執行 SQL 查詢"""
@@ -798,13 +509,72 @@ class LabService:
             log_error(f"Database query failed: {e}")
             return []
 
+    def _get_reference_index(self) -> ReferenceRangeIndex:
+        """取得參考值索引，lab_tests.db 的 mtime 變動時重新載入"""
+        try:
+            mtime = os.path.getmtime(self.db_path)
+        except OSError:
+            mtime = None
+        if self._reference_index is not None and mtime == self._reference_mtime:
+            return self._reference_index
+
+        with self._reference_lock:
+            if self._reference_index is None or mtime != self._reference_mtime:
+                tests = self._query_db("SELECT * FROM loinc_mapping")
+                ranges = self._query_db("SELECT * FROM reference_ranges ORDER BY id")
+                critical = self._query_db("SELECT * FROM critical_ranges ORDER BY id")
+                self._reference_index = ReferenceRangeIndex(tests, ranges, critical)
+                self._reference_mtime = mtime
+                log_info(
+                    f"Loaded reference range index: {len(self._reference_index.tests)} tests, "
+                    f"{len(self._reference_index)} ranges"
+                )
+            return self._reference_index
+
     # ==========================================
     # LOINC 碼對照功能
     # ==========================================
 
+    def _has_loinc_fts(self, conn) -> bool:
+        """
+        Checks for the FTS index, building it once for databases created before it existed
+        or before its sync triggers existed (their index misses rows written since the build).
+        """
+        names = {
+            row[0]
+            for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE name LIKE 'loinc_mapping_fts%'"
+            )
+        }
+        if {"loinc_mapping_fts", *LOINC_FTS_TRIGGERS} <= names:
+            return True
+        if self._fts_checked:
+            return "loinc_mapping_fts" in names
+        self._fts_checked = True
+        return build_loinc_fts(conn)
+
+    @staticmethod
+    def _commonness_boost(conn) -> str:
+        """
+        SQL 倍率運算式：台灣常用項目與 LOINC 常用度排名越前者倍率越高
+        （內建資料庫沒有這兩個欄位時為 1.0）
+        """
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(loinc_mapping)")}
+        terms = ["1.0"]
+        if "is_taiwan_common" in columns:
+            terms.append(f"{TAIWAN_COMMON_BOOST} * COALESCE(m.is_taiwan_common, 0)")
+        if "common_test_rank" in columns:
+            terms.append(
+                f"CASE WHEN m.common_test_rank > 0 THEN {COMMON_RANK_BOOST} / "
+                f"(1.0 + m.common_test_rank / {COMMON_RANK_SCALE}) ELSE 0 END"
+            )
+        return " + ".join(terms)
+
     def search_loinc_code(self, keyword: str, category: Optional[str] = None) -> str:
         """
         搜尋 LOINC 碼（支援中英文檢驗名稱）
+        3 個字以上以 FTS5 全文索引查詢，bm25 分數再乘上常用度倍率（台灣常用、COMMON_TEST_RANK），
+        較短的關鍵字（如「血糖」）以 LIKE 查詢並依完全符合、常用度排序
 
         Args:
             keyword: 搜尋關鍵字（檢驗名稱、LOINC 碼、常用縮寫）
@@ -813,23 +583,51 @@ class LabService:
         Returns:
             JSON 格式的搜尋結果
         """
-        term = f"%{keyword}%"
-        sql = """
-            SELECT loinc_code, loinc_name_en, loinc_name_zh, common_name_zh,
-                   category, specimen_type, unit, method
-            FROM loinc_mapping
-            WHERE (loinc_code LIKE ? OR loinc_name_zh LIKE ? OR
-                   loinc_name_en LIKE ? OR common_name_zh LIKE ?)
+        keyword = (keyword or "").strip()
+        select = """
+            SELECT m.loinc_code, m.loinc_name_en, m.loinc_name_zh, m.common_name_zh,
+                   m.category, m.specimen_type, m.unit, m.method
         """
-        params = [term, term, term, term]
-
-        if category:
-            sql += " AND category LIKE ?"
-            params.append(f"%{category}%")
-
-        sql += " ORDER BY loinc_code LIMIT 20"
+        try:
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            try:
+                boost = self._commonness_boost(conn)
+                category_sql = " AND m.category LIKE ?" if category else ""
+                category_params = [f"%{category}%"] if category else []
 
-        results = self._query_db(sql, tuple(params))
+                if len(keyword) >= FTS_MIN_QUERY_LENGTH and self._has_loinc_fts(conn):
+                    weights = ", ".join(str(weight) for _, weight in LOINC_FTS_COLUMNS)
+                    phrase = '"' + keyword.replace('"', '""') + '"'
+                    sql = f"""
+                        {select}
+                        FROM loinc_mapping_fts
+                        JOIN loinc_mapping m ON m.id = loinc_mapping_fts.rowid
+                        WHERE loinc_mapping_fts MATCH ?{category_sql}
+                        ORDER BY bm25(loinc_mapping_fts, {weights}) * ({boost}), m.loinc_code
+                        LIMIT 20
+                    """
+                    params = [phrase] + category_params
+                else:
+                    term = f"%{keyword}%"
+                    sql = f"""
+                        {select}
+                        FROM loinc_mapping m
+                        WHERE (m.loinc_code LIKE ? OR m.loinc_name_zh LIKE ? OR
+                               m.loinc_name_en LIKE ? OR m.common_name_zh LIKE ?){category_sql}
+                        ORDER BY CASE
+                            WHEN m.loinc_code = ? OR m.loinc_name_zh = ? OR m.common_name_zh = ?
+                            THEN 0 ELSE 1
+                        END, ({boost}) DESC, m.loinc_code
+                        LIMIT 20
+                    """
+                    params = [term] * 4 + category_params + [keyword] * 3
+                results = [dict(row) for row in conn.execute(sql, params).fetchall()]
+            finally:
+                conn.close()
+        except Exception as e:
+            log_error(f"Database query failed: {e}")
+            results = []
 
         if not results:
             return json.dumps(
@@ -847,10 +645,7 @@ class LabService:
 
     def get_loinc_by_code(self, loinc_code: str) -> Dict:
         """取得特定 LOINC 碼的完整資訊"""
-        results = self._query_db(
-            "SELECT * FROM loinc_mapping WHERE loinc_code = ?", (loinc_code,)
-        )
-        return results[0] if results else None
+        return self._get_reference_index().get_test(loinc_code)
 
     def list_categories(self) -> str:
         """列出所有檢驗分類"""
@@ -868,7 +663,11 @@ class LabService:
     # ==========================================
 
     def get_reference_range(
-        self, loinc_code: str, age: int, gender: Literal["M", "F", "all"] = "all"
+        self,
+        loinc_code: str,
+        age: int,
+        gender: Literal["M", "F", "all"] = "all",
+        source: Optional[str] = None,
     ) -> str:
         """
         查詢檢驗參考值範圍
@@ -877,67 +676,100 @@ class LabService:
             loinc_code: LOINC 碼
             age: 年齡
             gender: 性別（M=男性, F=女性, all=不分性別）
+            source: 參考值來源（選填，見 list_reference_sources）；未指定或該來源無此項目時用預設參考值
 
         Returns:
-            參考值範圍資訊
+            參考值範圍資訊（含來源與版本）
         """
+        return json.dumps(
+            self._reference_payload(loinc_code, age, gender, source), ensure_ascii=False
+        )
+
+    def list_reference_sources(self) -> str:
+        """列出已載入的參考值來源（CSV 檔、版本、筆數）"""
+        files = self._query_db(
+            "SELECT source, version, path, row_count, loaded_at FROM reference_range_files"
+        )
+        index = self._get_reference_index()
+        return json.dumps(
+            {
+                "selectable_sources": index.sources,
+                "files": [
+                    dict(f, path=os.path.basename(f["path"]), is_default=f["source"] is None)
+                    for f in files
+                ],
+            },
+            ensure_ascii=False,
+        )
+
+    def _reference_payload(
+        self, loinc_code: str, age: int, gender: str, source: Optional[str] = None
+    ) -> Dict:
+        """查詢參考值並組成回傳內容（dict）；找不到時含 error 或 message 欄位"""
         # 先取得檢驗項目資訊
-        test_info = self.get_loinc_by_code(loinc_code)
+        index = self._get_reference_index()
+        test_info = index.get_test(loinc_code)
         if not test_info:
-            return json.dumps(
-                {"error": f"找不到 LOINC 碼: {loinc_code}"}, ensure_ascii=False
-            )
+            return {"error": f"找不到 LOINC 碼: {loinc_code}"}
 
-        # 查詢參考值（優先找特定性別，找不到則找 all）
-        sql = """
-            SELECT * FROM reference_ranges
-            WHERE loinc_code = ?
-              AND age_min <= ?
-              AND age_max >= ?
-              AND (gender = ? OR gender = 'all')
-            ORDER BY
-                CASE gender WHEN ? THEN 1 ELSE 2 END,
-                age_min DESC
-            LIMIT 1
-        """
-        ref_range = self._query_db(sql, (loinc_code, age, age, gender, gender))
-
-        if not ref_range:
-            return json.dumps(
-                {
-                    "loinc_code": loinc_code,
-                    "test_name_zh": test_info["loinc_name_zh"],
-                    "test_name_en": test_info["loinc_name_en"],
-                    "message": f"找不到適用於年齡 {age} 歲、性別 {gender} 的參考值",
-                    "unit": test_info["unit"],
-                },
-                ensure_ascii=False,
-            )
+        # 查詢參考值（優先找指定來源、特定性別，找不到則找 all / 預設參考值）
+        ref = index.lookup(loinc_code, age, gender, source)
 
-        ref = ref_range[0]
-        return json.dumps(
-            {
+        if ref is None:
+            return {
                 "loinc_code": loinc_code,
                 "test_name_zh": test_info["loinc_name_zh"],
                 "test_name_en": test_info["loinc_name_en"],
-                "common_name": test_info["common_name_zh"],
-                "reference_range": {
-                    "low": ref["range_low"],
-                    "high": ref["range_high"],
-                    "unit": ref["unit"],
-                    "interpretation": ref["interpretation"],
-                },
-                "applicable_to": {
-                    "age_range": f"{ref['age_min']}-{ref['age_max']} 歲",
-                    "gender": (
-                        "男性"
-                        if ref["gender"] == "M"
-                        else "女性" if ref["gender"] == "F" else "不分性別"
-                    ),
-                },
+                "message": f"找不到適用於年齡 {age} 歲、性別 {gender} 的參考值",
+                "unit": test_info["unit"],
+            }
+
+        payload = {
+            "loinc_code": loinc_code,
+            "test_name_zh": test_info["loinc_name_zh"],
+            "test_name_en": test_info["loinc_name_en"],
+            "common_name": test_info["common_name_zh"],
+            "reference_range": {
+                "low": ref["range_low"],
+                "high": ref["range_high"],
+                "unit": ref["unit"],
+                "interpretation": ref["interpretation"],
+                "source": ref.get("source"),
+                "version": ref.get("version"),
             },
-            ensure_ascii=False,
-        )
+            "applicable_to": {
+                "age_range": f"{ref['age_min']}-{ref['age_max']} 歲",
+                "gender": (
+                    "男性"
+                    if ref["gender"] == "M"
+                    else "女性" if ref["gender"] == "F" else "不分性別"
+                ),
+            },
+        }
+        if source and ref.get("source") != source:
+            payload["source_note"] = f"來源 {source} 沒有此項目的參考值，改用預設參考值"
+        critical = self._critical_limits(index, loinc_code, age, gender, ref["unit"])
+        if critical is not None:
+            payload["critical_range"] = critical
+        return payload
+
+    @staticmethod
+    def _critical_limits(
+        index: ReferenceRangeIndex, loinc_code: str, age: float, gender: str, unit: str
+    ) -> Optional[Dict]:
+        """查詢危急值並換算為指定單位（與參考值同一索引；找不到或無法換算時 None）"""
+        crit = index.lookup_critical(loinc_code, age, gender)
+        if crit is None:
+            return None
+        low, high = crit["critical_low"], crit["critical_high"]
+        if unit and crit["unit"] and normalize_unit(unit) != normalize_unit(crit["unit"]):
+            conversion = compile_conversion(loinc_code, crit["unit"], unit)
+            if conversion is None:
+                return None
+            scale, offset = conversion
+            low = None if low is None else round(low * scale + offset, 4)
+            high = None if high is None else round(high * scale + offset, 4)
+        return {"low": low, "high": high, "unit": unit or crit["unit"]}
 
     def interpret_lab_result(
         self,
@@ -945,6 +777,8 @@ class LabService:
         value: float,
         age: int,
         gender: Literal["M", "F", "all"] = "all",
+        unit: Optional[str] = None,
+        source: Optional[str] = None,
     ) -> str:
         """
         判讀檢驗結果
@@ -954,96 +788,220 @@ class LabService:
             value: 檢驗值
             age: 年齡
             gender: 性別
+            unit: 檢驗值單位（選填，例如 mmol/L）；與參考值單位不同時先換算再判讀
+            source: 參考值來源（選填）
 
         Returns:
             檢驗結果判讀
         """
         # 取得參考值
-        ref_data = json.loads(self.get_reference_range(loinc_code, age, gender))
+        ref_data = self._reference_payload(loinc_code, age, gender, source)
 
         if "error" in ref_data or "message" in ref_data:
             return json.dumps(ref_data, ensure_ascii=False)
 
         ref_range = ref_data["reference_range"]
-        low = ref_range["low"]
-        high = ref_range["high"]
-
-        # 判斷結果
-        if value < low:
-            status = "偏低 (Low)"
-            flag = "L"
-            clinical_significance = "低於正常參考值，建議進一步評估"
-        elif value > high:
-            status = "偏高 (High)"
-            flag = "H"
-            clinical_significance = "高於正常參考值，建議進一步評估"
-        else:
-            status = "正常 (Normal)"
-            flag = "N"
-            clinical_significance = "數值在正常範圍內"
+        original = None
+        if unit and normalize_unit(unit) != normalize_unit(ref_range["unit"]):
+            conversion = compile_conversion(loinc_code, unit, ref_range["unit"])
+            if conversion is None:
+                return json.dumps(
+                    self._conversion_error(loinc_code, unit, ref_range["unit"]),
+                    ensure_ascii=False,
+                )
+            original = {"value": value, "unit": unit}
+            value = round(float(value) * conversion[0] + conversion[1], 4)
+
+        flag = self._flag_values(
+            np.array([value], dtype=float),
+            np.array([ref_range["low"]], dtype=float),
+            np.array([ref_range["high"]], dtype=float),
+            *self._critical_arrays([ref_data]),
+        )[0]
 
         return json.dumps(
-            {
-                "loinc_code": loinc_code,
-                "test_name_zh": ref_data["test_name_zh"],
-                "test_name_en": ref_data["test_name_en"],
-                "result": {
-                    "value": value,
-                    "unit": ref_range["unit"],
-                    "status": status,
-                    "flag": flag,
-                },
-                "reference_range": {
-                    "low": low,
-                    "high": high,
-                    "unit": ref_range["unit"],
-                },
-                "interpretation": clinical_significance,
-                "applicable_to": ref_data["applicable_to"],
-            },
-            ensure_ascii=False,
+            self._interpretation_payload(ref_data, value, flag, original), ensure_ascii=False
+        )
+
+    @staticmethod
+    def _conversion_error(loinc_code: str, unit: str, reference_unit: str) -> Dict:
+        return {
+            "loinc_code": loinc_code,
+            "error": f"無法將單位 {unit} 換算為參考值單位 {reference_unit}",
+        }
+
+    @staticmethod
+    def _flag_values(
+        values: np.ndarray,
+        low: np.ndarray,
+        high: np.ndarray,
+        critical_low: Optional[np.ndarray] = None,
+        critical_high: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        以陣列一次判定 L / N / H（缺少的上下限以 NaN 表示，視為無限制）；
+        提供危急值時，超出危急值者標記為 LL / HH
+        """
+        flags = np.where(values < low, "L", np.where(values > high, "H", "N")).astype("<U2")
+        if critical_low is not None:
+            flags = np.where(values < critical_low, "LL", flags)
+        if critical_high is not None:
+            flags = np.where(values > critical_high, "HH", flags)
+        return flags
+
+    @staticmethod
+    def _critical_arrays(ref_items: List[Dict]) -> tuple:
+        """由多筆參考值內容取出危急值上下限陣列（無危急值者為 NaN）"""
+        crit = [ref.get("critical_range") or {} for ref in ref_items]
+        return (
+            np.array([c.get("low") for c in crit], dtype=float),
+            np.array([c.get("high") for c in crit], dtype=float),
         )
 
+    @staticmethod
+    def _interpretation_payload(
+        ref_data: Dict, value: float, flag: str, original: Optional[Dict] = None
+    ) -> Dict:
+        """由參考值內容與旗標組成判讀結果（dict）；original 為換算前的數值與單位"""
+        status, clinical_significance = FLAG_DETAILS[flag]
+        ref_range = ref_data["reference_range"]
+        payload = {
+            "loinc_code": ref_data["loinc_code"],
+            "test_name_zh": ref_data["test_name_zh"],
+            "test_name_en": ref_data["test_name_en"],
+            "result": {
+                "value": value,
+                "unit": ref_range["unit"],
+                "status": status,
+                "flag": flag,
+            },
+            "reference_range": {
+                "low": ref_range["low"],
+                "high": ref_range["high"],
+                "unit": ref_range["unit"],
+                "source": ref_range.get("source"),
+            },
+            "interpretation": clinical_significance,
+            "applicable_to": ref_data["applicable_to"],
+        }
+        if "critical_range" in ref_data:
+            payload["result"]["critical"] = flag in CRITICAL_FLAGS
+            payload["critical_range"] = {
+                "low": ref_data["critical_range"]["low"],
+                "high": ref_data["critical_range"]["high"],
+            }
+        if original is not None:
+            payload["result"]["original_value"] = original["value"]
+            payload["result"]["original_unit"] = original["unit"]
+        return payload
+
     def batch_interpret_results(
         self,
         results: List[Dict[str, any]],
         age: int,
         gender: Literal["M", "F", "all"] = "all",
+        source: Optional[str] = None,
     ) -> str:
         """
         批次判讀多個檢驗結果
+        每個 LOINC 碼只查詢一次參考值（記憶體索引），單位換算與旗標以陣列一次計算，最後只序列化一次
 
         Args:
-            results: 檢驗結果列表 [{"loinc_code": "...", "value": 123}, ...]
+            results: 檢驗結果列表 [{"loinc_code": "...", "value": 123, "unit": "mmol/L"}, ...]
+                    （unit 選填，與參考值單位不同時先換算）
             age: 年齡
             gender: 性別
+            source: 參考值來源（選填）
 
         Returns:
             批次判讀結果
         """
-        interpretations = []
-        abnormal_count = 0
-
+        # 每個 LOINC 碼的參考值只解析一次
+        references: Dict[str, Dict] = {}
+        items = []
+        conversion_errors = []
+        calculator_inputs: Dict[str, float] = {}
         for result in results:
             loinc_code = result.get("loinc_code")
             value = result.get("value")
 
             if not loinc_code or value is None:
                 continue
+            try:
+                numeric = float(value)
+            except (TypeError, ValueError):
+                continue
 
-            interp = json.loads(
-                self.interpret_lab_result(loinc_code, value, age, gender)
-            )
+            # 衍生計算的輸入（含不在參考值表中的項目，如 HCO3、胰島素）
+            if loinc_code in INPUT_UNITS:
+                conversion = (1.0, 0.0)
+                if result.get("unit"):
+                    conversion = compile_conversion(
+                        loinc_code, result["unit"], INPUT_UNITS[loinc_code]
+                    )
+                if conversion is not None:
+                    calculator_inputs[loinc_code] = numeric * conversion[0] + conversion[1]
 
-            if "error" not in interp and "message" not in interp:
-                interpretations.append(interp)
-                if interp["result"]["flag"] != "N":
-                    abnormal_count += 1
+            if loinc_code not in references:
+                references[loinc_code] = self._reference_payload(
+                    loinc_code, age, gender, source
+                )
+            ref_data = references[loinc_code]
+            if "error" in ref_data or "message" in ref_data:
+                continue
+
+            # 換算係數依 (LOINC, 單位) 編譯並快取，數值稍後以陣列一次套用
+            unit = result.get("unit")
+            reference_unit = ref_data["reference_range"]["unit"]
+            conversion = None
+            if unit and normalize_unit(unit) != normalize_unit(reference_unit):
+                conversion = compile_conversion(loinc_code, unit, reference_unit)
+                if conversion is None:
+                    conversion_errors.append(
+                        dict(self._conversion_error(loinc_code, unit, reference_unit), value=value)
+                    )
+                    continue
+            items.append((ref_data, value, numeric, unit, conversion))
+
+        interpretations = []
+        if items:
+            numeric_values = np.array([item[2] for item in items])
+            needs_conversion = np.array([item[4] is not None for item in items])
+            scales = np.array([item[4][0] if item[4] else 1.0 for item in items])
+            offsets = np.array([item[4][1] if item[4] else 0.0 for item in items])
+            converted = np.where(
+                needs_conversion,
+                np.round(convert_values(numeric_values, scales, offsets), 4),
+                numeric_values,
+            )
+            flags = self._flag_values(
+                converted,
+                np.array([item[0]["reference_range"]["low"] for item in items], dtype=float),
+                np.array([item[0]["reference_range"]["high"] for item in items], dtype=float),
+                *self._critical_arrays([item[0] for item in items]),
+            )
+            interpretations = [
+                self._interpretation_payload(
+                    ref_data,
+                    value if conversion is None else float(converted_value),
+                    str(flag),
+                    None if conversion is None else {"value": value, "unit": unit},
+                )
+                for (ref_data, value, _, unit, conversion), converted_value, flag in zip(
+                    items, converted, flags
+                )
+            ]
+        derived = self._derived_results(calculator_inputs, age, gender)
+        abnormal_count = sum(1 for interp in interpretations if interp["result"]["flag"] != "N")
+        critical_count = sum(
+            1 for interp in interpretations if interp["result"]["flag"] in CRITICAL_FLAGS
+        )
 
         return json.dumps(
             {
                 "total_tests": len(interpretations),
                 "abnormal_count": abnormal_count,
+                "critical_count": critical_count,
                 "normal_count": len(interpretations) - abnormal_count,
                 "patient_info": {
                     "age": age,
@@ -1054,6 +1012,357 @@ class LabService:
                     ),
                 },
                 "results": interpretations,
+                **({"derived_results": derived} if derived else {}),
+                **({"conversion_errors": conversion_errors} if conversion_errors else {}),
+            },
+            ensure_ascii=False,
+        )
+
+    def _derived_results(self, inputs: Dict[str, float], age: int, gender: str) -> List[Dict]:
+        """由本批次的檢驗值計算衍生檢驗（eGFR、計算型 LDL 等），並以衍生項目自己的參考值判讀"""
+        if not inputs:
+            return []
+        values = derive(
+            {code: np.array([value]) for code, value in inputs.items()},
+            np.array([age], dtype=float),
+            np.array([gender]),
+        )
+        codes = [code for code in DERIVED_TESTS if not np.isnan(values[code][0])]
+        if not codes:
+            return []
+
+        derived_values = np.array([values[code][0] for code in codes])
+        flags = self._flag_values(
+            derived_values,
+            np.array([DERIVED_TESTS[code]["low"] for code in codes], dtype=float),
+            np.array([DERIVED_TESTS[code]["high"] for code in codes], dtype=float),
+        )
+        derived = []
+        for code, value, flag in zip(codes, derived_values, flags):
+            test = DERIVED_TESTS[code]
+            flag = str(flag)
+            derived.append(
+                {
+                    "derived_code": code,
+                    "loinc_code": test["loinc"],
+                    "test_name_zh": test["name_zh"],
+                    "test_name_en": test["name_en"],
+                    "result": {
+                        "value": round(float(value), 2),
+                        "unit": test["unit"],
+                        "status": FLAG_DETAILS[flag][0],
+                        "flag": flag,
+                    },
+                    "reference_range": {
+                        "low": test["low"],
+                        "high": test["high"],
+                        "unit": test["unit"],
+                    },
+                    "formula": test["formula"],
+                    "inputs": {
+                        code: round(inputs[code], 4)
+                        for key in test["inputs"]
+                        for code in key.split("|")
+                        if code in inputs
+                    },
+                }
+            )
+        return derived
+
+    def find_critical_results(
+        self,
+        results: List[Dict[str, any]],
+        age: Optional[int] = None,
+        gender: Literal["M", "F", "all"] = "all",
+    ) -> str:
+        """
+        危急值快速篩檢：只回傳超出危急值（LL / HH）的結果
+        危急值依 (LOINC 碼, 年齡, 性別, 單位) 快取，比較以陣列一次完成，不組完整判讀內容
+
+        Args:
+            results: 檢驗結果列表 [{"loinc_code": "...", "value": 6.8, "unit": "mmol/L",
+                    "patient_id": "...", "age": 70, "gender": "M"}, ...]
+                    （unit、patient_id、age、gender 選填；age / gender 未填時使用預設值）
+            age: 預設年齡
+            gender: 預設性別
+
+        Returns:
+            危急值結果（含在原列表中的位置 index）；無法檢查的項目列於 skipped 並附原因
+        """
+        index = self._get_reference_index()
+        # (LOINC 碼, 年齡, 性別, 單位) -> (危急值, 換算) 或無法檢查的原因
+        limits_cache: Dict[tuple, Union[tuple, str]] = {}
+        positions, values, lows, highs, scales, offsets, limits = [], [], [], [], [], [], []
+        skipped = []
+
+        for position, result in enumerate(results):
+            loinc_code = result.get("loinc_code")
+            item_age = result.get("age", age)
+            try:
+                value = float(result.get("value"))
+            except (TypeError, ValueError):
+                skipped.append({"index": position, "loinc_code": loinc_code, "reason": "value 不是數值"})
+                continue
+            if item_age is None:
+                skipped.append({"index": position, "loinc_code": loinc_code, "reason": "未提供年齡"})
+                continue
+            try:
+                item_age = float(item_age)
+            except (TypeError, ValueError):
+                skipped.append({"index": position, "loinc_code": loinc_code, "reason": "age 不是數值"})
+                continue
+            item_gender = result.get("gender") or gender
+            unit = result.get("unit") or None
+
+            key = (loinc_code, item_age, item_gender, unit)
+            if key not in limits_cache:
+                crit = index.lookup_critical(loinc_code, item_age, item_gender)
+                if index.get_test(loinc_code) is None:
+                    limits_cache[key] = f"找不到 LOINC 碼: {loinc_code}"
+                elif crit is None:
+                    limits_cache[key] = (
+                        f"未定義適用於年齡 {result.get('age', age)} 歲、性別 {item_gender} 的危急值"
+                    )
+                else:
+                    conversion = (1.0, 0.0)
+                    if unit and crit["unit"]:
+                        conversion = compile_conversion(loinc_code, unit, crit["unit"])
+                    limits_cache[key] = (
+                        (crit, conversion)
+                        if conversion is not None
+                        else f"無法將單位 {unit} 換算為危急值單位 {crit['unit']}"
+                    )
+            cached = limits_cache[key]
+            if isinstance(cached, str):
+                skipped.append({"index": position, "loinc_code": loinc_code, "reason": cached})
+                continue
+
+            crit, (scale, offset) = cached
+            positions.append(position)
+            values.append(value)
+            lows.append(crit["critical_low"])
+            highs.append(crit["critical_high"])
+            scales.append(scale)
+            offsets.append(offset)
+            limits.append(crit)
+
+        critical = []
+        if positions:
+            converted = convert_values(np.array(values), np.array(scales), np.array(offsets))
+            low = np.array(lows, dtype=float)
+            high = np.array(highs, dtype=float)
+            flags = np.where(converted < low, "LL", np.where(converted > high, "HH", ""))
+            for k in np.flatnonzero(flags != ""):
+                result = results[positions[k]]
+                crit = limits[k]
+                entry = {
+                    "index": positions[k],
+                    "loinc_code": crit["loinc_code"],
+                    "test_name_zh": (index.get_test(crit["loinc_code"]) or {}).get(
+                        "loinc_name_zh"
+                    ),
+                    "value": round(float(converted[k]), 4),
+                    "unit": crit["unit"],
+                    "flag": str(flags[k]),
+                    "critical_low": crit["critical_low"],
+                    "critical_high": crit["critical_high"],
+                }
+                if result.get("patient_id") is not None:
+                    entry["patient_id"] = result["patient_id"]
+                if scales[k] != 1.0 or offsets[k] != 0.0:
+                    entry["original_value"] = result.get("value")
+                    entry["original_unit"] = result.get("unit")
+                critical.append(entry)
+
+        return json.dumps(
+            {
+                "total_tests": len(results),
+                "checked_count": len(positions),
+                "critical_count": len(critical),
+                "results": critical,
+                "skipped_count": len(skipped),
+                "skipped": skipped,
+            },
+            ensure_ascii=False,
+        )
+
+    # ==========================================
+    # 檢驗結果趨勢分析
+    # ==========================================
+
+    def analyze_lab_trends(
+        self,
+        results: List[Dict[str, any]],
+        age: int,
+        gender: Literal["M", "F", "all"] = "all",
+        thresholds: Optional[Dict[str, Dict[str, float]]] = None,
+    ) -> str:
+        """
+        分析病人歷次檢驗結果的趨勢與 delta check
+        所有項目的序列一次以陣列計算（斜率、變化百分比、相鄰結果差異），參考值沿用記憶體索引
+
+        Args:
+            results: 歷次檢驗結果 [{"loinc_code": "...", "value": 1.2, "date": "2024-01-05", "unit": "mg/dL"}, ...]
+                    （date 可為 ISO 8601 日期 / 時間；unit 選填，與參考值單位不同時先換算）
+            age: 年齡
+            gender: 性別
+            thresholds: 自訂 delta check 門檻 {"2160-0": {"absolute": 0.3, "percent": 50}, ...}
+
+        Returns:
+            各檢驗項目的趨勢摘要與 delta check 警示
+        """
+        thresholds = {**DELTA_THRESHOLDS, **(thresholds or {})}
+        references: Dict[str, Dict] = {}
+        codes, days, values, originals = [], [], [], []
+        skipped = []
+
+        for result in results:
+            loinc_code = str(result.get("loinc_code") or "").strip()
+            day = parse_timestamp(result.get("date", result.get("timestamp")))
+            try:
+                value = float(result.get("value"))
+            except (TypeError, ValueError):
+                value = None
+            if not loinc_code or value is None or day is None:
+                skipped.append({**result, "reason": "缺少 loinc_code、數值或日期格式錯誤"})
+                continue
+
+            if loinc_code not in references:
+                references[loinc_code] = self._reference_payload(loinc_code, age, gender)
+            ref_data = references[loinc_code]
+            if "error" in ref_data:
+                skipped.append({**result, "reason": ref_data["error"]})
+                continue
+
+            unit = result.get("unit")
+            reference_unit = ref_data.get("reference_range", {}).get("unit") or ref_data.get("unit")
+            if unit and reference_unit and normalize_unit(unit) != normalize_unit(reference_unit):
+                conversion = compile_conversion(loinc_code, unit, reference_unit)
+                if conversion is None:
+                    skipped.append(
+                        {**result, **self._conversion_error(loinc_code, unit, reference_unit)}
+                    )
+                    continue
+                value = value * conversion[0] + conversion[1]
+
+            codes.append(loinc_code)
+            days.append(day)
+            values.append(value)
+
+        series_codes = list(dict.fromkeys(codes))
+        trends = []
+        if codes:
+            code_ids = {code: i for i, code in enumerate(series_codes)}
+            series_ids = np.array([code_ids[c] for c in codes])
+            stats = analyze_series(series_ids, np.array(days), np.array(values))
+
+            order = stats["order"]
+            sorted_ids = series_ids[order]
+            sorted_days = np.array(days)[order]
+            sorted_values = np.array(values)[order]
+
+            # Per-point reference limits and delta thresholds, indexed by series
+            ranges = [references[code].get("reference_range") for code in series_codes]
+            low = np.array([r["low"] if r else np.nan for r in ranges], dtype=float)
+            high = np.array([r["high"] if r else np.nan for r in ranges], dtype=float)
+            limits = [thresholds.get(code, {}) for code in series_codes]
+            absolute = np.array([lim.get("absolute", np.nan) for lim in limits], dtype=float)
+            percent = np.array(
+                [
+                    lim.get("percent", np.nan if "absolute" in lim else DEFAULT_DELTA_PERCENT)
+                    for lim in limits
+                ],
+                dtype=float,
+            )
+
+            critical_low, critical_high = self._critical_arrays(
+                [references[code] for code in series_codes]
+            )
+            flags = self._flag_values(
+                sorted_values,
+                low[sorted_ids],
+                high[sorted_ids],
+                critical_low[sorted_ids],
+                critical_high[sorted_ids],
+            )
+            has_range = ~(np.isnan(low) & np.isnan(high))
+            abnormal = np.add.reduceat((flags != "N").astype(int), stats["starts"])
+            deltas = delta_checks(
+                sorted_ids, sorted_values, absolute[sorted_ids], percent[sorted_ids]
+            )
+            alerts: Dict[int, List[Dict]] = {}
+            for pos, delta, pct in zip(deltas["index"], deltas["delta"], deltas["percent_change"]):
+                alerts.setdefault(int(sorted_ids[pos]), []).append(
+                    {
+                        "date": format_day(sorted_days[pos]),
+                        "previous_date": format_day(sorted_days[pos - 1]),
+                        "value": round(float(sorted_values[pos]), 4),
+                        "previous_value": round(float(sorted_values[pos - 1]), 4),
+                        "delta": round(float(delta), 4),
+                        "percent_change": round_or_none(pct, 1),
+                    }
+                )
+
+            total_change = percent_change(stats["first"], stats["last"])
+            recent_change = percent_change(stats["previous"], stats["last"])
+            directions = trend_direction(stats["slope_per_day"], stats["span_days"], stats["mean"])
+
+            for k, sid in enumerate(stats["series"]):
+                sid = int(sid)
+                code = series_codes[sid]
+                ref_data = references[code]
+                ref_range = ref_data.get("reference_range")
+                last_pos = stats["ends"][k]
+                latest_flag = str(flags[last_pos])
+                trends.append(
+                    {
+                        "loinc_code": code,
+                        "test_name_zh": ref_data["test_name_zh"],
+                        "unit": ref_range["unit"] if ref_range else ref_data.get("unit"),
+                        "count": int(stats["count"][k]),
+                        "first": {
+                            "date": format_day(sorted_days[stats["starts"][k]]),
+                            "value": round_or_none(stats["first"][k]),
+                        },
+                        "latest": {
+                            "date": format_day(sorted_days[last_pos]),
+                            "value": round_or_none(stats["last"][k]),
+                            "flag": latest_flag if has_range[sid] else None,
+                            "status": FLAG_DETAILS[latest_flag][0] if has_range[sid] else None,
+                        },
+                        "min": round_or_none(stats["min"][k]),
+                        "max": round_or_none(stats["max"][k]),
+                        "mean": round_or_none(stats["mean"][k]),
+                        "change_percent": round_or_none(total_change[k], 1),
+                        "change_from_previous_percent": round_or_none(recent_change[k], 1),
+                        "slope_per_year": round_or_none(
+                            stats["slope_per_day"][k] * DAYS_PER_YEAR
+                        ),
+                        "trend": directions[k],
+                        "abnormal_count": int(abnormal[k]) if has_range[sid] else None,
+                        "reference_range": (
+                            {"low": ref_range["low"], "high": ref_range["high"]}
+                            if ref_range
+                            else None
+                        ),
+                        "delta_alerts": alerts.get(sid, []),
+                    }
+                )
+
+        return json.dumps(
+            {
+                "patient_info": {
+                    "age": age,
+                    "gender": (
+                        "男性"
+                        if gender == "M"
+                        else "女性" if gender == "F" else "不分性別"
+                    ),
+                },
+                "total_series": len(trends),
+                "delta_alert_count": sum(len(t["delta_alerts"]) for t in trends),
+                "trends": trends,
+                **({"skipped": skipped} if skipped else {}),
             },
             ensure_ascii=False,
         )
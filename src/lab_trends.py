@@ -0,0 +1,153 @@
+"""
+Lab Trends - 檢驗結果時間序列分析
+將多個檢驗項目的歷史結果依序列排列後，以陣列一次計算趨勢斜率、變化百分比與 delta check
+"""
+
+from datetime import date, datetime
+from typing import Dict, Optional
+
+import numpy as np
+
+# Delta-check thresholds per LOINC code between consecutive results:
+# absolute change (in the reference unit) and/or percent change
+DELTA_THRESHOLDS = {
+    "718-7": {"absolute": 2.0},  # Hemoglobin g/dL
+    "4544-3": {"absolute": 6.0},  # Hematocrit %
+    "6690-2": {"percent": 50.0},  # WBC
+    "777-3": {"percent": 50.0},  # Platelets
+    "2951-2": {"absolute": 8.0},  # Sodium mmol/L
+    "2823-3": {"absolute": 1.0},  # Potassium mmol/L
+    "2075-0": {"absolute": 8.0},  # Chloride mmol/L
+    "2160-0": {"absolute": 0.3, "percent": 50.0},  # Creatinine mg/dL (KDIGO AKI)
+    "3094-0": {"percent": 50.0},  # BUN
+    "1558-6": {"percent": 50.0},  # Fasting glucose
+    "2345-7": {"percent": 50.0},  # Glucose
+    "1975-2": {"percent": 50.0},  # Total bilirubin
+    "1742-6": {"percent": 100.0},  # ALT
+    "1920-8": {"percent": 100.0},  # AST
+    "6301-6": {"absolute": 1.0},  # INR
+}
+DEFAULT_DELTA_PERCENT = 30.0
+
+# Fitted change over the observed span below this share of the mean counts as stable
+STABLE_CHANGE_PERCENT = 5.0
+
+DAYS_PER_YEAR = 365.25
+
+
+def parse_timestamp(value) -> Optional[float]:
+    """日期 / 時間字串（ISO 8601）或 epoch 秒轉為天數；無法解析時 None"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value) / 86400.0
+    text = str(value or "").strip()
+    if not text:
+        return None
+    try:
+        parsed = datetime.fromisoformat(text.replace("Z", "+00:00").replace("/", "-"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.replace(tzinfo=None) - parsed.utcoffset()
+    delta = parsed - datetime(1970, 1, 1)
+    return delta.total_seconds() / 86400.0
+
+
+def format_day(day: float) -> str:
+    """天數轉回日期字串"""
+    return date.fromordinal(date(1970, 1, 1).toordinal() + int(np.floor(day))).isoformat()
+
+
+def analyze_series(series_ids: np.ndarray, days: np.ndarray, values: np.ndarray) -> Dict:
+    """
+    以陣列一次分析所有序列
+
+    Args:
+        series_ids: (n_points,) 各點所屬序列（0..n_series-1）
+        days: (n_points,) 時間（天）
+        values: (n_points,) 檢驗值
+
+    Returns:
+        dict：order（依序列、時間排序的索引）、starts / ends（各序列起訖位置）、
+        以及每個序列的 count / first / last / min / max / mean / slope_per_day / span_days
+    """
+    order = np.lexsort((days, series_ids))
+    ids, t, v = series_ids[order], days[order], values[order]
+    present, starts = np.unique(ids, return_index=True)
+    ends = np.append(starts[1:], len(ids)) - 1
+
+    # Center time on each series' first point to keep the sums well conditioned
+    t = t - t[starts][np.searchsorted(present, ids)]
+    n = np.add.reduceat(np.ones_like(v), starts)
+    st = np.add.reduceat(t, starts)
+    sv = np.add.reduceat(v, starts)
+    stt = np.add.reduceat(t * t, starts)
+    stv = np.add.reduceat(t * v, starts)
+    denominator = n * stt - st * st
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(denominator > 0, (n * stv - st * sv) / denominator, np.nan)
+
+    return {
+        "order": order,
+        "starts": starts,
+        "ends": ends,
+        "series": present,
+        "count": n.astype(int),
+        "first": v[starts],
+        "last": v[ends],
+        "previous": np.where(n > 1, v[np.maximum(ends - 1, starts)], np.nan),
+        "min": np.minimum.reduceat(v, starts),
+        "max": np.maximum.reduceat(v, starts),
+        "mean": sv / n,
+        "slope_per_day": slope,
+        "span_days": t[ends],
+    }
+
+
+def delta_checks(
+    series_ids: np.ndarray,
+    values: np.ndarray,
+    absolute: np.ndarray,
+    percent: np.ndarray,
+) -> Dict:
+    """
+    相鄰兩次結果的 delta check（輸入須已依序列、時間排序）
+
+    Args:
+        absolute / percent: (n_points,) 各點適用的絕對值 / 百分比門檻（NaN 表示不檢查）
+
+    Returns:
+        dict：index（觸發點在排序後陣列的位置）、delta、percent_change
+    """
+    if len(values) < 2:
+        empty = np.array([], dtype=int)
+        return {"index": empty, "delta": np.array([]), "percent_change": np.array([])}
+
+    same_series = series_ids[1:] == series_ids[:-1]
+    delta = np.diff(values)
+    previous = values[:-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = np.where(previous != 0, delta / np.abs(previous) * 100.0, np.nan)
+
+    exceeds = (np.abs(delta) > absolute[1:]) | (np.abs(pct) > percent[1:])
+    hits = np.flatnonzero(same_series & exceeds)
+    return {"index": hits + 1, "delta": delta[hits], "percent_change": pct[hits]}
+
+
+def percent_change(start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(start != 0, (end - start) / np.abs(start) * 100.0, np.nan)
+
+
+def round_or_none(value: float, digits: int = 4) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), digits)
+
+
+def trend_direction(slope_per_day: np.ndarray, span_days: np.ndarray, mean: np.ndarray) -> list:
+    """依擬合變化量相對平均值判定上升 / 下降 / 穩定（單點或同日資料為 None）"""
+    fitted = slope_per_day * span_days
+    with np.errstate(divide="ignore", invalid="ignore"):
+        relative = np.where(mean != 0, np.abs(fitted) / np.abs(mean) * 100.0, np.abs(fitted))
+    labels = np.where(
+        relative < STABLE_CHANGE_PERCENT, "穩定", np.where(fitted > 0, "上升", "下降")
+    )
+    return [None if np.isnan(s) else str(label) for s, label in zip(slope_per_day, labels)]
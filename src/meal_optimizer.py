@@ -0,0 +1,177 @@
+"""
+Meal Optimizer - 以線性規劃計算符合營養目標的食物份量
+純 NumPy 實作的 tableau simplex，設有時間預算，不依賴外部求解器或服務
+"""
+
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Result statuses returned by solve_portions
+STATUS_OPTIMAL = "optimal"
+STATUS_TIME_LIMIT = "time_limit"
+STATUS_ITERATION_LIMIT = "iteration_limit"
+
+_TOLERANCE = 1e-9
+
+
+def _simplex(
+    tableau: np.ndarray,
+    basis: np.ndarray,
+    deadline: float,
+    max_iterations: int,
+) -> str:
+    """
+    以 tableau 形式執行 primal simplex（原地更新）
+
+    Args:
+        tableau: (m + 1) x (n + 1)，前 m 列為 [A | b]，最後一列為 reduced cost 與 -目標值；
+                 basis 欄必須已是單位矩陣且 b >= 0
+        basis: 每列的基變數欄位
+        deadline: time.perf_counter() 截止時間
+        max_iterations: 最大迭代次數
+    """
+    m = tableau.shape[0] - 1
+    degenerate_streak = 0
+    for _ in range(max_iterations):
+        if time.perf_counter() > deadline:
+            return STATUS_TIME_LIMIT
+
+        reduced = tableau[-1, :-1]
+        candidates = np.flatnonzero(reduced < -_TOLERANCE)
+        if not len(candidates):
+            return STATUS_OPTIMAL
+
+        # Dantzig's rule is fast in practice; Bland's rule breaks cycling on degenerate pivots
+        if degenerate_streak > 50:
+            entering = candidates[0]
+        else:
+            entering = candidates[np.argmin(reduced[candidates])]
+
+        column = tableau[:m, entering]
+        positive = column > _TOLERANCE
+        if not positive.any():
+            # Objective is bounded below by zero in our problems; treat as converged
+            return STATUS_OPTIMAL
+        ratios = np.full(m, np.inf)
+        ratios[positive] = tableau[:m, -1][positive] / column[positive]
+        best = ratios.min()
+        ties = np.flatnonzero(ratios <= best + _TOLERANCE)
+        leaving = ties[np.argmin(basis[ties])]
+        degenerate_streak = degenerate_streak + 1 if best <= _TOLERANCE else 0
+
+        pivot_row = tableau[leaving] / tableau[leaving, entering]
+        tableau -= np.outer(tableau[:, entering], pivot_row)
+        tableau[leaving] = pivot_row
+        basis[leaving] = entering
+
+    return STATUS_ITERATION_LIMIT
+
+
+def solve_portions(
+    nutrients: np.ndarray,
+    lower: np.ndarray,
+    upper: np.ndarray,
+    max_units: np.ndarray,
+    penalty: Optional[np.ndarray] = None,
+    amount_cost: float = 1e-3,
+    time_budget: float = 1.0,
+    max_iterations: int = 5000,
+) -> Dict:
+    """
+    求解各食物份量，使營養總量落在目標區間內
+
+    目標為軟性限制：每個營養素的不足量與超出量（以目標值為尺度）乘上 penalty 後最小化，
+    因此即使目標互相衝突也會回傳最接近的解；另以 amount_cost 輕微懲罰總份量，避免無用的堆疊。
+
+    Args:
+        nutrients: (k, n) 每單位份量（100 克）各食物的營養素含量，缺值請先補 0
+        lower: (k,) 下限，NaN 表示無下限
+        upper: (k,) 上限，NaN 表示無上限
+        max_units: (n,) 每種食物的份量上限（單位：100 克）
+        penalty: (k,) 各營養素偏離目標的權重，預設為 1
+        amount_cost: 每單位份量的成本
+        time_budget: 時間預算（秒），逾時回傳目前的可行解
+        max_iterations: 最大 simplex 迭代次數
+
+    Returns:
+        {"status", "units": (n,) 份量, "solve_time_ms"}
+    """
+    started = time.perf_counter()
+    k, n = nutrients.shape
+    penalty = np.ones(k) if penalty is None else np.asarray(penalty, dtype=float)
+
+    lo_rows = np.flatnonzero(~np.isnan(lower))
+    hi_rows = np.flatnonzero(~np.isnan(upper))
+
+    # Scale each nutrient row by its target so deviations are relative and well conditioned
+    def scaled(rows, bound):
+        scale = np.where(bound[rows] > 0, bound[rows], 1.0)
+        return nutrients[rows] / scale[:, None], bound[rows] / scale
+
+    a_lo, b_lo = scaled(lo_rows, lower)
+    a_hi, b_hi = scaled(hi_rows, upper)
+    n_lo, n_hi = len(lo_rows), len(hi_rows)
+
+    # Columns: x (n) | shortfall (n_lo) | surplus (n_lo) | excess (n_hi) | slack (n_hi) | bound slack (n)
+    offsets = np.cumsum([0, n, n_lo, n_lo, n_hi, n_hi, n])
+    x_col, short_col, surplus_col, excess_col, slack_col, bound_col, n_vars = offsets
+    m = n_lo + n_hi + n
+
+    tableau = np.zeros((m + 1, n_vars + 1))
+    basis = np.empty(m, dtype=int)
+
+    # A x + shortfall - surplus = lower   (shortfall starts basic at `lower`)
+    rows = np.arange(n_lo)
+    tableau[rows, x_col:short_col] = a_lo
+    tableau[rows, short_col + rows] = 1.0
+    tableau[rows, surplus_col + rows] = -1.0
+    tableau[rows, -1] = np.maximum(b_lo, 0.0)
+    basis[rows] = short_col + rows
+
+    # A x - excess + slack = upper        (slack starts basic at `upper`)
+    rows = np.arange(n_hi)
+    tableau[n_lo + rows, x_col:short_col] = a_hi
+    tableau[n_lo + rows, excess_col + rows] = -1.0
+    tableau[n_lo + rows, slack_col + rows] = 1.0
+    tableau[n_lo + rows, -1] = np.maximum(b_hi, 0.0)
+    basis[n_lo + rows] = slack_col + rows
+
+    # x + bound slack = max units
+    rows = np.arange(n)
+    tableau[n_lo + n_hi + rows, x_col + rows] = 1.0
+    tableau[n_lo + n_hi + rows, bound_col + rows] = 1.0
+    tableau[n_lo + n_hi + rows, -1] = max_units
+    basis[n_lo + n_hi + rows] = bound_col + rows
+
+    cost = np.zeros(n_vars)
+    cost[x_col:short_col] = amount_cost
+    cost[short_col:surplus_col] = penalty[lo_rows]
+    cost[excess_col:slack_col] = penalty[hi_rows]
+
+    # Reduced costs for the identity starting basis: c - c_B^T A
+    tableau[-1, :-1] = cost - cost[basis] @ tableau[:m, :-1]
+    tableau[-1, -1] = -cost[basis] @ tableau[:m, -1]
+
+    status = _simplex(tableau, basis, started + time_budget, max_iterations)
+
+    values = np.zeros(n_vars)
+    values[basis] = tableau[:m, -1]
+    return {
+        "status": status,
+        "units": np.clip(values[x_col:short_col], 0.0, max_units),
+        "solve_time_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def evaluate_targets(
+    totals: np.ndarray, lower: np.ndarray, upper: np.ndarray, tolerance: float = 0.01
+) -> List[bool]:
+    """各營養素總量是否落在目標區間（容許 1% 誤差）"""
+    met = np.ones(len(totals), dtype=bool)
+    has_lo = ~np.isnan(lower)
+    has_hi = ~np.isnan(upper)
+    met[has_lo] &= totals[has_lo] >= lower[has_lo] * (1 - tolerance)
+    met[has_hi] &= totals[has_hi] <= upper[has_hi] * (1 + tolerance)
+    return met.tolist()
@@ -0,0 +1,363 @@
+"""
+Nutrient Matrix - 食品營養素稠密矩陣
+將長表格式的 nutrition 資料（每列 = 食品 × 營養素）轉為 foods × nutrients 的 NumPy 矩陣，
+並與食品、營養素詞彙表一起存成可 memory-map 的 .npy 與 .json 檔案；
+另存每個營養素依含量遞減排序的食品索引（_order.npy），供排行查詢直接取用，
+以及依營養組成最相近的食品鄰居表（_knn.npy），供食物替代建議使用。
+同一次存檔的 .npy 檔名帶有相同版本戳記，由 .json 詞彙表記錄，讀取時不會混用不同版本
+"""
+
+import glob
+import json
+import os
+import re
+import uuid
+import warnings
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+# Food-level attributes kept in the vocabulary (one value per food)
+FOOD_FIELDS = [
+    "integration_number",
+    "sample_name",
+    "common_name",
+    "english_name",
+    "food_category",
+    "content_description",
+    "waste_rate",
+    "unit_weight",
+]
+
+# Ranking bases for the precomputed sort order: per 100 g, per serving (unit weight)
+RANK_BASES = ("100g", "serving")
+
+# Distance metrics for nutrient-profile similarity
+SIMILARITY_METRICS = ("cosine", "euclidean")
+
+# Neighbours kept per food in the precomputed k-NN table
+KNN_SIZE = 20
+
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def parse_number(value) -> float:
+    """將資料集中的數值字串轉為 float，無法解析時回傳 NaN（例如 ''、'-'）"""
+    if value is None:
+        return np.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _NUMBER_RE.search(str(value).replace(",", ""))
+    return float(match.group()) if match else np.nan
+
+
+def sidecar_path(npy_path: str, name: str, version: Optional[str] = None) -> str:
+    """
+    附屬陣列檔路徑（與矩陣檔同目錄，例如 food_nutrition_matrix_order.npy）；
+    指定 version 時為該版本的檔名（food_nutrition_matrix_order.<version>.npy）
+    """
+    base = os.path.splitext(npy_path)[0] + f"_{name}"
+    return f"{base}.{version}.npy" if version else f"{base}.npy"
+
+
+def versioned_path(npy_path: str, version: str) -> str:
+    """矩陣檔的版本化路徑（food_nutrition_matrix.<version>.npy）"""
+    return f"{os.path.splitext(npy_path)[0]}.{version}.npy"
+
+
+class NutrientMatrix:
+    """
+    食品營養素矩陣
+    - values: shape (n_foods, n_nutrients)，每 100 克含量，缺值為 NaN
+    - foods: 食品詞彙表（list of dict，欄位見 FOOD_FIELDS）
+    - nutrients: 營養素詞彙表（list of dict: name, unit, category）
+    - order: shape (len(RANK_BASES), n_nutrients, n_foods)，各營養素含量遞減的食品索引，缺值排最後
+    - knn: shape (n_foods, KNN_SIZE)，以 cosine 相似度排序的最相近食品索引（不含自身）
+    """
+
+    def __init__(
+        self,
+        values: np.ndarray,
+        foods: List[Dict],
+        nutrients: List[Dict],
+        order: Optional[np.ndarray] = None,
+        knn: Optional[np.ndarray] = None,
+    ):
+        self.values = values
+        self.foods = foods
+        self.nutrients = nutrients
+        self.unit_weights = np.array(
+            [np.nan if f["unit_weight"] is None else f["unit_weight"] for f in foods]
+        )
+        self.order = order if order is not None else self._compute_order()
+        self._profiles = None
+        self.knn = knn if knn is not None else self._compute_knn()
+        self._food_pos = {f["integration_number"]: i for i, f in enumerate(foods)}
+        self._nutrient_pos = {n["name"]: j for j, n in enumerate(nutrients)}
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def basis_values(self, basis: str = "100g") -> np.ndarray:
+        """依排行基準回傳含量矩陣；'serving' 以每單位重換算，無單位重的食品為 NaN"""
+        if basis == "serving":
+            return np.asarray(self.values) * (self.unit_weights / 100.0)[:, None]
+        return np.asarray(self.values)
+
+    def _compute_order(self) -> np.ndarray:
+        n_foods, n_nutrients = self.values.shape
+        order = np.empty((len(RANK_BASES), n_nutrients, n_foods), dtype=np.int32)
+        for b, basis in enumerate(RANK_BASES):
+            # argsort places NaN last; negate for descending, stable keeps dataset order on ties
+            order[b] = np.argsort(-self.basis_values(basis), axis=0, kind="stable").T
+        return order
+
+    def profiles(self) -> np.ndarray:
+        """
+        標準化後的營養組成向量（每欄 z-score，缺值視為平均值 0），
+        讓熱量（數百 kcal）與微量元素（mg、ug）在距離計算中有相近的權重
+        """
+        if self._profiles is None:
+            values = np.asarray(self.values, dtype=float)
+            with np.errstate(invalid="ignore"), warnings.catch_warnings():
+                # Columns with no data at all produce all-NaN slices
+                warnings.simplefilter("ignore", RuntimeWarning)
+                mean = np.nanmean(values, axis=0)
+                std = np.nanstd(values, axis=0)
+            std = np.where(np.isnan(std) | (std == 0), 1.0, std)
+            self._profiles = np.nan_to_num((values - np.nan_to_num(mean)) / std)
+        return self._profiles
+
+    def similarity(
+        self,
+        food_idx: int,
+        metric: str = "cosine",
+        weights: Optional[np.ndarray] = None,
+        targets: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        指定食品與其他食品的相似度（越大越相似）
+
+        Args:
+            food_idx: 基準食品
+            metric: "cosine"（夾角）或 "euclidean"（以 1 / (1 + 距離) 表示）
+            weights: 選用的營養素權重（長度 n_nutrients，0 表示忽略該營養素）
+            targets: 選用的食品索引陣列，僅計算這些食品；預設為全部
+        """
+        profiles = self.profiles()
+        if weights is not None:
+            # Scaling both vectors by sqrt(w) weights each squared term/product by w
+            profiles = profiles * np.sqrt(weights)
+        query = profiles[food_idx]
+        others = profiles if targets is None else profiles[targets]
+
+        if metric == "euclidean":
+            return 1.0 / (1.0 + np.linalg.norm(others - query, axis=1))
+        norms = np.linalg.norm(others, axis=1) * np.linalg.norm(query)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(norms > 0, others @ query / norms, 0.0)
+
+    def _compute_knn(self, k: int = KNN_SIZE, block: int = 512) -> np.ndarray:
+        """以分塊矩陣乘法計算所有食品的 cosine 最近鄰（避免一次配置 n x n 矩陣）"""
+        profiles = self.profiles()
+        n_foods = profiles.shape[0]
+        k = min(k, max(n_foods - 1, 0))
+        knn = np.empty((n_foods, k), dtype=np.int32)
+        if k == 0:
+            return knn
+
+        norms = np.linalg.norm(profiles, axis=1)
+        unit = profiles / np.where(norms > 0, norms, 1.0)[:, None]
+        for start in range(0, n_foods, block):
+            stop = min(start + block, n_foods)
+            sims = unit[start:stop] @ unit.T
+            sims[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+            # argpartition picks the top k, then only those k are fully sorted
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            top_sims = np.take_along_axis(sims, top, axis=1)
+            knn[start:stop] = np.take_along_axis(
+                top, np.argsort(-top_sims, axis=1, kind="stable"), axis=1
+            )
+        return knn
+
+    # ==========================================
+    # 建立與存取
+    # ==========================================
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Dict]) -> "NutrientMatrix":
+        """
+        由 nutrition 資料表的列建立矩陣（pivot）
+
+        Args:
+            rows: 含 FOOD_FIELDS 與 nutrient_item、nutrient_category、content_unit、
+                  content_per_100g 欄位的 dict
+        """
+        foods, nutrients = [], []
+        food_pos, nutrient_pos = {}, {}
+        cells_i, cells_j, cells_v = [], [], []
+
+        for row in rows:
+            food_key = row.get("integration_number") or row.get("sample_name")
+            nutrient_name = row.get("nutrient_item")
+            if not food_key or not nutrient_name:
+                continue
+
+            i = food_pos.get(food_key)
+            if i is None:
+                i = food_pos[food_key] = len(foods)
+                food = {field: row.get(field) for field in FOOD_FIELDS}
+                food["integration_number"] = food_key
+                food["waste_rate"] = parse_number(row.get("waste_rate"))
+                food["unit_weight"] = parse_number(row.get("unit_weight"))
+                foods.append(food)
+
+            j = nutrient_pos.get(nutrient_name)
+            if j is None:
+                j = nutrient_pos[nutrient_name] = len(nutrients)
+                nutrients.append(
+                    {
+                        "name": nutrient_name,
+                        "unit": row.get("content_unit"),
+                        "category": row.get("nutrient_category"),
+                    }
+                )
+
+            cells_i.append(i)
+            cells_j.append(j)
+            cells_v.append(parse_number(row.get("content_per_100g")))
+
+        values = np.full((len(foods), len(nutrients)), np.nan)
+        if cells_i:
+            values[np.array(cells_i), np.array(cells_j)] = np.array(cells_v)
+
+        # JSON cannot carry NaN portably; missing food attributes become None
+        for food in foods:
+            for field in ("waste_rate", "unit_weight"):
+                if np.isnan(food[field]):
+                    food[field] = None
+
+        return cls(values, foods, nutrients)
+
+    def save(self, npy_path: str, meta_path: str):
+        """
+        存成 .npy（矩陣、排序索引、鄰居表）與 .json（詞彙表）
+
+        陣列寫入帶新版本戳記的檔名，詞彙表（記錄版本與檔名）最後以單次 rename 替換，
+        因此讀取端看到的詞彙表與陣列必定來自同一次存檔；之後才刪除舊版本的陣列檔
+        """
+        version = uuid.uuid4().hex[:12]
+        files = {"values": os.path.basename(versioned_path(npy_path, version))}
+        np.save(versioned_path(npy_path, version), self.values)
+        for name, array in (("order", self.order), ("knn", self.knn)):
+            np.save(sidecar_path(npy_path, name, version), array)
+            files[name] = os.path.basename(sidecar_path(npy_path, name, version))
+
+        tmp_meta = meta_path + ".tmp"
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": version,
+                    "files": files,
+                    "foods": self.foods,
+                    "nutrients": self.nutrients,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_meta, meta_path)
+
+        # Older versions (and the unversioned layout) are no longer referenced
+        directory = os.path.dirname(os.path.abspath(npy_path))
+        stem = os.path.splitext(os.path.basename(npy_path))[0]
+        for path in glob.glob(os.path.join(directory, glob.escape(stem) + "*.npy")):
+            if os.path.basename(path) not in files.values():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass  # Still mapped by a reader on platforms that lock open files
+
+    @classmethod
+    def load(cls, npy_path: str, meta_path: str) -> "NutrientMatrix":
+        """
+        以 memory-map 方式載入矩陣與附屬陣列（唯讀）；陣列依詞彙表記錄的版本讀取，
+        形狀與詞彙表不符時拋出 ValueError。舊版檔案缺附屬陣列時即時計算
+        """
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        version = meta.get("version")
+        # Files saved before versioning use the unversioned names
+        values = np.load(
+            versioned_path(npy_path, version) if version else npy_path, mmap_mode="r"
+        )
+        n_foods, n_nutrients = values.shape
+        if (n_foods, n_nutrients) != (len(meta["foods"]), len(meta["nutrients"])):
+            raise ValueError(
+                f"Nutrient matrix {values.shape} does not match its vocabulary "
+                f"({len(meta['foods'])} foods x {len(meta['nutrients'])} nutrients)"
+            )
+        expected = {
+            "order": (len(RANK_BASES), n_nutrients, n_foods),
+            "knn": (n_foods, min(KNN_SIZE, max(n_foods - 1, 0))),
+        }
+        sidecars = {}
+        for name, shape in expected.items():
+            path = sidecar_path(npy_path, name, version)
+            if os.path.exists(path):
+                array = np.load(path, mmap_mode="r")
+                if array.shape == shape:
+                    sidecars[name] = array
+        return cls(values, meta["foods"], meta["nutrients"], **sidecars)
+
+    # ==========================================
+    # 查詢
+    # ==========================================
+
+    def food_index(self, integration_number: str) -> Optional[int]:
+        return self._food_pos.get(integration_number)
+
+    def nutrient_index(self, name: str) -> Optional[int]:
+        """營養素名稱 -> 欄位索引（先完全比對，再以唯一的部分比對）"""
+        if name in self._nutrient_pos:
+            return self._nutrient_pos[name]
+        matches = [j for n, j in self._nutrient_pos.items() if name in n]
+        return matches[0] if len(matches) == 1 else None
+
+    def first_nutrient(self, candidates: Iterable[str]) -> Optional[int]:
+        """依序回傳第一個存在於矩陣中的營養素欄位（僅完全比對）"""
+        for name in candidates:
+            if name in self._nutrient_pos:
+                return self._nutrient_pos[name]
+        return None
+
+    def match_nutrients(self, keyword: str) -> List[int]:
+        """名稱包含關鍵字的所有營養素欄位"""
+        return [j for j, n in enumerate(self.nutrients) if keyword in n["name"]]
+
+    def top_foods(
+        self, nutrient_idx: int, n: int, basis: str = "100g", mask: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        含量最高的前 n 個食品索引（略過缺值）
+
+        Args:
+            nutrient_idx: 營養素欄位
+            n: 筆數
+            basis: RANK_BASES 之一
+            mask: 選用的 bool 陣列（長度 n_foods），僅保留為 True 的食品
+        """
+        order = np.asarray(self.order[RANK_BASES.index(basis), nutrient_idx])
+        if mask is not None:
+            order = order[mask[order]]
+        values = self.values[order, nutrient_idx]
+        if basis == "serving":
+            values = values * self.unit_weights[order]
+        # NaN are sorted last, so the valid prefix is contiguous
+        return order[: min(n, int(np.count_nonzero(~np.isnan(values))))]
+
+    def row(self, food_idx: int) -> np.ndarray:
+        return self.values[food_idx]
+
+    def format_value(self, value: float) -> str:
+        return "-" if np.isnan(value) else f"{value:g}"
@@ -0,0 +1,137 @@
+"""
+Recipe Engine - 食譜營養計算
+將食材用量（克或家用單位）換算為可食重量，套用廢棄率與每單位重，
+並以向量化方式一次計算大量食譜的總營養與每份營養
+"""
+
+import re
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Household / metric units converted to grams; volumes assume ~1 g/ml
+UNIT_GRAMS = {
+    "g": 1.0,
+    "克": 1.0,
+    "公克": 1.0,
+    "kg": 1000.0,
+    "公斤": 1000.0,
+    "台斤": 600.0,
+    "斤": 600.0,
+    "兩": 37.5,
+    "ml": 1.0,
+    "毫升": 1.0,
+    "cc": 1.0,
+    "l": 1000.0,
+    "公升": 1000.0,
+    "杯": 240.0,
+    "cup": 240.0,
+    "碗": 200.0,
+    "bowl": 200.0,
+    "大匙": 15.0,
+    "湯匙": 15.0,
+    "tbsp": 15.0,
+    "小匙": 5.0,
+    "茶匙": 5.0,
+    "tsp": 5.0,
+}
+
+# Count units that use the food's own unit weight (每單位重) from the dataset
+COUNT_UNITS = {"個", "顆", "粒", "隻", "條", "根", "片", "塊", "份", "單位", "unit", "piece", "pc", "pcs"}
+
+_QUANTITY_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)(?:\s*/\s*(\d+(?:\.\d+)?))?\s*(.*?)\s*$")
+
+
+def parse_quantity(text) -> Optional[Tuple[float, str]]:
+    """
+    解析用量字串：'150g'、'2 碗'、'1/2 杯'、'3個' -> (數量, 單位)；純數字視為克
+
+    Returns:
+        (amount, unit) 或無法解析時 None
+    """
+    if isinstance(text, (int, float)):
+        return float(text), "g"
+    match = _QUANTITY_RE.match(str(text or ""))
+    if not match:
+        return None
+    amount = float(match.group(1))
+    if match.group(2):
+        if not float(match.group(2)):
+            return None
+        amount /= float(match.group(2))
+    return amount, (match.group(3) or "g").lower()
+
+
+def parse_servings(value) -> Optional[float]:
+    """
+    解析份數：數字或數字字串（未填時為 1 份）
+
+    Returns:
+        正數份數，或無法解析 / 不大於 0 時 None
+    """
+    if value is None or value == "":
+        return 1.0
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        servings = float(value)
+    else:
+        try:
+            servings = float(str(value).strip())
+        except ValueError:
+            return None
+    return servings if servings > 0 and servings != float("inf") else None
+
+
+def to_grams(amount: float, unit: str, unit_weight: Optional[float]) -> Optional[Tuple[float, bool]]:
+    """
+    換算為克數
+
+    Returns:
+        (grams, is_count_unit) 或無法換算時 None（未知單位、或計數單位但食品無每單位重）
+    """
+    unit = (unit or "g").lower()
+    if unit in UNIT_GRAMS:
+        return amount * UNIT_GRAMS[unit], False
+    if unit in COUNT_UNITS:
+        if unit_weight is None or not unit_weight > 0:
+            return None
+        return amount * unit_weight, True
+    return None
+
+
+def compute_recipes(
+    values: np.ndarray,
+    food_idx: np.ndarray,
+    edible_grams: np.ndarray,
+    recipe_ids: np.ndarray,
+    n_recipes: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    以向量化方式彙總所有食譜的營養總量
+
+    Args:
+        values: (n_foods, n_nutrients) 每 100 克含量（NaN 為缺值）
+        food_idx: (n_ingredients,) 各食材對應的食品列
+        edible_grams: (n_ingredients,) 各食材可食重量
+        recipe_ids: (n_ingredients,) 各食材所屬食譜（須遞增排列）
+        n_recipes: 食譜數
+
+    Returns:
+        (totals, missing)：(n_recipes, n_nutrients) 營養總量與缺值食材數
+    """
+    n_nutrients = values.shape[1]
+    totals = np.zeros((n_recipes, n_nutrients))
+    missing = np.zeros((n_recipes, n_nutrients), dtype=int)
+    if not len(food_idx):
+        return totals, missing
+
+    block = np.asarray(values)[food_idx]
+    absent = np.isnan(block)
+    contrib = np.where(absent, 0.0, block) * (edible_grams / 100.0)[:, None]
+
+    # Ingredients are grouped by recipe, so each recipe is one contiguous segment
+    present, starts = np.unique(recipe_ids, return_index=True)
+    totals[present] = np.add.reduceat(contrib, starts, axis=0)
+    missing[present] = np.add.reduceat(absent.astype(int), starts, axis=0)
+    return totals, missing
@@ -0,0 +1,108 @@
+"""
+Reference Range Index - 檢驗參考值記憶體索引
+依 LOINC 碼與性別分組、以 age_min 排序的區間表，查詢時以 bisect 定位，不需 SQL
+"""
+
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional
+
+
+def _group_ranges(rows: Iterable[Dict]) -> Dict[str, Dict[str, tuple]]:
+    """LOINC 碼 -> 性別 -> (age_min 排序陣列, 對應的列)"""
+    grouped: Dict[str, Dict[str, List[Dict]]] = {}
+    for ref in rows:
+        # Rows without age bounds never matched the SQL comparison either
+        if ref.get("age_min") is None or ref.get("age_max") is None:
+            continue
+        grouped.setdefault(ref["loinc_code"], {}).setdefault(
+            ref.get("gender") or "all", []
+        ).append(ref)
+
+    indexed: Dict[str, Dict[str, tuple]] = {}
+    for code, by_gender in grouped.items():
+        indexed[code] = {}
+        for gender, refs in by_gender.items():
+            # Stable sort keeps insertion (id) order among equal age_min
+            refs.sort(key=lambda r: r["age_min"])
+            indexed[code][gender] = ([r["age_min"] for r in refs], refs)
+    return indexed
+
+
+def _find_range(
+    indexed: Dict[str, Dict[str, tuple]], loinc_code: str, age: float, gender: str
+) -> Optional[Dict]:
+    by_gender = indexed.get(loinc_code)
+    if not by_gender:
+        return None
+    for candidate in dict.fromkeys((gender, "all")):
+        entry = by_gender.get(candidate)
+        if entry is None:
+            continue
+        age_mins, refs = entry
+        # Walk back from the last interval starting at or before `age` (largest age_min first)
+        for i in range(bisect_right(age_mins, age) - 1, -1, -1):
+            if refs[i]["age_max"] >= age:
+                return refs[i]
+    return None
+
+
+class ReferenceRangeIndex:
+    """
+    參考值區間索引
+    - tests: LOINC 碼 -> loinc_mapping 列
+    - ranges: LOINC 碼 -> 性別 -> (age_min 排序陣列, 對應的 reference_ranges 列)（預設參考值）
+    - source_ranges: 來源 -> 同上（各醫院 / 學會的參考值）
+    - critical: 同上，對應的 critical_ranges 列（危急值）
+    查詢規則與原 SQL 相同：先找指定性別、再找不分性別（all），同性別內取 age_min 最大的適用區間
+    """
+
+    def __init__(
+        self,
+        tests: Iterable[Dict],
+        ranges: Iterable[Dict],
+        critical: Optional[Iterable[Dict]] = None,
+    ):
+        self.tests: Dict[str, Dict] = {t["loinc_code"]: t for t in tests}
+        ranges = list(ranges)
+        # Databases created before sources were tracked have no is_default column
+        self.ranges = _group_ranges(r for r in ranges if r.get("is_default", 1))
+
+        by_source: Dict[str, List[Dict]] = {}
+        for ref in ranges:
+            if ref.get("source"):
+                by_source.setdefault(ref["source"], []).append(ref)
+        self.source_ranges = {
+            source: _group_ranges(refs) for source, refs in by_source.items()
+        }
+        self.critical = _group_ranges(critical or [])
+
+    def __len__(self) -> int:
+        return sum(
+            len(refs) for by_gender in self.ranges.values() for _, refs in by_gender.values()
+        )
+
+    def get_test(self, loinc_code: str) -> Optional[Dict]:
+        return self.tests.get(loinc_code)
+
+    @property
+    def sources(self) -> List[str]:
+        return sorted(self.source_ranges)
+
+    def lookup(
+        self, loinc_code: str, age: float, gender: str = "all", source: Optional[str] = None
+    ) -> Optional[Dict]:
+        """
+        回傳適用的參考值列（找不到時 None）
+        指定 source 時優先使用該來源，該來源沒有此項目時改用預設參考值
+        """
+        if source:
+            ref = _find_range(self.source_ranges.get(source, {}), loinc_code, age, gender)
+            if ref is not None:
+                return ref
+        return _find_range(self.ranges, loinc_code, age, gender)
+
+    def lookup_critical(
+        self, loinc_code: str, age: float, gender: str = "all"
+    ) -> Optional[Dict]:
+        """回傳適用的危急值列（找不到時 None）"""
+        return _find_range(self.critical, loinc_code, age, gender)
@@ -1,9 +1,12 @@
+import asyncio
 import glob
 import os
+import sys
 
 from mcp.server.fastmcp import FastMCP
 
 from config import MCPConfig  # Import at top level
+from autocomplete_service import AutocompleteService
 from clinical_guideline_service import ClinicalGuidelineService
 from drug_service import DrugService
 from fhir_condition_service import FHIRConditionService
@@ -11,6 +14,7 @@ from fhir_medication_service import FHIRMedicationService
 from food_nutrition_service import FoodNutritionService
 from health_food_service import HealthFoodService
 from icd_service import ICDService
+from lab_pipeline import run_pipeline
 from lab_service import LabService
 from utils import log_error, log_info
 
@@ -32,6 +36,17 @@ else:
 
 log_info(f"Using DATA_DIR: {DATA_DIR}")
 
+# Bulk lab files read / written by MCP clients are confined to this directory
+LAB_FILES_DIR = os.path.join(DATA_DIR, "lab_files")
+
+# Bulk lab-file jobs run the CLI script in a child process, one at a time, so the
+# CPU-bound pipeline never runs on (or forks) the server process
+LAB_FILE_SCRIPT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "interpret_lab_file.py"
+)
+LAB_FILE_MAX_BYTES = 2 * 1024**3
+_lab_file_jobs = asyncio.Semaphore(1)
+
 # Automatically find the ICD-10 Excel file.
 excel_files = glob.glob(os.path.join(DATA_DIR, "*.xlsx"))
 if excel_files:
@@ -52,6 +67,7 @@ fhir_condition_service = None
 fhir_medication_service = None
 lab_service = None
 guideline_service = None
+autocomplete_service = None
 
 try:
     icd_service = ICDService(ICD_FILE_PATH, DATA_DIR)
@@ -95,22 +111,34 @@ try:
 except Exception as e:
     log_error(f"ClinicalGuidelineService failed: {e}")
 
+try:
+    autocomplete_service = AutocompleteService(
+        icd_service=icd_service, lab_service=lab_service, drug_service=drug_service
+    )
+except Exception as e:
+    log_error(f"AutocompleteService failed: {e}")
+
 # ==========================================
 # Group 1: ICD-10 Tools (Diagnosis & Procedures)
 # ==========================================
 
 
 @mcp.tool()
-def search_medical_codes(keyword: str, type: str = "all") -> str:
+def search_medical_codes(
+    keyword: str, type: str = "all", limit: int = 10, cursor: str = None
+) -> str:
     """
     Search for ICD-10-CM (Diagnosis) or ICD-10-PCS (Procedure) codes.
+    Results are ranked: exact code > code prefix > exact name > name prefix/whole word > substring.
 
     Args:
         keyword: Search term (e.g., 'Diabetes', 'E11', 'Appendectomy', '子宮內膜異位').
         type: Filter by 'diagnosis', 'procedure', or 'all'. Default is 'all'.
+        limit: Results per page for each code type. Default is 10.
+        cursor: Pass the 'next_cursor' of a previous response to fetch the next page.
     """
     log_info(f"Tool called: search_medical_codes with query='{keyword}', type='{type}'")
-    return icd_service.search_codes(keyword, type)
+    return icd_service.search_codes(keyword, type, limit=limit, cursor=cursor)
 
 
 @mcp.tool()
@@ -168,6 +196,81 @@ def check_medical_conflict(diagnosis_code: str, procedure_code: str) -> str:
     return icd_service.get_conflict_info(diagnosis_code, procedure_code)
 
 
+@mcp.tool()
+def check_medical_conflict_matrix(
+    diagnosis_codes: list[str], procedure_codes: list[str]
+) -> str:
+    """
+    Check every diagnosis × procedure combination of a claim in one call.
+
+    Retrieves all diagnosis and procedure definitions at once and returns the full
+    N×M pairing context. Each pair carries a precomputed compatibility hint comparing
+    the ICD-10-CM chapter with the ICD-10-PCS body system ('compatible', 'review', 'unknown').
+
+    Use this instead of repeated check_medical_conflict calls for surgical claims
+    with several diagnoses and procedures.
+
+    Args:
+        diagnosis_codes: ICD-10-CM diagnosis codes (e.g., ['K35.80', 'E11.9']).
+        procedure_codes: ICD-10-PCS procedure codes (e.g., ['0DTJ0ZZ', '0DTJ4ZZ']).
+
+    Returns:
+        JSON with diagnosis/procedure details, codes not found, and per-pair hints.
+    """
+    log_info(
+        f"Tool called: check_medical_conflict_matrix ({len(diagnosis_codes)} x {len(procedure_codes)})"
+    )
+    return icd_service.get_conflict_matrix(diagnosis_codes, procedure_codes)
+
+
+@mcp.tool()
+def search_procedures_by_axes(
+    section: str = None,
+    body_system: str = None,
+    operation: str = None,
+    body_part: str = None,
+    approach: str = None,
+    device: str = None,
+    qualifier: str = None,
+    limit: int = 50,
+) -> str:
+    """
+    Filter ICD-10-PCS procedure codes by any combination of their 7 axes.
+
+    PCS codes are built from axes: section, body system, operation, body part,
+    approach, device, qualifier (e.g., '0DTJ4ZZ' = Medical and Surgical / Gastrointestinal /
+    Resection / Appendix / Percutaneous Endoscopic / No Device / No Qualifier).
+
+    Args:
+        section: Axis 1 character (e.g., '0' for Medical and Surgical).
+        body_system: Axis 2 character or name (e.g., 'D', 'Gastrointestinal System').
+        operation: Axis 3 character or root operation name (e.g., 'T', 'Resection').
+        body_part: Axis 4 character (e.g., 'J' for Appendix within body system 'D').
+        approach: Axis 5 character or name (e.g., '4', 'Percutaneous Endoscopic', 'laparoscopic').
+        device: Axis 6 character (e.g., 'Z' for No Device).
+        qualifier: Axis 7 character (e.g., 'Z' for No Qualifier).
+        limit: Maximum number of codes returned. Default is 50.
+
+    Example:
+        search_procedures_by_axes(body_system='D', operation='Resection', body_part='J', approach='laparoscopic')
+        # All laparoscopic resections of the appendix
+    """
+    log_info(
+        f"Tool called: search_procedures_by_axes with section={section}, body_system={body_system}, "
+        f"operation={operation}, body_part={body_part}, approach={approach}"
+    )
+    return icd_service.search_procedures_by_axes(
+        section=section,
+        body_system=body_system,
+        operation=operation,
+        body_part=body_part,
+        approach=approach,
+        device=device,
+        qualifier=qualifier,
+        limit=limit,
+    )
+
+
 # ==========================================
 # Group 2: Drug Tools (Taiwan FDA Data)
 # ==========================================
@@ -352,15 +455,142 @@ def get_ingredients_by_category(category: str) -> str:
 
 
 @mcp.tool()
-def analyze_meal_nutrition(foods: list[str]) -> str:
+def check_ingredients_batch(names: list[str]) -> str:
+    """
+    Check a whole product formulation's ingredient list against Taiwan FDA food ingredient
+    regulations in one call. Returns per-ingredient status (approved / restricted /
+    unknown / needs_review / not_found), category, usable part and the raw restriction
+    notes; unknown means the note could not be classified and should be read as-is.
+
+    Args:
+        names: Ingredient names in Chinese, English or scientific name
+               (e.g., ['薑黃', 'Rosemary', '人參']).
+    """
+    log_info(f"Tool called: check_ingredients_batch with {len(names)} names")
+    return food_nutrition_service.check_ingredients_batch(names)
+
+
+@mcp.tool()
+def analyze_meal_nutrition(
+    foods: list[str], grams: list[float] = None, meals: list[str] = None
+) -> str:
     """
     Analyze the combined nutritional composition of multiple foods (meal planning).
+    Returns summed nutrient totals, per-meal macros (energy/protein/fat/carbohydrate
+    with energy ratios) and % of Taiwan daily reference values.
 
     Args:
         foods: List of food names to analyze together (e.g., ['白米', '雞胸肉', '青花菜']).
+        grams: Optional edible portion in grams for each food, same order as foods
+               (e.g., [150, 120, 80]). Defaults to 100 g per food.
+        meals: Optional meal label for each food (e.g., ['午餐', '午餐', '晚餐']).
     """
-    log_info(f"Tool called: analyze_meal_nutrition with foods={foods}")
-    return food_nutrition_service.analyze_diet_plan(foods)
+    log_info(f"Tool called: analyze_meal_nutrition with foods={foods}, grams={grams}")
+    return food_nutrition_service.analyze_diet_plan(foods, grams, meals)
+
+
+@mcp.tool()
+def analyze_recipe_nutrition(recipes: list[dict], nutrients: list[str] = None) -> str:
+    """
+    Compute total and per-serving nutrition for one or many recipes (menu analysis).
+    Quantities may be grams or household units; waste rate and unit weights are applied.
+
+    Args:
+        recipes: List of recipes, e.g. [{"name": "蛋炒飯", "servings": 2, "ingredients": [
+                 {"food": "白飯", "quantity": "2 碗"}, {"food": "雞蛋", "quantity": "2 個"},
+                 {"food": "青花菜", "quantity": "100g", "as_purchased": true}]}].
+                 Units: g/公克/kg/台斤/兩/ml/杯/碗/大匙/小匙, or counts (個/顆/片/份) using
+                 the food's unit weight. as_purchased=true removes the inedible waste portion
+                 (default for count units).
+        nutrients: Optional nutrient names to report (default: energy, protein, fat,
+                   saturated fat, carbohydrate, sugar, fiber, sodium).
+    """
+    log_info(f"Tool called: analyze_recipe_nutrition with {len(recipes)} recipes")
+    return food_nutrition_service.analyze_recipes(recipes, nutrients)
+
+
+@mcp.tool()
+def resolve_food_names(names: list[str], limit: int = 3) -> str:
+    """
+    Resolve food names (sample, common or English names) to dataset foods in one batch.
+    Use this to check how a meal's food names will be interpreted before analysis.
+
+    Args:
+        names: Food names (e.g., ['白飯', '蛋', 'broccoli']).
+        limit: Number of ranked candidates per name (default 3).
+    """
+    log_info(f"Tool called: resolve_food_names with names={names}")
+    return food_nutrition_service.resolve_food_names(names, limit)
+
+
+@mcp.tool()
+def rank_foods_by_nutrient(
+    nutrient: str, n: int = 20, category: str = None, per: str = "100g"
+) -> str:
+    """
+    List the foods richest in a given nutrient (e.g., top calcium sources among vegetables).
+
+    Args:
+        nutrient: Nutrient name (e.g., '鈣', '膳食纖維', '維生素C').
+        n: Number of foods to return (default 20).
+        category: Optional food category filter (e.g., '蔬菜類', '水果類').
+        per: Ranking basis: '100g' (default) or 'serving' (per unit weight).
+    """
+    log_info(
+        f"Tool called: rank_foods_by_nutrient with nutrient={nutrient}, category={category}, per={per}"
+    )
+    return food_nutrition_service.rank_foods_by_nutrient(nutrient, n, category, per)
+
+
+@mcp.tool()
+def find_similar_foods(
+    food_name: str,
+    n: int = 10,
+    metric: str = "cosine",
+    category: str = None,
+    weights: dict[str, float] = None,
+) -> str:
+    """
+    Find foods with a similar nutrient profile, e.g. substitutes for diet counseling.
+
+    Args:
+        food_name: Reference food (e.g., '白米').
+        n: Number of similar foods to return (default 10).
+        metric: 'cosine' (default) or 'euclidean', over standardized nutrient vectors.
+        category: Optional category filter for candidates (e.g., '穀物類').
+        weights: Optional nutrient weights, e.g. {'粗蛋白': 2, '鈉': 1}.
+                 When given, only the listed nutrients are compared.
+    """
+    log_info(
+        f"Tool called: find_similar_foods with food_name={food_name}, metric={metric}, category={category}"
+    )
+    return food_nutrition_service.find_similar_foods(food_name, n, metric, category, weights)
+
+
+@mcp.tool()
+def optimize_meal_plan(
+    foods: list[str],
+    diet: str = None,
+    targets: dict[str, dict[str, float]] = None,
+    max_grams: float = 300,
+    time_budget_ms: int = 2000,
+) -> str:
+    """
+    Compute gram amounts of candidate foods that best meet daily nutrient targets
+    (linear programming over the nutrient matrix).
+
+    Args:
+        foods: Candidate food names (e.g., ['糙米', '雞胸肉', '青花菜', '豆腐', '蘋果']).
+        diet: ICD-10 category with predefined targets: 'E11'/'E10' (diabetes), 'I10' (DASH),
+              'E78' (hyperlipidemia), 'E66' (weight control); None or 'default' for a general diet.
+        targets: Optional custom targets, e.g. {'鈉': {'max': 1500}, '粗蛋白': {'min': 70}}.
+        max_grams: Maximum grams per food (default 300).
+        time_budget_ms: Solver time budget in milliseconds (default 2000).
+    """
+    log_info(f"Tool called: optimize_meal_plan with diet={diet}, foods={foods}")
+    return food_nutrition_service.optimize_meal_plan(
+        foods, diet, targets, max_grams, time_budget_ms
+    )
 
 
 # ==========================================
@@ -626,7 +856,9 @@ def list_lab_categories() -> str:
 
 
 @mcp.tool()
-def get_reference_range(loinc_code: str, age: int, gender: str = "all") -> str:
+def get_reference_range(
+    loinc_code: str, age: int, gender: str = "all", source: str = None
+) -> str:
     """
     查詢檢驗參考值範圍（依年齡、性別）
 
@@ -640,9 +872,11 @@ def get_reference_range(loinc_code: str, age: int, gender: str = "all") -> str:
             - "M": 男性
             - "F": 女性
             - "all": 不分性別（預設）
+        source: 參考值來源（選填，可用 list_lab_reference_sources 查詢）；
+            該來源沒有此項目時改用預設參考值
 
     Returns:
-        檢驗項目資訊、參考值範圍（上限/下限）、適用對象
+        檢驗項目資訊、參考值範圍（上限/下限、來源與版本）、適用對象
 
     Examples:
         - get_reference_range("1558-6", age=45, gender="M")  # 45歲男性空腹血糖參考值
@@ -651,12 +885,32 @@ def get_reference_range(loinc_code: str, age: int, gender: str = "all") -> str:
     log_info(
         f"Tool called: get_reference_range for LOINC={loinc_code}, age={age}, gender={gender}"
     )
-    return lab_service.get_reference_range(loinc_code, age, gender)
+    return lab_service.get_reference_range(loinc_code, age, gender, source)
+
+
+@mcp.tool()
+def list_lab_reference_sources() -> str:
+    """
+    列出可選用的檢驗參考值來源
+
+    參考值由 CSV 載入：預設參考值（每筆附出處）與各醫院 / 學會的版本化參考值檔。
+
+    Returns:
+        可指定的來源名稱（用於 get_reference_range / interpret_lab_result 的 source 參數）
+        與已載入的檔案、版本、筆數
+    """
+    log_info("Tool called: list_lab_reference_sources")
+    return lab_service.list_reference_sources()
 
 
 @mcp.tool()
 def interpret_lab_result(
-    loinc_code: str, value: float, age: int, gender: str = "all"
+    loinc_code: str,
+    value: float,
+    age: int,
+    gender: str = "all",
+    unit: str = None,
+    source: str = None,
 ) -> str:
     """
     判讀檢驗結果（自動比對參考值，判斷是否異常）
@@ -668,10 +922,12 @@ def interpret_lab_result(
         value: 檢驗數值
         age: 患者年齡（歲）
         gender: 性別（"M"=男性, "F"=女性, "all"=不分性別）
+        unit: 檢驗值單位（選填，例如 "mmol/L"）；與參考值單位不同時自動換算後判讀
+        source: 參考值來源（選填，可用 list_lab_reference_sources 查詢）
 
     Returns:
         檢驗結果判讀：
-        - 數值狀態（正常/偏高/偏低）
+        - 數值狀態（正常/偏高/偏低/危急偏高/危急偏低）
         - 參考值範圍
         - 臨床意義
 
@@ -680,14 +936,16 @@ def interpret_lab_result(
           # 判讀空腹血糖 126 mg/dL
         - interpret_lab_result("4548-4", value=7.5, age=60, gender="F")
           # 判讀 HbA1c 7.5%
+        - interpret_lab_result("1558-6", value=7.0, age=50, gender="M", unit="mmol/L")
+          # 空腹血糖 7.0 mmol/L，換算為 mg/dL 後判讀
     """
-    log_info(f"Tool called: interpret_lab_result for LOINC={loinc_code}, value={value}")
-    return lab_service.interpret_lab_result(loinc_code, value, age, gender)
+    log_info(f"Tool called: interpret_lab_result for LOINC={loinc_code}, value={value}, unit={unit}")
+    return lab_service.interpret_lab_result(loinc_code, value, age, gender, unit, source)
 
 
 @mcp.tool()
 def batch_interpret_lab_results(
-    results_json: str, age: int, gender: str = "all"
+    results_json: str, age: int, gender: str = "all", source: str = None
 ) -> str:
     """
     批次判讀多個檢驗結果
@@ -697,11 +955,16 @@ def batch_interpret_lab_results(
     Args:
         results_json: 檢驗結果 JSON 字串
             格式: [{"loinc_code": "1558-6", "value": 126}, ...]
+            可加 "unit"（例如 {"loinc_code": "2160-0", "value": 80, "unit": "umol/L"}）自動換算
         age: 患者年齡
         gender: 性別
+        source: 參考值來源（選填）
 
     Returns:
-        批次判讀結果摘要、異常項目統計、各項目詳細判讀
+        批次判讀結果摘要、異常項目統計、各項目詳細判讀；
+        輸入足夠時附衍生計算（derived_results）：eGFR（CKD-EPI 2021，需肌酸酐與性別）、
+        計算型 LDL（總膽固醇、HDL、三酸甘油酯）、陰離子間隙（Na、Cl、HCO3 1963-8）、
+        白蛋白校正鈣（Ca 17861-6、白蛋白 1751-7）、HOMA-IR（空腹血糖、胰島素 20448-7）
 
     Example:
         batch_interpret_lab_results(
@@ -719,7 +982,7 @@ def batch_interpret_lab_results(
 
     try:
         results = json.loads(results_json)
-        return lab_service.batch_interpret_results(results, age, gender)
+        return lab_service.batch_interpret_results(results, age, gender, source)
     except json.JSONDecodeError as e:
         log_error(f"JSON decode error in batch_interpret_lab_results: {e}")
         return json.dumps(
@@ -727,6 +990,188 @@ def batch_interpret_lab_results(
         )
 
 
+@mcp.tool()
+def find_critical_lab_results(
+    results_json: str, age: int = None, gender: str = "all"
+) -> str:
+    """
+    危急值快速篩檢（只回傳危急值結果）
+
+    一次檢查大量檢驗結果（可跨多位病人），只回傳超出危急值（LL 危急偏低 / HH 危急偏高）的項目，
+    不產生完整判讀內容，適合分流與即時通報。
+
+    Args:
+        results_json: 檢驗結果 JSON 字串
+            格式: [{"loinc_code": "2823-3", "value": 6.8, "patient_id": "P001", "age": 70, "gender": "M"}, ...]
+            unit、patient_id、age、gender 為選填（age / gender 未填時使用下方預設值）
+        age: 預設年齡
+        gender: 預設性別
+
+    Returns:
+        危急值項目（原列表位置 index、病人、數值、旗標、危急值上下限）與檢查數量；
+        無法檢查的項目列於 skipped（index、loinc_code、reason：數值或年齡無效、未提供年齡、
+        找不到 LOINC 碼、未定義危急值、單位無法換算）
+
+    Example:
+        find_critical_lab_results(
+            results_json='[
+                {"loinc_code": "2823-3", "value": 6.8, "patient_id": "P001"},
+                {"loinc_code": "718-7", "value": 6.2, "patient_id": "P002"}
+            ]',
+            age=60
+        )
+    """
+    log_info("Tool called: find_critical_lab_results")
+    import json
+
+    try:
+        results = json.loads(results_json)
+        return lab_service.find_critical_results(results, age, gender)
+    except json.JSONDecodeError as e:
+        log_error(f"JSON decode error in find_critical_lab_results: {e}")
+        return json.dumps(
+            {"error": f"Invalid JSON format: {str(e)}"}, ensure_ascii=False
+        )
+
+
+def _resolve_lab_file(path: str):
+    """將檔案路徑解析至 LAB_FILES_DIR 內；超出該目錄（絕對路徑、../、符號連結）時回傳 None"""
+    base = os.path.realpath(LAB_FILES_DIR)
+    resolved = os.path.realpath(os.path.join(base, path))
+    if resolved == base or os.path.commonpath([base, resolved]) != base:
+        return None
+    return resolved
+
+
+@mcp.tool()
+async def interpret_lab_file(
+    input_path: str,
+    output_path: str,
+    chunk_size: int = 5000,
+    workers: int = 1,
+) -> str:
+    """
+    批次判讀大型檢驗結果檔案（回溯性品質稽核）
+
+    串流讀取伺服器上的 CSV / NDJSON 檔案（欄位: patient_id, age, gender, loinc_code,
+    value, unit），分塊判讀後寫出 NDJSON，記憶體用量不隨檔案大小增加。
+    輸入與輸出路徑皆相對於資料目錄下的 lab_files/，不可指向該目錄以外的檔案；
+    輸入檔上限 2 GB。判讀在獨立的子程序中執行，同一時間只處理一個檔案，其餘請求依序等候。
+
+    Args:
+        input_path: 輸入檔案路徑（.csv 或 .ndjson，相對於 lab_files/）
+        output_path: 輸出 NDJSON 檔案路徑（相對於 lab_files/）
+        chunk_size: 每個區塊的列數（預設 5000）
+        workers: worker 程序數（預設 1，上限為 CPU 核心數）
+
+    Returns:
+        處理摘要（列數、異常數、錯誤數、耗時）
+    """
+    log_info(f"Tool called: interpret_lab_file with input_path={input_path}")
+    import json
+
+    source = _resolve_lab_file(input_path)
+    target = _resolve_lab_file(output_path)
+    if source is None or target is None:
+        return json.dumps(
+            {"error": "檔案路徑必須位於 lab_files 目錄內", "lab_files_dir": LAB_FILES_DIR},
+            ensure_ascii=False,
+        )
+    if not os.path.isfile(source):
+        return json.dumps({"error": f"找不到輸入檔案: {input_path}"}, ensure_ascii=False)
+    if source == target:
+        return json.dumps({"error": "輸出檔案不可與輸入檔案相同"}, ensure_ascii=False)
+    if os.path.getsize(source) > LAB_FILE_MAX_BYTES:
+        return json.dumps(
+            {"error": f"輸入檔案超過上限 {LAB_FILE_MAX_BYTES // 1024**3} GB"}, ensure_ascii=False
+        )
+    workers = max(1, min(int(workers), os.cpu_count() or 1))
+    command = [
+        sys.executable,
+        LAB_FILE_SCRIPT,
+        source,
+        "--output",
+        target,
+        "--data-dir",
+        DATA_DIR,
+        "--chunk-size",
+        str(max(1, int(chunk_size))),
+        "--workers",
+        str(workers),
+    ]
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        async with _lab_file_jobs:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            _, stderr = await process.communicate()
+        # The script writes its JSON summary as the last line of stderr
+        lines = stderr.decode("utf-8", "replace").strip().splitlines()
+        if process.returncode != 0 or not lines:
+            log_error(f"interpret_lab_file exited with {process.returncode}: {lines[-5:]}")
+            return json.dumps(
+                {"error": f"檔案判讀失敗（exit code {process.returncode}）", "detail": lines[-5:]},
+                ensure_ascii=False,
+            )
+        return json.dumps(json.loads(lines[-1]), ensure_ascii=False)
+    except Exception as e:
+        log_error(f"Error in interpret_lab_file: {e}")
+        return json.dumps({"error": str(e)}, ensure_ascii=False)
+
+
+@mcp.tool()
+def analyze_lab_trends(
+    results_json: str, age: int, gender: str = "all", thresholds_json: str = None
+) -> str:
+    """
+    分析病人歷次檢驗結果的趨勢與 delta check
+
+    一次分析一個或多個檢驗項目的歷史數值，計算斜率、變化百分比、異常次數，
+    並標示相鄰兩次結果變化超過門檻的 delta check 警示（不需逐筆閱讀原始數值）。
+
+    Args:
+        results_json: 歷次檢驗結果 JSON 字串
+            格式: [{"loinc_code": "2160-0", "value": 1.1, "date": "2024-03-01"}, ...]
+            可加 "unit" 自動換算為參考值單位
+        age: 患者年齡
+        gender: 性別（"M"=男性, "F"=女性, "all"=不分性別）
+        thresholds_json: 自訂 delta check 門檻（選填）
+            格式: {"2160-0": {"absolute": 0.3, "percent": 50}}
+
+    Returns:
+        各項目的趨勢摘要（首次/最新數值、斜率（每年）、變化百分比、趨勢方向、異常次數）
+        與 delta check 警示
+
+    Example:
+        analyze_lab_trends(
+            results_json='[
+                {"loinc_code": "2160-0", "value": 1.0, "date": "2024-01-10"},
+                {"loinc_code": "2160-0", "value": 1.5, "date": "2024-02-10"},
+                {"loinc_code": "4548-4", "value": 7.8, "date": "2024-01-10"},
+                {"loinc_code": "4548-4", "value": 7.1, "date": "2024-04-10"}
+            ]',
+            age=65,
+            gender="M"
+        )
+    """
+    log_info(f"Tool called: analyze_lab_trends for age={age}, gender={gender}")
+    import json
+
+    try:
+        results = json.loads(results_json)
+        thresholds = json.loads(thresholds_json) if thresholds_json else None
+        return lab_service.analyze_lab_trends(results, age, gender, thresholds)
+    except json.JSONDecodeError as e:
+        log_error(f"JSON decode error in analyze_lab_trends: {e}")
+        return json.dumps(
+            {"error": f"Invalid JSON format: {str(e)}"}, ensure_ascii=False
+        )
+
+
 # ==========================================
 # Group 9: Clinical Guideline Tools
 # ==========================================
@@ -878,7 +1323,28 @@ def suggest_clinical_pathway(icd_code: str, patient_context_json: str = None) ->
 
 
 # ==========================================
-# Group 10: FHIR Medication Tools
+# Group 10: Autocomplete
+# ==========================================
+
+
+@mcp.tool()
+def autocomplete_medical_terms(prefix: str, domain: str = "all", limit: int = 10) -> str:
+    """
+    Prefix suggestions for ICD codes/names, LOINC codes/names and drug names.
+
+    Answers from an in-memory sorted prefix index, suitable for per-keystroke use.
+
+    Args:
+        prefix: Text typed so far (e.g., 'E11', '糖尿', 'glu', 'ALT').
+        domain: 'icd', 'loinc', 'drug', or 'all'. Default is 'all'.
+        limit: Maximum suggestions per domain. Default is 10.
+    """
+    log_info(f"Tool called: autocomplete_medical_terms with prefix='{prefix}', domain='{domain}'")
+    return autocomplete_service.autocomplete(prefix, domain, limit)
+
+
+# ==========================================
+# Group 11: FHIR Medication Tools
 # ==========================================
 
 
@@ -0,0 +1,219 @@
+"""
+Unit Conversion - 檢驗數值單位換算
+以 UCUM 風格解析單位（前綴 + 基本單位、10^N 計數、分子/分母），
+並以各檢驗項目（LOINC）的分子量、價數處理質量 ↔ 莫耳換算；
+換算結果編譯為 (scale, offset) 並依 (LOINC, 來源單位, 目標單位) 快取，批次時以陣列一次套用
+"""
+
+from functools import lru_cache
+import re
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# SI prefixes (lower-cased; mega is not used by lab units and would clash with milli)
+PREFIXES = {
+    "k": 1e3,
+    "d": 1e-1,
+    "c": 1e-2,
+    "m": 1e-3,
+    "u": 1e-6,
+    "n": 1e-9,
+    "p": 1e-12,
+    "f": 1e-15,
+}
+
+# Base atoms -> (dimension, factor to the dimension's base unit)
+BASE_UNITS = {
+    "g": ("mass", 1.0),
+    "mol": ("amount", 1.0),
+    "eq": ("equivalent", 1.0),
+    "l": ("volume", 1.0),
+    "kat": ("enzyme", 1.0),
+    "u": ("enzyme", 1e-6 / 60),  # 1 U = 1 umol/min = 16.67 nkat
+    "iu": ("iu", 1.0),
+    "s": ("time", 1.0),
+    "sec": ("time", 1.0),
+    "min": ("time", 60.0),
+    "h": ("time", 3600.0),
+    "hr": ("time", 3600.0),
+}
+
+# Whole tokens with a fixed meaning
+SPECIAL_TOKENS = {
+    "%": ({}, 1e-2),
+    "ratio": ({}, 1.0),
+    "cells": ({"count": 1}, 1.0),
+    "k": ({"count": 1}, 1e3),  # K/uL
+    "thou": ({"count": 1}, 1e3),
+}
+
+# Molar mass (g/mol) per LOINC code for mass <-> amount conversions
+MOLAR_MASSES = {
+    "1558-6": 180.16,  # Glucose (fasting)
+    "2345-7": 180.16,  # Glucose
+    "2093-3": 386.65,  # Cholesterol
+    "2085-9": 386.65,  # HDL cholesterol
+    "2089-1": 386.65,  # LDL cholesterol
+    "2571-8": 885.7,  # Triglyceride (as triolein)
+    "1975-2": 584.66,  # Bilirubin
+    "2160-0": 113.12,  # Creatinine
+    "3094-0": 28.014,  # Urea nitrogen (2 N)
+    "2951-2": 22.99,  # Sodium
+    "2823-3": 39.098,  # Potassium
+    "2075-0": 35.45,  # Chloride
+    "718-7": 16114.5,  # Hemoglobin (monomer)
+    "3053-6": 776.87,  # Free T4
+    "17861-6": 40.078,  # Calcium
+    "2000-8": 40.078,  # Calcium
+    "1751-7": 66500.0,  # Albumin
+    "2947-0": 22.99,  # Sodium (blood)
+    "6298-4": 39.098,  # Potassium (blood)
+}
+
+# Ionic charge per LOINC code for mEq <-> mmol
+VALENCES = {
+    "2951-2": 1,
+    "2947-0": 1,
+    "2823-3": 1,
+    "6298-4": 1,
+    "2075-0": 1,
+    "17861-6": 2,
+    "2000-8": 2,
+}
+
+# HbA1c LOINC codes (NGSP % and IFCC mmol/mol reporting)
+HBA1C_CODES = ("4548-4", "4549-2", "17856-6", "59261-8")
+
+# Analyte-specific affine conversions: (code, from, to) -> (scale, offset)
+# HbA1c: IFCC (mmol/mol) = 10.929 x (NGSP % - 2.15)
+AFFINE_CONVERSIONS = {
+    **{(code, "%", "mmol/mol"): (10.929, -2.15 * 10.929) for code in HBA1C_CODES},
+    **{(code, "mmol/mol", "%"): (1 / 10.929, 2.15) for code in HBA1C_CODES},
+}
+
+# Unit pairs that only convert through AFFINE_CONVERSIONS, never as plain ratios
+AFFINE_ONLY_PAIRS = {("%", "mmol/mol"), ("mmol/mol", "%")}
+
+_POWER_RE = re.compile(r"^10(?:\^|\*|e)?([+-]?\d+)(.*)$")
+
+
+def normalize_unit(unit: str) -> str:
+    """單位字串正規化（小寫、去空白、µ/μ -> u、× -> *）"""
+    text = str(unit or "").strip().lower()
+    for old, new in (("µ", "u"), ("μ", "u"), ("×", "*"), (" ", ""), ("mcg", "ug")):
+        text = text.replace(old, new)
+    return text
+
+
+def _parse_atom(token: str) -> Optional[Tuple[Dict[str, int], float]]:
+    """解析單一單位記號，例如 'mg'、'umol'、'10^3'、'10*9'、'%'"""
+    if token in SPECIAL_TOKENS:
+        dims, factor = SPECIAL_TOKENS[token]
+        return dict(dims), factor
+
+    factor = 1.0
+    match = _POWER_RE.match(token)
+    if match:
+        factor = 10.0 ** int(match.group(1))
+        token = match.group(2).lstrip("*")
+        if not token:
+            # Bare powers of ten are cell/particle counts (10^3/uL)
+            return {"count": 1}, factor
+
+    if token in BASE_UNITS:
+        dim, base = BASE_UNITS[token]
+        return {dim: 1}, factor * base
+    if token[:1] in PREFIXES and token[1:] in BASE_UNITS:
+        dim, base = BASE_UNITS[token[1:]]
+        return {dim: 1}, factor * PREFIXES[token[:1]] * base
+    return None
+
+
+@lru_cache(maxsize=1024)
+def parse_unit(unit: str) -> Optional[Tuple[Tuple[Tuple[str, int], ...], float]]:
+    """
+    將單位解析為 (維度, 換算至基本單位的倍數)
+
+    Returns:
+        ((("mass", 1), ("volume", -1)), 10.0) 代表 mg/dL = 10 g/L；無法解析時 None
+    """
+    text = normalize_unit(unit)
+    if not text:
+        return None
+    parts = text.split("/")
+    dims: Dict[str, int] = {}
+    factor = 1.0
+    for position, part in enumerate(parts):
+        if not part:
+            if position == 0:
+                continue  # '/uL'
+            return None
+        parsed = _parse_atom(part)
+        if parsed is None:
+            return None
+        atom_dims, atom_factor = parsed
+        sign = 1 if position == 0 else -1
+        for dim, exp in atom_dims.items():
+            dims[dim] = dims.get(dim, 0) + sign * exp
+        factor = factor * atom_factor if sign > 0 else factor / atom_factor
+    return tuple(sorted((d, e) for d, e in dims.items() if e)), factor
+
+
+@lru_cache(maxsize=4096)
+def compile_conversion(
+    loinc_code: str, from_unit: str, to_unit: str
+) -> Optional[Tuple[float, float]]:
+    """
+    編譯 from_unit -> to_unit 的換算為 (scale, offset)：converted = value * scale + offset
+
+    Returns:
+        無法換算（維度不同且無分子量 / 價數）時 None
+    """
+    source, target = normalize_unit(from_unit), normalize_unit(to_unit)
+    if source == target:
+        return 1.0, 0.0
+    if (loinc_code, source, target) in AFFINE_CONVERSIONS:
+        return AFFINE_CONVERSIONS[(loinc_code, source, target)]
+    if (source, target) in AFFINE_ONLY_PAIRS:
+        return None
+
+    parsed_from, parsed_to = parse_unit(source), parse_unit(target)
+    if parsed_from is None or parsed_to is None:
+        return None
+    dims_from, factor_from = parsed_from
+    dims_to, factor_to = parsed_to
+    if dims_from == dims_to:
+        return factor_from / factor_to, 0.0
+
+    # Bridge the numerator dimension through the analyte's molar mass or valence
+    molar_mass = MOLAR_MASSES.get(loinc_code)
+    valence = VALENCES.get(loinc_code)
+    bridges = {}
+    if molar_mass:
+        bridges[("mass", "amount")] = 1.0 / molar_mass
+        bridges[("amount", "mass")] = molar_mass
+    if valence:
+        bridges[("equivalent", "amount")] = 1.0 / valence
+        bridges[("amount", "equivalent")] = float(valence)
+        if molar_mass:
+            bridges[("mass", "equivalent")] = valence / molar_mass
+            bridges[("equivalent", "mass")] = molar_mass / valence
+
+    rest_from = {d: e for d, e in dims_from if d not in ("mass", "amount", "equivalent")}
+    rest_to = {d: e for d, e in dims_to if d not in ("mass", "amount", "equivalent")}
+    num_from = [d for d, e in dims_from if d in ("mass", "amount", "equivalent") and e == 1]
+    num_to = [d for d, e in dims_to if d in ("mass", "amount", "equivalent") and e == 1]
+    if rest_from != rest_to or len(num_from) != 1 or len(num_to) != 1:
+        return None
+    bridge = bridges.get((num_from[0], num_to[0]))
+    if bridge is None:
+        return None
+    return factor_from * bridge / factor_to, 0.0
+
+
+def convert_values(
+    values: np.ndarray, scales: np.ndarray, offsets: np.ndarray
+) -> np.ndarray:
+    """以陣列套用已編譯的換算（批次判讀用）"""
+    return values * scales + offsets
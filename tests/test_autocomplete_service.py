@@ -0,0 +1,87 @@
+import re
+import threading
+import time
+
+import pytest
+
+from autocomplete_service import AutocompleteService, word_starts
+from lab_service import LabService
+
+
+@pytest.fixture(scope="module")
+def lab_service(tmp_path_factory):
+    return LabService(str(tmp_path_factory.mktemp("lab")))
+
+
+@pytest.fixture
+def autocomplete(lab_service):
+    service = AutocompleteService(lab_service=lab_service)
+    # Wait for the warm-up thread; queries during the first build see no index
+    for _ in range(500):
+        if service._get_index("loinc") is not None:
+            return service
+        time.sleep(0.01)
+    pytest.fail("autocomplete index was not built")
+
+
+def _codes(service, prefix):
+    return [s["loinc_code"] for s in service.suggest(prefix, "loinc", limit=20)]
+
+
+def test_word_starts_store_words_and_offsets():
+    assert word_starts("human insulin (rdna)") == [("insulin", 6), ("rdna", 15)]
+    assert word_starts("第二型糖尿病，未伴有併發症") == [("未伴有併發症", 7)]
+    assert word_starts("insulin") == []
+
+
+def test_whole_name_and_code_prefixes(autocomplete):
+    assert _codes(autocomplete, "98979")[0] == "98979-8"
+    assert "98979-8" in _codes(autocomplete, "腎絲球")
+
+
+def test_later_name_words_match(autocomplete):
+    assert "98979-8" in _codes(autocomplete, "ckd")
+    # A prefix spanning several words is checked against the rest of the name
+    assert _codes(autocomplete, "epi 2021") == ["98979-8"]
+    assert _codes(autocomplete, "epi 2009") == []
+
+
+def test_word_index_holds_words_not_suffixes(autocomplete):
+    index = autocomplete._get_index("loinc")
+    assert all(re.fullmatch(r"\w+", word) for word in index["word_keys"])
+    # Sources point at the whole-name keys instead of copying them
+    keys = {id(key) for key in index["keys"]}
+    assert all(id(name) in keys for name, _ in index["word_sources"])
+
+
+def test_queries_do_not_wait_for_a_rebuild(autocomplete):
+    index = autocomplete._get_index("loinc")
+    release = threading.Event()
+    load_pairs = autocomplete._load_pairs
+
+    def slow_load_pairs(domain, service):
+        release.wait(5)
+        return load_pairs(domain, service)
+
+    autocomplete._load_pairs = slow_load_pairs
+    # Pretend the source database changed so the next lookup rebuilds
+    autocomplete._indexes["loinc"] = {**index, "mtime": None, "checked_at": float("-inf")}
+    builder = threading.Thread(target=autocomplete._get_index, args=("loinc",))
+    builder.start()
+    try:
+        for _ in range(500):
+            if "loinc" in autocomplete._building:
+                break
+            time.sleep(0.01)
+        started = time.monotonic()
+        assert "98979-8" in _codes(autocomplete, "ckd")
+        assert time.monotonic() - started < 1.0
+    finally:
+        release.set()
+        builder.join()
+    # The warm-up thread may have picked up the rebuild instead of `builder`
+    for _ in range(500):
+        if not autocomplete._building:
+            break
+        time.sleep(0.01)
+    assert autocomplete._indexes["loinc"]["mtime"] is not None
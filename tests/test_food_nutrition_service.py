@@ -0,0 +1,201 @@
+from datetime import datetime
+import json
+import sqlite3
+
+import pytest
+
+from food_nutrition_service import FoodNutritionService
+
+# (integration_number, sample_name, category, waste_rate, unit_weight, {nutrient: (unit, per 100 g)})
+FOODS = [
+    ("A001", "白米飯", "穀物類", 0.0, None, {"熱量": ("kcal", 183.0), "粗蛋白": ("g", 3.1)}),
+    ("B001", "雞蛋", "蛋類", 12.0, 50.0, {"熱量": ("kcal", 134.0), "粗蛋白": ("g", 12.5)}),
+]
+
+
+@pytest.fixture
+def service(tmp_path):
+    conn = sqlite3.connect(tmp_path / "food_nutrition.db")
+    conn.execute(
+        """
+        CREATE TABLE nutrition (
+            food_category TEXT, integration_number TEXT, sample_name TEXT, common_name TEXT,
+            english_name TEXT, content_description TEXT, waste_rate REAL,
+            nutrient_category TEXT, nutrient_item TEXT, content_unit TEXT,
+            content_per_100g REAL, unit_weight REAL
+        )
+        """
+    )
+    conn.executemany(
+        "INSERT INTO nutrition VALUES (?, ?, ?, '', '', '', ?, '一般成分', ?, ?, ?, ?)",
+        [
+            (category, number, name, waste, nutrient, unit, amount, unit_weight)
+            for number, name, category, waste, unit_weight, nutrients in FOODS
+            for nutrient, (unit, amount) in nutrients.items()
+        ],
+    )
+    conn.commit()
+    conn.close()
+    # A fresh metadata file keeps the service from downloading the datasets
+    with open(tmp_path / "food_nutrition_meta.json", "w") as f:
+        json.dump({"last_updated": datetime.now().isoformat()}, f)
+
+    service = FoodNutritionService(str(tmp_path))
+    yield service
+    service.scheduler.shutdown(wait=False)
+
+
+def _analyze(service, recipes):
+    return json.loads(service.analyze_recipes(recipes))["recipes"]
+
+
+def test_analyze_recipes_totals(service):
+    [recipe] = _analyze(
+        service,
+        [{"name": "蛋炒飯", "servings": 2, "ingredients": [
+            {"food": "白米飯", "quantity": "1 碗"},
+            {"food": "雞蛋", "quantity": "2 個"},
+        ]}],
+    )
+    # 200 g rice + 2 eggs x 50 g less 12 % shell
+    assert recipe["edible_grams"] == 288.0
+    assert recipe["total"]["熱量"]["amount"] == pytest.approx(366.0 + 88.0 * 1.34, abs=0.01)
+    assert recipe["per_serving"]["熱量"]["amount"] == pytest.approx((366.0 + 88.0 * 1.34) / 2, abs=0.01)
+    assert recipe["unresolved"] == []
+
+
+def test_analyze_recipes_reports_malformed_ingredients_per_recipe(service):
+    recipes = _analyze(
+        service,
+        [
+            {"name": "字串食材", "ingredients": "rice"},
+            {"name": "混合", "ingredients": ["rice", None, {"food": "白米飯", "quantity": "100g"}]},
+            {"name": "錯誤份數", "servings": 0, "ingredients": []},
+            {"name": "無效用量", "ingredients": [{"food": "白米飯", "quantity": "1/0 碗"}]},
+        ],
+    )
+    assert recipes[0] == {"name": "字串食材", "error": "ingredients 需為食材物件的陣列"}
+
+    assert recipes[1]["total"]["熱量"]["amount"] == 183.0
+    assert [p["food"] for p in recipes[1]["unresolved"]] == ["rice", None]
+    assert all("格式錯誤" in p["reason"] for p in recipes[1]["unresolved"])
+
+    assert "份數" in recipes[2]["error"]
+    assert recipes[3]["unresolved"][0]["reason"].startswith("無法換算用量")
+
+
+INGREDIENTS = [
+    ("薑黃", "Turmeric", "Curcuma longa", ""),
+    ("人參", "Ginseng", "Panax ginseng", "未限制"),
+    ("銀杏", "Ginkgo", "Ginkgo biloba", "限用於膠囊錠狀食品"),
+    ("迷迭香", "Rosemary", "Rosmarinus officinalis", "本品為傳統食品原料"),
+]
+
+
+def _add_ingredients(service, rows):
+    conn = sqlite3.connect(service.db_path)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS food_ingredients (
+            regulation_note TEXT, major_category TEXT, sub_category TEXT, name_zh TEXT,
+            name_en TEXT, scientific_name TEXT, part TEXT, note TEXT
+        )
+        """
+    )
+    conn.executemany(
+        "INSERT INTO food_ingredients VALUES ('', '植物類', '草本', ?, ?, ?, '', ?)", rows
+    )
+    conn.commit()
+    conn.close()
+
+
+def _statuses(service, names):
+    items = json.loads(service.check_ingredients_batch(names))["items"]
+    return {item["input"]: item["status"] for item in items}
+
+
+def test_check_ingredients_status_follows_the_note(service):
+    _add_ingredients(service, INGREDIENTS)
+    items = json.loads(service.check_ingredients_batch(["薑黃", "人參", "Ginkgo", "迷迭香"]))["items"]
+    assert [item["status"] for item in items] == ["approved", "approved", "restricted", "unknown"]
+    # Notes no rule understands are passed through verbatim
+    assert items[3]["matches"][0]["restriction"] == "本品為傳統食品原料"
+    assert items[3]["matches"][0]["restriction_status"] == "unknown"
+
+
+def test_ingredient_index_rebuilds_after_a_write(service):
+    _add_ingredients(service, INGREDIENTS[:1])
+    assert _statuses(service, ["人參"]) == {"人參": "not_found"}
+    _add_ingredients(service, INGREDIENTS[1:2])
+    assert _statuses(service, ["人參"]) == {"人參": "approved"}
+
+
+class _FakeResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.headers = {"Content-Type": "application/json"}
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+def _fake_download(service, monkeypatch, ingredients):
+    def get(url, **kwargs):
+        if url == service.API_SOURCES["ingredients"]:
+            return _FakeResponse(200, ingredients)
+        return _FakeResponse(503)
+
+    monkeypatch.setattr("food_nutrition_service.requests.get", get)
+
+
+def _fts_names(db_path, keyword):
+    conn = sqlite3.connect(db_path)
+    try:
+        return [
+            row[0]
+            for row in conn.execute(
+                "SELECT name_zh FROM food_ingredients_fts WHERE food_ingredients_fts MATCH ?",
+                (f'"{keyword}"',),
+            )
+        ]
+    finally:
+        conn.close()
+
+
+def test_ingredient_reload_and_fts_rebuild_commit_together(service, monkeypatch):
+    _add_ingredients(service, INGREDIENTS[:1])
+    conn = sqlite3.connect(service.db_path)
+    assert service._build_ingredients_fts(conn)
+    conn.close()
+    _fake_download(
+        service, monkeypatch, [{"中文名稱": "枸杞子", "英文名稱": "Goji berry", "備註": ""}]
+    )
+
+    seen_during_rebuild = []
+    build_fts = service._build_ingredients_fts
+
+    def checking_build(conn):
+        # Another connection still sees the old table and index until the commit
+        seen_during_rebuild.append(_fts_names(service.db_path, "Turmeric"))
+        return build_fts(conn)
+
+    monkeypatch.setattr(service, "_build_ingredients_fts", checking_build)
+    service._update_all_data()
+
+    assert seen_during_rebuild == [["薑黃"]]
+    assert _fts_names(service.db_path, "Turmeric") == []
+    assert _fts_names(service.db_path, "Goji berry") == ["枸杞子"]
+    assert _statuses(service, ["枸杞子", "薑黃"]) == {"枸杞子": "approved", "薑黃": "not_found"}
+
+
+def test_failed_ingredient_reload_keeps_the_old_table(service, monkeypatch):
+    _add_ingredients(service, INGREDIENTS[:1])
+    _fake_download(service, monkeypatch, [{"中文名稱": "枸杞子"}])
+
+    def fail(*args):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(service, "_record_parse_failures", fail)
+    service._update_all_data()
+    assert _statuses(service, ["薑黃", "枸杞子"]) == {"薑黃": "approved", "枸杞子": "not_found"}
@@ -0,0 +1,61 @@
+from fuzzy_search import (
+    NGramIndex,
+    char_ngrams,
+    levenshtein,
+    normalize_code,
+    normalize_text,
+    partial_levenshtein,
+)
+
+
+def test_normalize_text_full_width_and_spaces():
+    assert normalize_text("  Ｅ１１  Type\t2 ") == "e11 type 2"
+    assert normalize_text(None) == ""
+
+
+def test_normalize_code_drops_dots():
+    assert normalize_code("Ｅ11.9") == "e119"
+
+
+def test_char_ngrams():
+    assert char_ngrams("abc") == {"ab", "bc"}
+    assert char_ngrams("a") == {"a"}
+    assert char_ngrams("") == set()
+
+
+def test_levenshtein():
+    assert levenshtein("kitten", "sitting") == 3
+    assert levenshtein("", "abc") == 3
+    assert levenshtein("same", "same") == 0
+
+
+def test_partial_levenshtein_matches_substring():
+    assert partial_levenshtein("apendicitis", "acute appendicitis") == 1
+    assert partial_levenshtein("", "anything") == 0
+    assert partial_levenshtein("abc", "") == 3
+
+
+def test_ngram_index_ranks_closest_match_first():
+    index = NGramIndex(n=2)
+    index.add("Acute appendicitis", 1)
+    index.add("Acute pancreatitis", 2)
+    index.add("Type 2 diabetes mellitus", 3)
+    results = index.search("apendicitis")
+    assert results[0][0] == 1
+    assert results[0][1] == round(1 - 1 / len("apendicitis"), 4)
+    assert all(doc_id != 3 for doc_id, _, _ in results)
+
+
+def test_ngram_index_code_normalizer_prefers_whole_code():
+    index = NGramIndex(n=2, normalizer=normalize_code)
+    index.add("E11.9", 1)
+    index.add("E11.90", 2)
+    doc_id, similarity, text = index.search("E11.9x")[0]
+    assert (doc_id, text) == (1, "e119")
+    assert similarity == 0.8
+
+
+def test_ngram_index_empty_query():
+    index = NGramIndex()
+    index.add("abc", 1)
+    assert index.search("") == []
@@ -0,0 +1,183 @@
+import json
+import sqlite3
+
+import pytest
+
+from icd_service import ICDService
+
+DIAGNOSES = [
+    ("E11.9", "Type 2 diabetes mellitus without complications", "第二型糖尿病，無併發症"),
+    ("E11.65", "Type 2 diabetes mellitus with hyperglycemia", "第二型糖尿病伴有高血糖"),
+    ("I21.9", "Acute myocardial infarction, unspecified", "急性心肌梗塞"),
+    ("K35.80", "Unspecified acute appendicitis", "急性闌尾炎"),
+    ("C18.0", "Malignant neoplasm of cecum", "盲腸惡性腫瘤"),
+]
+
+PROCEDURES = [
+    ("0DTJ4ZZ", "Resection of Appendix, Percutaneous Endoscopic Approach", "腹腔鏡闌尾切除術"),
+    ("0DTJ0ZZ", "Resection of Appendix, Open Approach", "開腹闌尾切除術"),
+    ("02703ZZ", "Dilation of Coronary Artery, One Artery, Percutaneous Approach", "冠狀動脈擴張術"),
+    ("0WJG0ZZ", "Inspection of Peritoneal Cavity, Open Approach", "腹膜腔檢查"),
+    # Stored with surrounding whitespace, as some Excel exports do
+    (" 0DBJ4ZZ ", "Excision of Appendix, Percutaneous Endoscopic Approach", "腹腔鏡闌尾部分切除"),
+]
+
+
+@pytest.fixture
+def service(tmp_path):
+    conn = sqlite3.connect(tmp_path / "icd10_smart.db")
+    conn.execute("CREATE TABLE diagnoses (code TEXT, name_en TEXT, name_zh TEXT, category TEXT)")
+    conn.executemany(
+        "INSERT INTO diagnoses VALUES (?, ?, ?, ?)",
+        [(code, en, zh, code[:3]) for code, en, zh in DIAGNOSES],
+    )
+    conn.execute("CREATE TABLE procedures (code TEXT, name_en TEXT, name_zh TEXT)")
+    conn.executemany("INSERT INTO procedures VALUES (?, ?, ?)", PROCEDURES)
+    conn.commit()
+    conn.close()
+    return ICDService(str(tmp_path / "missing.xlsx"), str(tmp_path))
+
+
+def _pair(matrix, diagnosis_code, procedure_code):
+    return next(
+        p
+        for p in matrix["pairs"]
+        if p["diagnosis_code"] == diagnosis_code and p["procedure_code"] == procedure_code
+    )
+
+
+def test_conflict_matrix_covers_every_pair_in_caller_order(service):
+    matrix = json.loads(
+        service.get_conflict_matrix(["K35.80", "I21.9", "K35.80"], ["0DTJ4ZZ", "02703ZZ"])
+    )
+    assert [(p["diagnosis_code"], p["procedure_code"]) for p in matrix["pairs"]] == [
+        ("K35.80", "0DTJ4ZZ"),
+        ("K35.80", "02703ZZ"),
+        ("I21.9", "0DTJ4ZZ"),
+        ("I21.9", "02703ZZ"),
+    ]
+    assert set(matrix["diagnoses"]) == {"K35.80", "I21.9"}
+    assert matrix["procedures"]["0DTJ4ZZ"]["name_zh"] == "腹腔鏡闌尾切除術"
+
+
+def test_conflict_matrix_hints(service):
+    matrix = json.loads(
+        service.get_conflict_matrix(
+            ["K35.80", "I21.9", "C18.0"], ["0DTJ4ZZ", "02703ZZ", "0WJG0ZZ"]
+        )
+    )
+    appendectomy = _pair(matrix, "K35.80", "0DTJ4ZZ")
+    assert appendectomy["diagnosis_chapter"] == "消化系統疾病"
+    assert appendectomy["procedure_body_system"] == "Gastrointestinal System"
+    assert appendectomy["compatibility_hint"] == "compatible"
+
+    assert _pair(matrix, "I21.9", "02703ZZ")["compatibility_hint"] == "compatible"
+    assert _pair(matrix, "I21.9", "0DTJ4ZZ")["compatibility_hint"] == "review"
+    assert _pair(matrix, "K35.80", "02703ZZ")["compatibility_hint"] == "review"
+    # Neoplasms may justify a procedure on any body system
+    assert _pair(matrix, "C18.0", "02703ZZ")["compatibility_hint"] == "compatible"
+    # General anatomical regions accept every chapter
+    assert _pair(matrix, "I21.9", "0WJG0ZZ")["compatibility_hint"] == "compatible"
+
+
+def test_conflict_matrix_reports_unknown_codes(service):
+    matrix = json.loads(service.get_conflict_matrix(["K35.80", "ZZZ.9"], ["0DTJ4ZZ", "XXXXXXX"]))
+    assert matrix["not_found"] == {"diagnoses": ["ZZZ.9"], "procedures": ["XXXXXXX"]}
+    assert len(matrix["pairs"]) == 4
+    assert _pair(matrix, "ZZZ.9", "0DTJ4ZZ")["compatibility_hint"] == "unknown"
+    assert _pair(matrix, "K35.80", "XXXXXXX")["diagnosis_chapter"] == "消化系統疾病"
+    assert _pair(matrix, "K35.80", "XXXXXXX")["compatibility_hint"] == "unknown"
+
+
+def test_conflict_matrix_empty_input(service):
+    matrix = json.loads(service.get_conflict_matrix([], ["0DTJ4ZZ", ""]))
+    assert matrix["pairs"] == []
+    assert matrix["not_found"] == {"diagnoses": [], "procedures": []}
+
+
+def _axes(service, **filters):
+    return json.loads(service.search_procedures_by_axes(**filters))
+
+
+def test_pcs_axes_are_decomposed_from_trimmed_codes(service):
+    result = _axes(service, operation="B")
+    assert [r["code"].strip() for r in result["results"]] == ["0DBJ4ZZ"]
+    row = result["results"][0]
+    assert (row["body_system"], row["body_part"], row["approach"]) == ("D", "J", "4")
+
+
+def test_pcs_axis_names_resolve_to_code_characters(service):
+    result = _axes(service, operation="Resection", approach="laparoscopic")
+    assert result["filters"] == {"section": "0", "operation": "T", "approach": "4"}
+    assert [r["code"] for r in result["results"]] == ["0DTJ4ZZ"]
+    assert result["results"][0]["axis_labels"] == {
+        "body_system": "Gastrointestinal System",
+        "operation": "Resection",
+        "approach": "Percutaneous Endoscopic",
+    }
+    # An unambiguous partial name also resolves
+    assert _axes(service, body_system="gastro", body_part="j")["total_found"] == 3
+
+
+def test_pcs_unknown_axis_name_lists_valid_values(service):
+    result = _axes(service, operation="Resect appendix")
+    assert result["error"] == "Invalid operation 'Resect appendix': unknown name"
+    assert result["valid_values"]["T"] == "Resection"
+
+
+def test_pcs_ambiguous_axis_name_lists_candidates(service):
+    result = _axes(service, approach="Opening")
+    assert result["error"].startswith("Invalid approach 'Opening': ambiguous name")
+    assert set(result["valid_values"]) == {"7", "8", "F"}
+
+
+def test_pcs_unlabelled_axis_rejects_names(service):
+    result = _axes(service, body_part="Appendix")
+    assert "single code character" in result["error"]
+    assert "valid_values" not in result
+
+
+def test_pcs_requires_a_filter(service):
+    assert "error" in _axes(service, device="  ")
+
+
+def _search(service, keyword, **kwargs):
+    return json.loads(service.search_codes(keyword, **kwargs))
+
+
+def test_search_ranks_exact_code_first(service):
+    result = _search(service, "E11.9", type="diagnosis")
+    assert [(r["code"], r["match"]) for r in result["diagnoses"]] == [("E11.9", "exact_code")]
+    # A code typed without its dot still hits the exact tier
+    assert _search(service, "e119", type="diagnosis")["diagnoses"][0]["match"] == "exact_code"
+
+
+def test_search_cursor_round_trip_covers_every_row_once(service):
+    first = _search(service, "Approach", type="procedure", limit=2)
+    seen = [r["code"] for r in first["procedures"]]
+    cursor = first["next_cursor"]
+    while cursor:
+        page = _search(service, "Approach", type="procedure", limit=2, cursor=cursor)
+        seen += [r["code"] for r in page["procedures"]]
+        cursor = page["next_cursor"]
+
+    everything = _search(service, "Approach", type="procedure", limit=50)
+    assert "next_cursor" not in everything
+    assert seen == [r["code"] for r in everything["procedures"]]
+    assert len(seen) == len(PROCEDURES)
+
+
+def test_search_cursor_skips_exhausted_tables(service):
+    first = _search(service, "appendi", limit=1)
+    assert len(first["diagnoses"]) == 1 and len(first["procedures"]) == 1
+    second = _search(service, "appendi", limit=1, cursor=first["next_cursor"])
+    # The single appendicitis diagnosis was exhausted on page one
+    assert second["diagnoses"] == []
+    assert len(second["procedures"]) == 1
+    assert second["procedures"][0]["code"] != first["procedures"][0]["code"]
+
+
+def test_search_invalid_cursor_restarts_and_limit_is_clamped(service):
+    restarted = _search(service, "E11", type="diagnosis", limit=0, cursor="not-a-cursor")
+    assert [r["code"] for r in restarted["diagnoses"]] == ["E11.65"]
+    assert "next_cursor" in restarted
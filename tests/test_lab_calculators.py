@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from lab_calculators import DERIVED_TESTS, derive, egfr_ckd_epi
+from lab_pipeline import derived_records
+
+
+def test_egfr_ckd_epi_2021_reference_values():
+    egfr = egfr_ckd_epi(
+        np.array([1.0, 0.7, 2.0]), np.array([60.0, 50.0, 70.0]), np.array(["M", "F", "F"])
+    )
+    np.testing.assert_allclose(egfr, [86.16, 105.30, 26.38], atol=0.01)
+
+
+def test_egfr_not_applicable():
+    with np.errstate(divide="ignore"):
+        egfr = egfr_ckd_epi(
+            np.array([1.0, 1.0, 0.0]), np.array([60.0, 16.0, 60.0]), np.array(["all", "M", "M"])
+        )
+    assert np.isnan(egfr).all()
+
+
+def test_egfr_reported_under_ckd_epi_2021_code():
+    assert "98979-8" in DERIVED_TESTS
+    assert "33914-3" not in DERIVED_TESTS
+
+
+def test_derive_vectorized_over_patients():
+    values = {
+        "2093-3": np.array([200.0, 250.0]),
+        "2085-9": np.array([50.0, 40.0]),
+        "2571-8": np.array([150.0, 450.0]),
+        "2951-2": np.array([140.0, np.nan]),
+        "2075-0": np.array([104.0, np.nan]),
+        "2028-9": np.array([24.0, np.nan]),
+        "2000-8": np.array([8.0, np.nan]),
+        "1751-7": np.array([3.0, np.nan]),
+        "1558-6": np.array([100.0, np.nan]),
+        "20448-7": np.array([10.0, np.nan]),
+    }
+    result = derive(values, np.array([50.0, 50.0]), np.array(["M", "F"]))
+
+    np.testing.assert_allclose(result["13457-7"][0], 120.0)
+    # Friedewald does not apply with triglycerides >= 400 mg/dL
+    assert np.isnan(result["13457-7"][1])
+    # Total CO2 stands in for bicarbonate; calcium 2000-8 for 17861-6
+    np.testing.assert_allclose(result["33037-3"][0], 12.0)
+    np.testing.assert_allclose(result["29265-6"][0], 8.8)
+    np.testing.assert_allclose(result["HOMA-IR"][0], 1000.0 / 405.0)
+    assert np.isnan(result["98979-8"]).all()
+
+
+def test_pipeline_derived_records_per_patient():
+    visits = {
+        ("P1", "2024-01-05"): {"age": 60.0, "gender": "M", "values": {"2160-0": 1.0}},
+        ("P2", None): {
+            "age": 50.0,
+            "gender": "F",
+            "values": {"2160-0": 0.7, "2093-3": 220.0, "2085-9": 45.0, "2571-8": 150.0},
+        },
+        ("P3", None): {"age": 40.0, "gender": "all", "values": {"2160-0": 1.0}},
+        # Conflicting duplicate inputs are left out rather than guessed
+        ("P4", None): {"age": 60.0, "gender": "M", "values": {"2160-0": 1.0}, "conflicts": {"2160-0"}},
+    }
+    records = derived_records(visits)
+    summary = [(r["patient_id"], r["derived_code"], r["value"], r["flag"]) for r in records]
+    assert summary == [
+        ("P1", "98979-8", 86.16, "L"),
+        ("P2", "98979-8", 105.3, "N"),
+        ("P2", "13457-7", 145.0, "H"),
+    ]
+    assert all(r["derived"] for r in records)
+    assert [r["date"] for r in records] == ["2024-01-05", None, None]
+    assert derived_records({}) == []
+
+
+@pytest.mark.parametrize("code", sorted(DERIVED_TESTS))
+def test_derived_tests_metadata(code):
+    test = DERIVED_TESTS[code]
+    assert test["unit"] and test["inputs"]
+    assert test["low"] is not None or test["high"] is not None
+    assert test["loinc"] in (code, None)
+
+
+def test_homa_ir_is_not_reported_as_a_loinc_code():
+    assert DERIVED_TESTS["HOMA-IR"]["loinc"] is None
+    records = derived_records(
+        {("P1", None): {"age": 40.0, "gender": "M", "values": {"1558-6": 100.0, "20448-7": 10.0}}}
+    )
+    assert [(r["derived_code"], r["loinc_code"]) for r in records] == [("HOMA-IR", None)]
@@ -0,0 +1,106 @@
+import csv
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from lab_pipeline import iter_chunks, run_pipeline
+from lab_service import LabService
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "interpret_lab_file.py")
+
+FIELDS = ["patient_id", "age", "gender", "loinc_code", "value", "unit", "date"]
+
+ROWS = [
+    # P1: lipid panel and creatinine on one visit
+    ("P1", 60, "M", "2093-3", 220, "mg/dL", "2024-01-05"),
+    ("P1", 60, "M", "2085-9", 45, "mg/dL", "2024-01-05"),
+    ("P1", 60, "M", "2571-8", 150, "mg/dL", "2024-01-05"),
+    ("P1", 60, "M", "2160-0", 88.4, "umol/L", "2024-01-05"),
+    # P2: creatinine and the lipid panel were drawn on different days
+    ("P2", 50, "F", "2160-0", 0.7, "mg/dL", "2024-02-01"),
+    ("P2", 50, "F", "2093-3", 200, "mg/dL", "2024-03-01"),
+    ("P2", 50, "F", "2085-9", 50, "mg/dL", "2024-03-01"),
+    ("P2", 50, "F", "2571-8", 150, "mg/dL", "2024-03-01"),
+    ("P2", 50, "F", "2160-0", 0.9, "mg/dL", "2024-03-01"),
+    # P3: the same test twice on one visit with different results
+    ("P3", 45, "M", "2160-0", 1.0, "mg/dL", "2024-04-01"),
+    ("P3", 45, "M", "2160-0", 1.4, "mg/dL", "2024-04-01"),
+]
+
+
+@pytest.fixture(scope="module")
+def lab_service(tmp_path_factory):
+    return LabService(str(tmp_path_factory.mktemp("lab")))
+
+
+@pytest.fixture
+def input_path(tmp_path):
+    path = tmp_path / "labs.csv"
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+        writer.writerows(ROWS)
+    return str(path)
+
+
+def _run(lab_service, input_path, tmp_path, chunk_size):
+    output_path = str(tmp_path / f"out_{chunk_size}.ndjson")
+    summary = run_pipeline(
+        input_path, output_path, lab_service.data_dir, chunk_size=chunk_size, lab_service=lab_service
+    )
+    with open(output_path, encoding="utf-8") as f:
+        outputs = [json.loads(line) for line in f]
+    return summary, outputs
+
+
+def _derived(outputs):
+    return [o for o in outputs if o.get("derived")]
+
+
+def test_derived_output_does_not_depend_on_chunk_size(lab_service, input_path, tmp_path):
+    small_summary, small = _run(lab_service, input_path, tmp_path, chunk_size=1)
+    large_summary, large = _run(lab_service, input_path, tmp_path, chunk_size=10000)
+
+    assert _derived(small) == _derived(large)
+    assert [o for o in small if not o.get("derived")] == [o for o in large if not o.get("derived")]
+    for key in ("rows", "abnormal", "critical", "errors", "derived"):
+        assert small_summary[key] == large_summary[key]
+    assert small_summary["rows"] == len(ROWS)
+
+
+def test_derived_inputs_are_combined_per_visit(lab_service, input_path, tmp_path):
+    _, outputs = _run(lab_service, input_path, tmp_path, chunk_size=3)
+    derived = [(o["patient_id"], o["date"], o["loinc_code"], o["value"]) for o in _derived(outputs)]
+    assert derived == [
+        ("P1", "2024-01-05", "98979-8", 86.16),
+        ("P1", "2024-01-05", "13457-7", 145.0),
+        ("P2", "2024-02-01", "98979-8", 105.3),
+        # The 2024-03-01 eGFR uses that day's creatinine, not the February one
+        ("P2", "2024-03-01", "98979-8", 77.88),
+        ("P2", "2024-03-01", "13457-7", 120.0),
+    ]
+
+
+def test_chunks_are_cut_only_at_patient_boundaries():
+    rows = [{"patient_id": p} for p in ["A", "A", "A", "B", "C", "C"]] + [{"_error": "bad"}] * 2
+    chunks = [[row.get("patient_id") for row in chunk] for chunk in iter_chunks(iter(rows), 2)]
+    assert chunks == [["A", "A", "A"], ["B", "C", "C"], [None, None]]
+
+
+def test_script_with_spawned_workers_matches_in_process_run(lab_service, input_path, tmp_path):
+    # The server runs bulk jobs through this script in a child process
+    _, expected = _run(lab_service, input_path, tmp_path, chunk_size=2)
+    output_path = str(tmp_path / "script.ndjson")
+    result = subprocess.run(
+        [sys.executable, SCRIPT, input_path, "--output", output_path, "--data-dir", lab_service.data_dir,
+         "--chunk-size", "2", "--workers", "2"],
+        stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    summary = json.loads(result.stderr.strip().splitlines()[-1])
+    assert summary["rows"] == len(ROWS)
+    with open(output_path, encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == expected
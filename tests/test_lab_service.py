@@ -0,0 +1,118 @@
+import json
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from lab_service import BUNDLED_DATA_DIR, LOINC_FTS_TRIGGERS, LabService
+
+
+@pytest.fixture
+def lab_service(tmp_path):
+    return LabService(str(tmp_path))
+
+
+def _codes(service, keyword):
+    return [r["loinc_code"] for r in json.loads(service.search_loinc_code(keyword)).get("results", [])]
+
+
+def _execute(service, sql, params=()):
+    conn = sqlite3.connect(service.db_path)
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+def test_fts_search_sees_rows_written_after_the_build(lab_service):
+    _execute(
+        lab_service,
+        "INSERT INTO loinc_mapping (loinc_code, loinc_name_en, loinc_name_zh) VALUES (?, ?, ?)",
+        ("99999-9", "Zymogen panel", "酵素原檢驗"),
+    )
+    assert _codes(lab_service, "Zymogen") == ["99999-9"]
+
+    _execute(lab_service, "UPDATE loinc_mapping SET loinc_name_en = 'Proenzyme panel' WHERE loinc_code = '99999-9'")
+    assert _codes(lab_service, "Zymogen") == []
+    assert _codes(lab_service, "Proenzyme") == ["99999-9"]
+
+    _execute(lab_service, "DELETE FROM loinc_mapping WHERE loinc_code = '99999-9'")
+    assert _codes(lab_service, "Proenzyme") == []
+
+
+def test_fts_without_triggers_is_rebuilt(lab_service):
+    # Databases built before the sync triggers existed
+    for trigger in LOINC_FTS_TRIGGERS:
+        _execute(lab_service, f"DROP TRIGGER {trigger}")
+    _execute(
+        lab_service,
+        "INSERT INTO loinc_mapping (loinc_code, loinc_name_en, loinc_name_zh) VALUES (?, ?, ?)",
+        ("99999-9", "Zymogen panel", "酵素原檢驗"),
+    )
+    assert _codes(LabService(lab_service.data_dir), "Zymogen") == ["99999-9"]
+
+
+def _make_old_db(service):
+    """A database built before 98979-8 existed, with an FTS index that has no triggers."""
+    for trigger in LOINC_FTS_TRIGGERS:
+        _execute(service, f"DROP TRIGGER {trigger}")
+    _execute(service, "DELETE FROM loinc_mapping WHERE loinc_code = '98979-8'")
+    _execute(service, "DELETE FROM reference_ranges WHERE loinc_code = '98979-8'")
+    _execute(service, "INSERT INTO loinc_mapping_fts(loinc_mapping_fts) VALUES('rebuild')")
+    # Older reference CSV: its recorded mtime no longer matches the file on disk
+    _execute(service, "UPDATE reference_range_files SET mtime = 0")
+
+
+def test_sync_upgrades_an_old_database(lab_service):
+    _make_old_db(lab_service)
+    upgraded = LabService(lab_service.data_dir)
+
+    assert upgraded.get_loinc_by_code("98979-8")["loinc_name_zh"]
+    assert json.loads(upgraded.get_reference_range("98979-8", 40, "M"))["reference_range"]["low"] == 90
+    # The sync itself refreshed the FTS index and restored its triggers
+    conn = sqlite3.connect(upgraded.db_path)
+    triggers = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    conn.close()
+    assert set(LOINC_FTS_TRIGGERS) <= triggers
+    assert _codes(upgraded, "CKD-EPI") == ["98979-8"]
+
+
+def test_sync_adds_new_common_tests_without_reference_changes(tmp_path):
+    for name in ("lab_tests.csv", "lab_reference_ranges.csv"):
+        shutil.copy(os.path.join(BUNDLED_DATA_DIR, name), tmp_path / name)
+    service = LabService(str(tmp_path))
+    assert service.get_loinc_by_code("99999-9") is None
+
+    with open(tmp_path / "lab_tests.csv", "a", encoding="utf-8") as f:
+        f.write("99999-9,Zymogen panel,酵素原檢驗,,化學,血清,U/L,\n")
+    upgraded = LabService(str(tmp_path))
+    assert upgraded.get_loinc_by_code("99999-9")["loinc_name_zh"] == "酵素原檢驗"
+    assert _codes(upgraded, "Zymogen") == ["99999-9"]
+
+
+def test_sync_invalidates_the_cached_reference_index(lab_service):
+    index = lab_service._get_reference_index()
+    _execute(lab_service, "UPDATE reference_range_files SET mtime = 0")
+    lab_service._sync_reference_ranges()
+    assert lab_service._get_reference_index() is not index
+
+
+def test_find_critical_results_reports_skipped_items(lab_service):
+    results = [
+        {"loinc_code": "2823-3", "value": 6.8, "patient_id": "P1"},
+        {"loinc_code": "2823-3", "value": "high"},
+        {"loinc_code": "2823-3", "value": 6.8, "age": None},
+        {"loinc_code": "0000-0", "value": 1.0},
+        {"loinc_code": "2093-3", "value": 500.0},
+        {"loinc_code": "2823-3", "value": 6.8, "unit": "%"},
+    ]
+    report = json.loads(lab_service.find_critical_results(results, age=60))
+    assert [r["index"] for r in report["results"]] == [0]
+
+    reasons = {s["index"]: s["reason"] for s in report["skipped"]}
+    assert report["skipped_count"] == 5
+    assert reasons[1] == "value 不是數值"
+    assert reasons[2] == "未提供年齡"
+    assert reasons[3] == "找不到 LOINC 碼: 0000-0"
+    assert "危急值" in reasons[4]
+    assert reasons[5].startswith("無法將單位 %")
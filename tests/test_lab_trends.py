@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from lab_trends import (
+    analyze_series,
+    delta_checks,
+    format_day,
+    parse_timestamp,
+    percent_change,
+    round_or_none,
+    trend_direction,
+)
+
+
+def test_parse_timestamp_formats():
+    assert parse_timestamp("1970-01-02") == pytest.approx(1.0)
+    assert parse_timestamp("1970/01/03") == pytest.approx(2.0)
+    assert parse_timestamp("1970-01-02T12:00:00Z") == pytest.approx(1.5)
+    assert parse_timestamp("1970-01-02T08:00:00+08:00") == pytest.approx(1.0)
+    assert parse_timestamp(86400) == pytest.approx(1.0)
+    assert parse_timestamp("not a date") is None
+    assert parse_timestamp(None) is None
+    assert parse_timestamp(True) is None
+
+
+def test_format_day():
+    assert format_day(parse_timestamp("2024-02-29")) == "2024-02-29"
+
+
+def test_analyze_series_sorts_and_fits_each_series():
+    # Series 0: y = 2 + 0.5 t (given out of order); series 1: a single point
+    ids = np.array([0, 1, 0, 0])
+    days = np.array([10.0, 5.0, 0.0, 4.0])
+    values = np.array([7.0, 3.0, 2.0, 4.0])
+    stats = analyze_series(ids, days, values)
+
+    np.testing.assert_array_equal(stats["series"], [0, 1])
+    np.testing.assert_array_equal(stats["count"], [3, 1])
+    np.testing.assert_allclose(stats["first"], [2.0, 3.0])
+    np.testing.assert_allclose(stats["last"], [7.0, 3.0])
+    np.testing.assert_allclose(stats["previous"][0], 4.0)
+    assert np.isnan(stats["previous"][1])
+    np.testing.assert_allclose(stats["slope_per_day"][0], 0.5)
+    assert np.isnan(stats["slope_per_day"][1])
+    np.testing.assert_allclose(stats["span_days"], [10.0, 0.0])
+    np.testing.assert_allclose(stats["mean"], [13.0 / 3, 3.0])
+    np.testing.assert_allclose(stats["min"], [2.0, 3.0])
+    np.testing.assert_allclose(stats["max"], [7.0, 3.0])
+
+
+def test_delta_checks_flag_only_within_a_series():
+    ids = np.array([0, 0, 0, 1])
+    values = np.array([1.0, 1.2, 2.0, 10.0])
+    absolute = np.full(4, 0.3)
+    percent = np.full(4, np.nan)
+    hits = delta_checks(ids, values, absolute, percent)
+    np.testing.assert_array_equal(hits["index"], [2])
+    np.testing.assert_allclose(hits["delta"], [0.8])
+    np.testing.assert_allclose(hits["percent_change"], [0.8 / 1.2 * 100])
+
+
+def test_delta_checks_percent_threshold_and_short_input():
+    hits = delta_checks(
+        np.array([0, 0]), np.array([100.0, 160.0]), np.full(2, np.nan), np.full(2, 50.0)
+    )
+    np.testing.assert_array_equal(hits["index"], [1])
+    empty = delta_checks(np.array([0]), np.array([1.0]), np.array([0.1]), np.array([1.0]))
+    assert len(empty["index"]) == 0
+
+
+def test_percent_change_and_rounding():
+    np.testing.assert_allclose(percent_change(np.array([2.0, -4.0]), np.array([3.0, -2.0])), [50.0, 50.0])
+    assert np.isnan(percent_change(np.array([0.0]), np.array([1.0]))[0])
+    assert round_or_none(np.nan) is None
+    assert round_or_none(1.234567, 2) == 1.23
+
+
+def test_trend_direction_labels():
+    labels = trend_direction(
+        np.array([0.1, -0.1, 0.001, np.nan]),
+        np.array([100.0, 100.0, 100.0, 0.0]),
+        np.array([50.0, 50.0, 50.0, 50.0]),
+    )
+    assert labels == ["上升", "下降", "穩定", None]
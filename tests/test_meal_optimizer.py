@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from meal_optimizer import (
+    STATUS_ITERATION_LIMIT,
+    STATUS_OPTIMAL,
+    STATUS_TIME_LIMIT,
+    evaluate_targets,
+    solve_portions,
+)
+
+NAN = np.nan
+
+
+def test_meets_lower_bound_with_the_densest_food():
+    # min x_a + x_b  s.t.  10 x_a + 5 x_b >= 20  ->  x = (2, 0)
+    solution = solve_portions(
+        np.array([[10.0, 5.0]]), np.array([20.0]), np.array([NAN]), np.array([5.0, 5.0])
+    )
+    assert solution["status"] == STATUS_OPTIMAL
+    np.testing.assert_allclose(solution["units"], [2.0, 0.0], atol=1e-9)
+
+
+def test_upper_bound_forces_a_mix():
+    # protein: 20 x_a + 10 x_b >= 30, sodium: 400 x_a <= 400  ->  x = (1, 1)
+    nutrients = np.array([[20.0, 10.0], [400.0, 0.0]])
+    solution = solve_portions(
+        nutrients, np.array([30.0, NAN]), np.array([NAN, 400.0]), np.array([3.0, 3.0])
+    )
+    assert solution["status"] == STATUS_OPTIMAL
+    np.testing.assert_allclose(solution["units"], [1.0, 1.0], atol=1e-9)
+    totals = nutrients @ solution["units"]
+    assert evaluate_targets(totals, np.array([30.0, NAN]), np.array([NAN, 400.0])) == [True, True]
+
+
+def test_portion_cap_is_respected():
+    # 10 x_a + 5 x_b >= 20 with x_a <= 1  ->  x = (1, 2)
+    solution = solve_portions(
+        np.array([[10.0, 5.0]]), np.array([20.0]), np.array([NAN]), np.array([1.0, 5.0])
+    )
+    np.testing.assert_allclose(solution["units"], [1.0, 2.0], atol=1e-9)
+
+
+def test_conflicting_targets_return_closest_plan():
+    # Only one food; the target needs 4 units but at most 1 is allowed
+    solution = solve_portions(
+        np.array([[5.0]]), np.array([20.0]), np.array([NAN]), np.array([1.0])
+    )
+    assert solution["status"] == STATUS_OPTIMAL
+    np.testing.assert_allclose(solution["units"], [1.0])
+
+
+def test_iteration_and_time_limits():
+    args = (np.array([[10.0, 5.0]]), np.array([20.0]), np.array([NAN]), np.array([5.0, 5.0]))
+    assert solve_portions(*args, max_iterations=0)["status"] == STATUS_ITERATION_LIMIT
+    assert solve_portions(*args, time_budget=-1.0)["status"] == STATUS_TIME_LIMIT
+
+
+def test_evaluate_targets_tolerance():
+    met = evaluate_targets(
+        np.array([99.5, 101.5, 50.0]),
+        np.array([100.0, NAN, NAN]),
+        np.array([NAN, 100.0, NAN]),
+    )
+    assert met == [True, False, True]
+
+
+@pytest.mark.parametrize("lower", [0.0, 30.0])
+def test_units_never_negative(lower):
+    solution = solve_portions(
+        np.array([[10.0, 20.0]]), np.array([lower]), np.array([60.0]), np.array([2.0, 2.0])
+    )
+    assert (solution["units"] >= 0).all()
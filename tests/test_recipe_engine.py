@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from recipe_engine import compute_recipes, parse_quantity, parse_servings, to_grams
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("150g", (150.0, "g")),
+        ("2 碗", (2.0, "碗")),
+        ("1/2 杯", (0.5, "杯")),
+        ("3個", (3.0, "個")),
+        ("1.5 TBSP", (1.5, "tbsp")),
+        (80, (80.0, "g")),
+        ("200", (200.0, "g")),
+    ],
+)
+def test_parse_quantity(text, expected):
+    assert parse_quantity(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", None, "some", "g150", "1/0 杯"])
+def test_parse_quantity_invalid(text):
+    assert parse_quantity(text) is None
+
+
+def test_to_grams_units():
+    assert to_grams(2, "碗", None) == (400.0, False)
+    assert to_grams(1, "台斤", None) == (600.0, False)
+    assert to_grams(3, "個", 50.0) == (150.0, True)
+    # Count units need the food's unit weight
+    assert to_grams(3, "個", None) is None
+    assert to_grams(1, "handful", 50.0) is None
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [(None, 1.0), ("", 1.0), (2, 2.0), ("3", 3.0), (" 1.5 ", 1.5)],
+)
+def test_parse_servings(value, expected):
+    assert parse_servings(value) == expected
+
+
+@pytest.mark.parametrize("value", ["two", [2], 0, -1, True, float("nan"), "inf"])
+def test_parse_servings_invalid(value):
+    assert parse_servings(value) is None
+
+
+def test_compute_recipes_totals_and_missing():
+    # 2 foods x 2 nutrients per 100 g; food 1 lacks nutrient 1
+    values = np.array([[100.0, 10.0], [50.0, np.nan]])
+    totals, missing = compute_recipes(
+        values,
+        food_idx=np.array([0, 1, 1]),
+        edible_grams=np.array([200.0, 100.0, 50.0]),
+        recipe_ids=np.array([0, 0, 2]),
+        n_recipes=3,
+    )
+    np.testing.assert_allclose(totals, [[250.0, 20.0], [0.0, 0.0], [25.0, 0.0]])
+    np.testing.assert_array_equal(missing, [[0, 1], [0, 0], [0, 1]])
+
+
+def test_compute_recipes_without_ingredients():
+    totals, missing = compute_recipes(
+        np.ones((1, 3)), np.array([], dtype=int), np.array([]), np.array([], dtype=int), 2
+    )
+    assert totals.shape == (2, 3) and not totals.any() and not missing.any()
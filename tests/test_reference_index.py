@@ -0,0 +1,85 @@
+from reference_index import ReferenceRangeIndex
+
+
+def _range(code, age_min, age_max, gender, low, high, **extra):
+    return {
+        "loinc_code": code,
+        "age_min": age_min,
+        "age_max": age_max,
+        "gender": gender,
+        "range_low": low,
+        "range_high": high,
+        "unit": "g/dL",
+        **extra,
+    }
+
+
+TESTS = [{"loinc_code": "718-7", "loinc_name_zh": "血紅素"}]
+RANGES = [
+    _range("718-7", 0, 120, "all", 11.0, 16.0),
+    _range("718-7", 18, 120, "M", 13.5, 17.5),
+    _range("718-7", 18, 120, "F", 12.0, 16.0),
+    _range("718-7", 65, 120, "M", 12.5, 17.0),
+    _range("718-7", None, None, "M", 0.0, 99.0),
+    _range("718-7", 18, 120, "M", 14.0, 18.0, source="醫院A", is_default=0),
+]
+
+
+def make_index(**kwargs):
+    return ReferenceRangeIndex(TESTS, RANGES, **kwargs)
+
+
+def test_gender_specific_range_preferred():
+    assert make_index().lookup("718-7", 40, "F")["range_low"] == 12.0
+
+
+def test_falls_back_to_all_gender():
+    assert make_index().lookup("718-7", 10, "M")["range_low"] == 11.0
+    assert make_index().lookup("718-7", 40, "all")["range_low"] == 11.0
+
+
+def test_largest_applicable_age_min_wins():
+    index = make_index()
+    assert index.lookup("718-7", 70, "M")["range_low"] == 12.5
+    assert index.lookup("718-7", 64, "M")["range_low"] == 13.5
+
+
+def test_unknown_code_and_age_outside_ranges():
+    index = make_index()
+    assert index.lookup("2345-7", 40, "M") is None
+    assert index.lookup("718-7", 130, "F") is None
+
+
+def test_rows_without_age_bounds_are_ignored():
+    assert len(make_index()) == 4
+
+
+def test_source_lookup_and_default_fallback():
+    index = make_index()
+    assert index.sources == ["醫院A"]
+    assert index.lookup("718-7", 40, "M", source="醫院A")["range_low"] == 14.0
+    # The source has no female range, so the default applies
+    assert index.lookup("718-7", 40, "F", source="醫院A")["range_low"] == 12.0
+    assert index.lookup("718-7", 40, "M", source="unknown")["range_low"] == 13.5
+
+
+def test_critical_lookup():
+    critical = [
+        {
+            "loinc_code": "718-7",
+            "age_min": 0,
+            "age_max": 120,
+            "gender": "all",
+            "critical_low": 7.0,
+            "critical_high": 20.0,
+        }
+    ]
+    index = make_index(critical=critical)
+    assert index.lookup_critical("718-7", 50, "M")["critical_low"] == 7.0
+    assert make_index().lookup_critical("718-7", 50, "M") is None
+
+
+def test_get_test():
+    index = make_index()
+    assert index.get_test("718-7")["loinc_name_zh"] == "血紅素"
+    assert index.get_test("0000-0") is None
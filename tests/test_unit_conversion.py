@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from unit_conversion import compile_conversion, convert_values, normalize_unit, parse_unit
+
+
+def test_normalize_unit():
+    assert normalize_unit(" µmol/L ") == "umol/l"
+    assert normalize_unit("10×3/μL") == "10*3/ul"
+    assert normalize_unit("mcg/dL") == "ug/dl"
+
+
+def test_parse_unit_dimensions_and_factor():
+    assert parse_unit("mg/dL") == ((("mass", 1), ("volume", -1)), pytest.approx(0.01))
+    assert parse_unit("10^3/uL") == ((("count", 1), ("volume", -1)), pytest.approx(1e9))
+    assert parse_unit("furlongs") is None
+
+
+def test_glucose_mg_dl_to_mmol_l_uses_molar_mass():
+    scale, offset = compile_conversion("2345-7", "mg/dL", "mmol/L")
+    assert scale == pytest.approx(1 / 18.016)
+    assert offset == 0.0
+    assert 180.16 * scale == pytest.approx(10.0)
+
+
+def test_glucose_mmol_l_to_mg_dl():
+    scale, _ = compile_conversion("1558-6", "mmol/L", "mg/dL")
+    assert scale == pytest.approx(18.016)
+
+
+def test_creatinine_umol_l_to_mg_dl():
+    scale, _ = compile_conversion("2160-0", "umol/L", "mg/dL")
+    assert 88.4 * scale == pytest.approx(1.0, abs=1e-3)
+
+
+def test_calcium_mmol_l_to_mg_dl():
+    scale, _ = compile_conversion("17861-6", "mmol/L", "mg/dL")
+    assert 2.5 * scale == pytest.approx(10.02, abs=1e-2)
+
+
+def test_monovalent_meq_equals_mmol():
+    assert compile_conversion("2951-2", "mEq/L", "mmol/L") == (pytest.approx(1.0), 0.0)
+
+
+def test_same_dimension_conversions():
+    assert compile_conversion("777-3", "K/uL", "10^3/uL") == (pytest.approx(1.0), 0.0)
+    assert compile_conversion("1751-7", "g/L", "g/dL") == (pytest.approx(0.1), 0.0)
+    assert compile_conversion("718-7", "g/dL", "G/DL") == (1.0, 0.0)
+
+
+def test_hba1c_ngsp_ifcc_affine_round_trip():
+    to_ifcc = compile_conversion("4548-4", "%", "mmol/mol")
+    to_ngsp = compile_conversion("4548-4", "mmol/mol", "%")
+    ifcc = 7.0 * to_ifcc[0] + to_ifcc[1]
+    assert ifcc == pytest.approx(53.0, abs=0.1)
+    assert ifcc * to_ngsp[0] + to_ngsp[1] == pytest.approx(7.0)
+
+
+@pytest.mark.parametrize("code", ["2345-7", "718-7", None])
+def test_percent_mmol_per_mol_only_converts_hba1c(code):
+    assert compile_conversion(code, "%", "mmol/mol") is None
+    assert compile_conversion(code, "mmol/mol", " % ") is None
+
+
+def test_incompatible_units_return_none():
+    assert compile_conversion("718-7", "g/dL", "10^3/uL") is None
+    # Mass <-> amount needs a molar mass for the analyte
+    assert compile_conversion("6690-2", "mg/dL", "mmol/L") is None
+    assert compile_conversion("2345-7", "mg/dL", "bogus") is None
+
+
+def test_convert_values_applies_scale_and_offset():
+    result = convert_values(np.array([1.0, 2.0]), np.array([2.0, 10.0]), np.array([0.0, -1.0]))
+    np.testing.assert_allclose(result, [2.0, 19.0])